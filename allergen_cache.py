@@ -0,0 +1,57 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Generic, TypeVar
+
+# Ensembles d'allergies distincts gardés en mémoire par catalogue (les moins récemment utilisés sont évincés)
+ALLERGEN_CACHE_SIZE = int(os.getenv("ALLERGEN_CACHE_SIZE", 64))
+
+T = TypeVar("T")
+
+class AllergenSafeCache(Generic[T]):
+    """Cache LRU borné de tableaux pré-filtrés par ensemble d'allergies.
+
+    La clé est le masque d'allergènes (allergen_mask) : la forme canonique
+    de l'ensemble, indépendante de l'ordre, de la casse et des accents.
+    La plupart des utilisateurs partagent quelques profils (aucun,
+    Lactose, Gluten...), qui restent en cache ; le propriétaire vide le
+    cache dès que le catalogue change, ou y range la version du catalogue
+    avec chaque tableau pour écarter les entrées périmées à la lecture.
+    """
+
+    def __init__(self, build: Callable[[int], T], maxsize: int = ALLERGEN_CACHE_SIZE):
+        self.build = build
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, T]" = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, mask: int) -> T:
+        mask = int(mask)
+        with self._lock:
+            if mask in self._entries:
+                self._entries.move_to_end(mask)
+                self.hits += 1
+                return self._entries[mask]
+            generation = self._generation
+        value = self.build(mask)
+        with self._lock:
+            self.misses += 1
+            # Catalogue modifié pendant le calcul : ne pas garder un tableau périmé
+            if generation != self._generation:
+                return value
+            self._entries[mask] = value
+            self._entries.move_to_end(mask)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
@@ -0,0 +1,35 @@
+import zlib
+from typing import Iterable, Optional
+from text_utils import normalize_text
+
+# Allergènes à déclaration obligatoire : un bit réservé chacun
+ALLERGENES_CONNUS = [
+    "Gluten", "Lactose", "Oeufs", "Arachides", "Fruits à coque", "Poisson", "Crustacés",
+    "Mollusques", "Soja", "Céleri", "Moutarde", "Sésame", "Sulfites", "Lupin",
+]
+# Les autres allergènes sont hachés sur les bits restants d'un BIGINT signé (bits 14 à 62).
+# Une collision ne peut qu'exclure un aliment de trop, jamais laisser passer un allergène.
+_PREMIER_BIT_HACHE = len(ALLERGENES_CONNUS)
+_NB_BITS_HACHES = 63 - _PREMIER_BIT_HACHE
+
+def _cle(allergene: str) -> str:
+    # Singulier approximatif : « Oeuf » et « Oeufs » partagent le même bit
+    return " ".join(mot[:-1] if mot.endswith("s") and len(mot) > 3 else mot for mot in normalize_text(allergene).split())
+
+_BITS_CONNUS = {_cle(nom): bit for bit, nom in enumerate(ALLERGENES_CONNUS)}
+
+def allergen_bit(allergene: str) -> int:
+    """Position du bit associé à un allergène"""
+    cle = _cle(allergene)
+    bit = _BITS_CONNUS.get(cle)
+    if bit is None:
+        bit = _PREMIER_BIT_HACHE + zlib.crc32(cle.encode("utf-8")) % _NB_BITS_HACHES
+    return bit
+
+def allergen_mask(allergenes: Optional[Iterable[str]]) -> int:
+    """Encoder une liste d'allergènes en masque de bits (0 si aucun)"""
+    mask = 0
+    for allergene in allergenes or []:
+        if allergene and allergene.strip():
+            mask |= 1 << allergen_bit(allergene)
+    return mask
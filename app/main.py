@@ -2,7 +2,7 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
 from app.database import create_db_and_tables
-from app.routers import foods
+from app.routers import foods, recommendations, users
 from app.schemas import HealthCheck
 
 # Créer l'application FastAPI
@@ -25,6 +25,8 @@ app.add_middleware(
 
 # Inclure les routers
 app.include_router(foods.router, prefix="/api/v1")
+app.include_router(recommendations.router, prefix="/api/v1")
+app.include_router(users.router, prefix="/api/v1")
 
 # Endpoint de santé
 @app.get("/health", response_model=HealthCheck, tags=["health"])
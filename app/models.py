@@ -2,7 +2,7 @@ from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List
 from datetime import datetime
 
-from sqlalchemy import Column, JSON
+from sqlalchemy import Column, Index, JSON
 
 class UserBase(SQLModel):
     name: str
@@ -63,6 +63,11 @@ class Recommendation(RecommendationBase, table=True):
     user: User = Relationship(back_populates="recommendations")
     food: Food = Relationship(back_populates="recommendations")
 
+# Lecture des recommandations d'un utilisateur déjà triées : WHERE user_id = ? ORDER BY score DESC LIMIT n
+Index("ix_recommendation_user_score", Recommendation.user_id, Recommendation.score.desc())
+# Invalidation des recommandations d'un aliment modifié ou supprimé
+Index("ix_recommendation_food", Recommendation.food_id)
+
 class RecommendationCreate(RecommendationBase):
     pass
 
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlmodel import Session
-from typing import List
+from typing import List, Optional
 from app.database import get_session
 from app.services.food_service import FoodService
-from app.schemas import FoodCreate, FoodRead, FoodUpdate
+from app.services.nutrition_service import NutritionService
+from app.schemas import FoodCreate, FoodGoalRequest, FoodMatch, FoodRead, FoodScore, FoodUpdate
 
 router = APIRouter(prefix="/foods", tags=["foods"])
 
@@ -19,6 +20,47 @@ def get_foods(skip: int = 0, limit: int = 100, session: Session = Depends(get_se
     food_service = FoodService(session)
     return food_service.get_foods(skip=skip, limit=limit)
 
+@router.get("/closest", response_model=List[FoodMatch])
+def get_closest_foods(
+    calories: Optional[float] = Query(None, ge=0),
+    proteins: Optional[float] = Query(None, ge=0),
+    carbohydrates: Optional[float] = Query(None, ge=0),
+    fats: Optional[float] = Query(None, ge=0),
+    fiber: Optional[float] = Query(None, ge=0),
+    category: Optional[List[str]] = Query(None, description="Catégories autorisées (répétable)"),
+    k: int = Query(10, ge=1, le=100),
+    session: Session = Depends(get_session),
+):
+    """Aliments les plus proches de valeurs nutritionnelles cibles"""
+    targets = {"calories": calories, "proteins": proteins, "carbohydrates": carbohydrates, "fats": fats, "fiber": fiber}
+    if all(value is None for value in targets.values()):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Au moins un nutriment cible est requis"
+        )
+    return NutritionService(session).closest_foods(targets, k=k, categories=category)
+
+@router.post("/score", response_model=List[FoodScore])
+def score_foods(request: FoodGoalRequest, session: Session = Depends(get_session)):
+    """Classer les aliments selon des objectifs nutritionnels pondérés (ex. riche en protéines, < 10 g de lipides)"""
+    return NutritionService(session).score_foods(request.goals, k=request.k, categories=request.categories)
+
+@router.get("/similar/{food_id}", response_model=List[FoodMatch])
+def get_similar_foods(
+    food_id: int,
+    category: Optional[List[str]] = Query(None, description="Catégories autorisées (répétable)"),
+    k: int = Query(10, ge=1, le=100),
+    session: Session = Depends(get_session),
+):
+    """Aliments au profil nutritionnel le plus proche d'un aliment"""
+    foods = NutritionService(session).similar_foods(food_id, k=k, categories=category)
+    if foods is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Aliment non trouvé"
+        )
+    return foods
+
 @router.get("/{food_id}", response_model=FoodRead)
 def get_food(food_id: int, session: Session = Depends(get_session)):
     """Récupérer un aliment par son ID"""
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlmodel import Session
+from typing import List
+from app.database import get_session
+from app.models import User
+from app.services.recommendation_service import RecommendationService
+from app.schemas import RecommendationRead
+
+router = APIRouter(prefix="/recommendations", tags=["recommendations"])
+
+@router.get("/users/{user_id}", response_model=List[RecommendationRead])
+def get_user_recommendations(user_id: int, limit: int = Query(10, ge=1, le=100), session: Session = Depends(get_session)):
+    """Recommandations précalculées d'un utilisateur, par score décroissant"""
+    return RecommendationService(session).get_recommendations(user_id, limit)
+
+@router.post("/users/{user_id}/refresh", response_model=List[RecommendationRead])
+def refresh_user_recommendations(user_id: int, session: Session = Depends(get_session)):
+    """Recalculer les recommandations d'un utilisateur (après modification de ses allergies)"""
+    if not session.get(User, user_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Utilisateur non trouvé"
+        )
+    service = RecommendationService(session)
+    service.refresh_users([user_id])
+    return service.get_recommendations(user_id)
+
+@router.post("/refresh")
+def refresh_all_recommendations(session: Session = Depends(get_session)):
+    """Recalculer les recommandations de tous les utilisateurs (traitement par lots)"""
+    return RecommendationService(session).refresh_all()
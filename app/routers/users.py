@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlmodel import Session
+from app.database import get_session
+from app.services.user_service import UserService
+from app.schemas import UserRead, UserUpdate
+
+router = APIRouter(prefix="/users", tags=["users"])
+
+@router.patch("/{user_id}", response_model=UserRead)
+def update_user(user_id: int, user: UserUpdate, session: Session = Depends(get_session)):
+    """Modifier un utilisateur (ses recommandations sont recalculées si ses allergies changent)"""
+    updated = UserService(session).update_user(user_id, user.dict(exclude_unset=True))
+    if not updated:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Utilisateur non trouvé"
+        )
+    return updated
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List
 from datetime import datetime
 
@@ -64,6 +64,23 @@ class FoodUpdate(BaseModel):
     vitamins: Optional[List[str]] = None
     minerals: Optional[List[str]] = None
 
+class FoodMatch(FoodRead):
+    distance: float  # distance euclidienne entre profils standardisés
+
+class NutrientGoal(BaseModel):
+    nutrient: str = Field(..., pattern="^(calories|proteins|carbohydrates|fats|fiber)$")
+    weight: float = 0.0  # > 0 : plus c'est élevé, mieux c'est ; < 0 : l'inverse
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+class FoodGoalRequest(BaseModel):
+    goals: List[NutrientGoal] = Field(..., min_length=1)
+    categories: Optional[List[str]] = None
+    k: int = Field(10, ge=1, le=100)
+
+class FoodScore(FoodRead):
+    score: float  # somme pondérée des valeurs standardisées
+
 # Schémas pour les recommandations
 class RecommendationCreate(BaseModel):
     user_id: int
@@ -2,6 +2,8 @@ from sqlmodel import Session, select
 from typing import List, Optional
 from app.models import Food, FoodCreate, FoodRead
 from app.schemas import FoodCreate as FoodCreateSchema, FoodRead as FoodReadSchema
+from app.services.nutrition_service import NutritionService
+from app.services.recommendation_service import RecommendationService
 
 class FoodService:
     def __init__(self, session: Session):
@@ -12,6 +14,8 @@ class FoodService:
         self.session.add(food)
         self.session.commit()
         self.session.refresh(food)
+        NutritionService(self.session).on_food_changed(food)
+        RecommendationService(self.session).on_food_changed(food.id)
         
         # Convertir en schéma de réponse
         return FoodReadSchema(
@@ -81,6 +85,8 @@ class FoodService:
         self.session.add(food)
         self.session.commit()
         self.session.refresh(food)
+        NutritionService(self.session).on_food_changed(food)
+        RecommendationService(self.session).on_food_changed(food.id)
         
         return FoodReadSchema(
             id=food.id,
@@ -101,6 +107,10 @@ class FoodService:
         if not food:
             return False
         
+        recommendations = RecommendationService(self.session)
+        user_ids = recommendations.on_food_deleted(food_id)
         self.session.delete(food)
         self.session.commit()
+        NutritionService(self.session).on_food_deleted(food_id)
+        recommendations.refresh_users(user_ids)
         return True 
\ No newline at end of file
@@ -0,0 +1,219 @@
+import threading
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+NUTRIENTS = ("calories", "proteins", "carbohydrates", "fats", "fiber")
+
+class Goal(NamedTuple):
+    """Objectif sur un nutriment : poids du score (positif : plus c'est élevé,
+    mieux c'est) et bornes strictes sur la valeur brute"""
+    weight: float = 0.0
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+class NutrientIndex:
+    """Matrice nutritionnelle standardisée pour la recherche de profils proches.
+
+    Une colonne par aliment, une ligne contiguë par nutriment (NUTRIENTS),
+    centrée et réduite avec les moyennes et écarts-types du catalogue au moment de
+    la construction : une différence de calories pèse autant qu'une
+    différence de protéines d'un même nombre d'écarts-types. La distance
+    euclidienne à une cible est calculée pour toutes les lignes en une
+    opération vectorisée, sur les seules colonnes renseignées dans la
+    cible et, si des catégories sont demandées, sur les seules lignes de
+    ces catégories (listes de lignes par catégorie tenues à jour).
+    Les valeurs brutes sont gardées dans une matrice de même forme pour
+    les bornes des objectifs nutritionnels (`score`).
+    """
+
+    def __init__(self, nutrients: Sequence[str] = NUTRIENTS):
+        self.nutrients = tuple(nutrients)
+        self._lock = threading.RLock()
+        self.build([], np.zeros((0, len(self.nutrients))), [])
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, food_id: int) -> bool:
+        return int(food_id) in self._positions
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def signature(self) -> Tuple[int, Optional[int]]:
+        """(nombre d'aliments, id maximal), comparable à la même mesure en base"""
+        with self._lock:
+            return self._size, int(self.ids.max()) if self._size else None
+
+    def drift(self) -> float:
+        """Écart des statistiques actuelles à celles de la construction : plus grand décalage
+        de moyenne (en écarts-types de construction) ou variation relative d'écart-type.
+        Infini si la matrice a été construite vide et a reçu des aliments depuis."""
+        with self._lock:
+            if not self._size:
+                return 0.0
+            if not self._built_size:
+                return float("inf")
+            raw = self._raw[:, :self._size].astype(np.float64)
+            std = raw.std(axis=1)
+            shift = np.abs(raw.mean(axis=1) - self.mean) / self.std
+            spread = np.abs(np.where(std > 0, std, 1.0) / self.std - 1)
+            return float(max(shift.max(), spread.max()))
+
+    def build(self, ids: Iterable[int], values, categories: Iterable[str]) -> None:
+        """Reconstruire la matrice à partir des valeurs brutes (n, len(nutrients))"""
+        ids = np.asarray(list(ids), dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64).reshape(len(ids), len(self.nutrients))
+        with self._lock:
+            self.mean = values.mean(axis=0) if len(ids) else np.zeros(len(self.nutrients))
+            std = values.std(axis=0) if len(ids) else np.ones(len(self.nutrients))
+            self.std = np.where(std > 0, std, 1.0)
+            self._matrix = np.ascontiguousarray(self.standardize(values).T, dtype=np.float32)
+            self._raw = np.ascontiguousarray(values.T, dtype=np.float32)
+            self._ids = ids
+            self._categories = list(categories)
+            self._positions = {int(food_id): row for row, food_id in enumerate(ids)}
+            self._size = len(ids)
+            self._built_size = len(ids)
+            self._rows_by_category: Optional[Dict[str, np.ndarray]] = None
+
+    def standardize(self, values) -> np.ndarray:
+        return (np.asarray(values, dtype=np.float64) - self.mean) / self.std
+
+    def upsert(self, food_id: int, values: Sequence[float], category: str) -> None:
+        """Ajouter ou remplacer un aliment (standardisé avec les statistiques existantes)"""
+        food_id = int(food_id)
+        row_values = self.standardize(values).astype(np.float32)
+        with self._lock:
+            row = self._positions.get(food_id)
+            if row is None:
+                if self._size == self._matrix.shape[1]:
+                    capacity = max(16, 2 * self._size)
+                    matrix = np.zeros((len(self.nutrients), capacity), dtype=np.float32)
+                    raw = np.zeros((len(self.nutrients), capacity), dtype=np.float32)
+                    ids = np.zeros(capacity, dtype=np.int64)
+                    matrix[:, :self._size], ids[:self._size] = self._matrix[:, :self._size], self._ids[:self._size]
+                    raw[:, :self._size] = self._raw[:, :self._size]
+                    self._matrix, self._raw, self._ids = matrix, raw, ids
+                row = self._size
+                self._ids[row] = food_id
+                self._positions[food_id] = row
+                self._categories.append(category)
+                self._size += 1
+            else:
+                self._categories[row] = category
+            self._matrix[:, row] = row_values
+            self._raw[:, row] = values
+            self._rows_by_category = None
+
+    def remove(self, food_id: int) -> bool:
+        """Retirer un aliment (la dernière ligne prend sa place)"""
+        with self._lock:
+            row = self._positions.pop(int(food_id), None)
+            if row is None:
+                return False
+            last = self._size - 1
+            if row != last:
+                self._matrix[:, row] = self._matrix[:, last]
+                self._raw[:, row] = self._raw[:, last]
+                self._ids[row] = self._ids[last]
+                self._categories[row] = self._categories[last]
+                self._positions[int(self._ids[row])] = row
+            self._categories.pop()
+            self._size = last
+            self._rows_by_category = None
+            return True
+
+    def _rows_for(self, categories: Optional[Iterable[str]]) -> Optional[np.ndarray]:
+        if not categories:
+            return None
+        if self._rows_by_category is None:
+            order = sorted(range(self._size), key=self._categories.__getitem__)
+            groups: Dict[str, List[int]] = {}
+            for row in order:
+                groups.setdefault(self._categories[row], []).append(row)
+            self._rows_by_category = {name: np.asarray(rows, dtype=np.int64) for name, rows in groups.items()}
+        rows = [self._rows_by_category[c] for c in categories if c in self._rows_by_category]
+        return np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+
+    def nearest(self, target: Mapping[str, float], k: int = 10, categories: Optional[Iterable[str]] = None,
+                exclude: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, distances) des k aliments les plus proches d'une cible de valeurs brutes.
+
+        Seuls les nutriments présents dans `target` comptent dans la distance.
+        """
+        columns = [i for i, name in enumerate(self.nutrients) if target.get(name) is not None]
+        if not columns:
+            raise ValueError("Au moins un nutriment cible est requis")
+        point = (np.array([target[self.nutrients[i]] for i in columns]) - self.mean[columns]) / self.std[columns]
+        with self._lock:
+            rows = self._rows_for(categories)
+            distances, buffer = None, None
+            for column, value in zip(columns, point.astype(np.float32)):
+                values = self._matrix[column, :self._size] if rows is None else self._matrix[column, rows]
+                if distances is None:
+                    distances = np.subtract(values, value)
+                    np.square(distances, out=distances)
+                else:
+                    buffer = np.subtract(values, value, out=buffer)
+                    np.square(buffer, out=buffer)
+                    distances += buffer
+            if exclude is not None and int(exclude) in self._positions:
+                own = self._positions[int(exclude)]
+                if rows is None:
+                    distances[own] = np.inf
+                else:
+                    distances[rows == own] = np.inf
+            n = min(k, int(np.isfinite(distances).sum()))
+            if n <= 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            best = np.argpartition(distances, n - 1)[:n] if n < len(distances) else np.arange(len(distances))
+            best = best[np.argsort(distances[best], kind="stable")]
+            positions = best if rows is None else rows[best]
+            return self._ids[positions].copy(), np.sqrt(distances[best])
+
+    def similar_to(self, food_id: int, k: int = 10, categories: Optional[Iterable[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, distances) des k aliments au profil le plus proche de `food_id` (exclu du résultat)"""
+        with self._lock:
+            row = self._positions[int(food_id)]
+            target = dict(zip(self.nutrients, self._raw[:, row].astype(np.float64)))
+            return self.nearest(target, k, categories, exclude=food_id)
+
+    def score(self, goals: Mapping[str, Goal], k: int = 10, categories: Optional[Iterable[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, scores) des k aliments qui satisfont les bornes et maximisent
+        la somme pondérée des valeurs standardisées.
+
+        Chaque objectif est évalué sur toutes les lignes à la fois (une
+        opération par nutriment) ; les aliments hors bornes sont écartés
+        avant l'extraction du top-k.
+        """
+        unknown = set(goals) - set(self.nutrients)
+        if unknown:
+            raise ValueError(f"Nutriments inconnus: {', '.join(sorted(unknown))}")
+        with self._lock:
+            rows = self._rows_for(categories)
+            size = self._size if rows is None else len(rows)
+            scores = np.zeros(size, dtype=np.float32)
+            admissible = np.ones(size, dtype=bool)
+            for name, goal in goals.items():
+                column = self.nutrients.index(name)
+                if goal.weight:
+                    values = self._matrix[column, :self._size] if rows is None else self._matrix[column, rows]
+                    scores += np.float32(goal.weight) * values
+                if goal.min is not None or goal.max is not None:
+                    raw = self._raw[column, :self._size] if rows is None else self._raw[column, rows]
+                    if goal.min is not None:
+                        admissible &= raw >= np.float32(goal.min)
+                    if goal.max is not None:
+                        admissible &= raw <= np.float32(goal.max)
+            scores[~admissible] = -np.inf
+            n = min(k, int(np.count_nonzero(admissible)))
+            if n <= 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            best = np.argpartition(-scores, n - 1)[:n] if n < len(scores) else np.arange(len(scores))
+            best = best[np.argsort(-scores[best], kind="stable")]
+            positions = best if rows is None else rows[best]
+            return self._ids[positions].copy(), scores[best]
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.models import Food
+from app.schemas import FoodMatch, FoodScore, NutrientGoal
+from app.services.nutrient_index import NUTRIENTS, Goal, NutrientIndex
+
+# Délai entre deux vérifications du catalogue en base (écritures d'un autre worker) et
+# dérive des statistiques (en écarts-types) au-delà de laquelle la matrice est reconstruite
+NUTRIENT_INDEX_REFRESH_SECONDS = float(os.getenv("NUTRIENT_INDEX_REFRESH_SECONDS", 5))
+NUTRIENT_INDEX_MAX_DRIFT = float(os.getenv("NUTRIENT_INDEX_MAX_DRIFT", 0.25))
+
+# Matrice partagée par base : (matrice, dernière vérification)
+_indexes: Dict[str, Tuple[NutrientIndex, float]] = {}
+_lock = threading.Lock()
+
+def load_nutrient_index(session: Session) -> NutrientIndex:
+    index = NutrientIndex()
+    rows = session.exec(select(Food.id, Food.category, *[getattr(Food, n) for n in NUTRIENTS])).all()
+    index.build([r[0] for r in rows], [r[2:] for r in rows], [r[1] for r in rows])
+    return index
+
+def get_nutrient_index(session: Session) -> NutrientIndex:
+    """Matrice nutritionnelle d'une base (une instance par URL de moteur, chargée au premier appel).
+
+    Les écritures du worker courant la mettent à jour ligne par ligne ;
+    toutes les NUTRIENT_INDEX_REFRESH_SECONDS, elle est reconstruite si le
+    nombre d'aliments ou l'id maximal en base ne correspondent plus
+    (écritures d'un autre worker) ou si ses moyennes et écarts-types ont
+    trop dérivé depuis la construction (standardisation périmée, ou
+    matrice construite sur un catalogue vide).
+    """
+    key = str(session.get_bind().engine.url)
+    now = time.monotonic()
+    with _lock:
+        entry = _indexes.get(key)
+        if entry is not None and now - entry[1] < NUTRIENT_INDEX_REFRESH_SECONDS:
+            return entry[0]
+        signature = tuple(session.exec(select(func.count(Food.id), func.max(Food.id))).one())
+        index = entry[0] if entry is not None else None
+        if index is None or index.signature != signature or index.drift() > NUTRIENT_INDEX_MAX_DRIFT:
+            index = load_nutrient_index(session)
+        _indexes[key] = (index, now)
+        return index
+
+class NutritionService:
+    """Recherche d'aliments par proximité de profil nutritionnel ou par objectifs nutritionnels"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    @property
+    def index(self) -> NutrientIndex:
+        return get_nutrient_index(self.session)
+
+    def _foods(self, ids) -> Dict[int, Food]:
+        return {f.id: f for f in self.session.exec(select(Food).where(Food.id.in_([int(i) for i in ids]))).all()}
+
+    def _matches(self, ids, distances) -> List[FoodMatch]:
+        foods = self._foods(ids)
+        return [
+            FoodMatch(**foods[int(food_id)].dict(), distance=round(float(distance), 4))
+            for food_id, distance in zip(ids, distances) if int(food_id) in foods
+        ]
+
+    def similar_foods(self, food_id: int, k: int = 10, categories: Optional[Iterable[str]] = None) -> Optional[List[FoodMatch]]:
+        """Aliments au profil le plus proche de `food_id` ; None si l'aliment n'existe pas"""
+        index = self.index
+        if food_id not in index:
+            return None
+        return self._matches(*index.similar_to(food_id, k, categories))
+
+    def closest_foods(self, targets: Mapping[str, float], k: int = 10, categories: Optional[Iterable[str]] = None) -> List[FoodMatch]:
+        """Aliments les plus proches de valeurs cibles (seuls les nutriments fournis comptent)"""
+        return self._matches(*self.index.nearest(targets, k, categories))
+
+    def score_foods(self, goals: List[NutrientGoal], k: int = 10, categories: Optional[Iterable[str]] = None) -> List[FoodScore]:
+        """Meilleurs aliments pour des objectifs nutritionnels (poids et bornes par nutriment)"""
+        combined: Dict[str, Goal] = {}
+        for goal in goals:
+            # Plusieurs objectifs sur un même nutriment : poids additionnés, bornes les plus strictes
+            previous = combined.get(goal.nutrient, Goal())
+            combined[goal.nutrient] = Goal(
+                previous.weight + goal.weight,
+                max((b for b in (previous.min, goal.min) if b is not None), default=None),
+                min((b for b in (previous.max, goal.max) if b is not None), default=None),
+            )
+        ids, scores = self.index.score(combined, k, categories)
+        foods = self._foods(ids)
+        return [
+            FoodScore(**foods[int(food_id)].dict(), score=round(float(score), 4))
+            for food_id, score in zip(ids, scores) if int(food_id) in foods
+        ]
+
+    def on_food_changed(self, food: Food) -> None:
+        entry = _indexes.get(str(self.session.get_bind().engine.url))
+        if entry is not None:
+            entry[0].upsert(food.id, [getattr(food, n) for n in NUTRIENTS], food.category)
+
+    def on_food_deleted(self, food_id: int) -> None:
+        entry = _indexes.get(str(self.session.get_bind().engine.url))
+        if entry is not None:
+            entry[0].remove(food_id)
@@ -0,0 +1,299 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import delete, func, insert
+from sqlmodel import Session, select
+
+from app.models import Food, Recommendation, User
+from app.schemas import RecommendationRead
+from lexical_index import tokenize
+
+# Nombre de recommandations conservées par utilisateur
+RECOMMENDATIONS_PER_USER = int(os.getenv("RECOMMENDATIONS_PER_USER", 20))
+# Utilisateurs traités par transaction et lignes par INSERT multi-valeurs
+RECOMMENDATIONS_USERS_PER_COMMIT = int(os.getenv("RECOMMENDATIONS_USERS_PER_COMMIT", 1000))
+RECOMMENDATIONS_INSERT_BATCH = int(os.getenv("RECOMMENDATIONS_INSERT_BATCH", 5000))
+# Délai entre deux vérifications du catalogue en base (écritures d'un autre worker)
+RECOMMENDATIONS_CATALOG_REFRESH_SECONDS = float(os.getenv("RECOMMENDATIONS_CATALOG_REFRESH_SECONDS", 5))
+
+REASONS = ["Riche en protéines", "Riche en fibres", "Riche en vitamines et minéraux", "Pauvre en matières grasses"]
+
+# Allergie : suite de jetons normalisés (casse, accents et pluriel simple ignorés), cherchée telle quelle
+# parmi les jetons du nom et de la catégorie (« oeuf » n'exclut pas « boeuf »)
+Term = Tuple[str, ...]
+
+def _allergy_terms(allergies: Optional[Iterable[str]]) -> FrozenSet[Term]:
+    return frozenset(term for term in (tuple(tokenize(allergy)) for allergy in allergies or []) if term)
+
+def _mentions(tokens: Term, term: Term) -> bool:
+    """Vrai si la suite de jetons `term` apparaît dans `tokens`"""
+    n = len(term)
+    return any(tokens[i:i + n] == term for i in range(len(tokens) - n + 1))
+
+class FoodCatalog:
+    """Catalogue d'aliments chargé en colonnes NumPy pour le calcul des recommandations.
+
+    Le score nutritionnel de chaque aliment est calculé une fois pour tout
+    le catalogue : protéines (1 point par 10 g pour 100 kcal), fibres
+    (1 point par 5 g pour 100 kcal), vitamines et minéraux (0,1 point
+    chacun), moins la part des calories venant des lipides. Les échelles sont fixes : le
+    score d'un aliment ne dépend pas du reste du catalogue, ce qui permet
+    l'invalidation incrémentale (upsert ou remove d'une seule ligne). Le motif retenu est la composante qui
+    contribue le plus au score.
+    """
+
+    def __init__(self, foods: List[Food]):
+        self.ids = np.array([f.id for f in foods], dtype=np.int64)
+        self.tokens = [_food_tokens(f) for f in foods]
+        self.scores, self.reasons = _score(foods)
+        self._exclusions: Dict[Term, np.ndarray] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def signature(self) -> Tuple[int, Optional[int]]:
+        """(nombre d'aliments, id maximal), comparable à la même mesure en base"""
+        with self._lock:
+            return len(self.ids), int(self.ids.max()) if len(self.ids) else None
+
+    def row(self, food_id: int) -> Optional[int]:
+        with self._lock:
+            rows = np.flatnonzero(self.ids == food_id)
+            return int(rows[0]) if len(rows) else None
+
+    def upsert(self, food: Food) -> None:
+        """Ajouter ou remplacer un aliment (score et masques d'exclusion de sa seule ligne)"""
+        tokens = _food_tokens(food)
+        scores, reasons = _score([food])
+        with self._lock:
+            row = self.row(food.id)
+            if row is None:
+                self.ids = np.append(self.ids, np.int64(food.id))
+                self.tokens.append(tokens)
+                self.scores = np.append(self.scores, scores)
+                self.reasons = np.append(self.reasons, reasons)
+                self._exclusions = {term: np.append(mask, _mentions(tokens, term)) for term, mask in self._exclusions.items()}
+                return
+            self.tokens[row] = tokens
+            self.scores[row], self.reasons[row] = scores[0], reasons[0]
+            for term, mask in self._exclusions.items():
+                mask[row] = _mentions(tokens, term)
+
+    def remove(self, food_id: int) -> bool:
+        with self._lock:
+            row = self.row(food_id)
+            if row is None:
+                return False
+            self.ids = np.delete(self.ids, row)
+            del self.tokens[row]
+            self.scores = np.delete(self.scores, row)
+            self.reasons = np.delete(self.reasons, row)
+            self._exclusions = {term: np.delete(mask, row) for term, mask in self._exclusions.items()}
+            return True
+
+    def excluded(self, terms: FrozenSet[Term]) -> np.ndarray:
+        """Aliments dont le nom ou la catégorie mentionne une allergie (masque mis en cache par terme)"""
+        with self._lock:
+            mask = np.zeros(len(self.ids), dtype=bool)
+            for term in terms:
+                if term not in self._exclusions:
+                    self._exclusions[term] = np.array([_mentions(tokens, term) for tokens in self.tokens], dtype=bool)
+                mask |= self._exclusions[term]
+            return mask
+
+    def top(self, terms: FrozenSet[Term], n: int) -> List[Tuple[int, int, float]]:
+        """(id, motif, score) des n meilleurs aliments compatibles avec les allergies, par score décroissant"""
+        with self._lock:
+            scores = np.where(self.excluded(terms), -np.inf, self.scores)
+            n = min(n, int(np.isfinite(scores).sum()))
+            if n <= 0:
+                return []
+            best = np.argpartition(-scores, n - 1)[:n] if n < len(scores) else np.arange(len(scores))
+            best = best[np.argsort(-scores[best], kind="stable")]
+            return [(int(self.ids[i]), int(self.reasons[i]), float(self.scores[i])) for i in best]
+
+def _food_tokens(food: Food) -> Term:
+    return tuple(tokenize(f"{food.name} {food.category}"))
+
+def _score(foods: List[Food]) -> Tuple[np.ndarray, np.ndarray]:
+    """Scores et motifs (indice dans REASONS) d'aliments, sur les échelles fixes de FoodCatalog"""
+    calories = np.maximum(np.array([f.calories for f in foods], dtype=np.float64), 1.0)
+    proteins = np.array([f.proteins for f in foods], dtype=np.float64)
+    fiber = np.array([f.fiber for f in foods], dtype=np.float64)
+    fats = np.array([f.fats for f in foods], dtype=np.float64)
+    micro = np.array([len(f.vitamins or []) + len(f.minerals or []) for f in foods], dtype=np.float64)
+    components = np.stack([
+        10 * proteins / calories,
+        20 * fiber / calories,
+        0.1 * micro,
+        -9 * fats / calories,
+    ]) if len(foods) else np.zeros((len(REASONS), 0))
+    return components.sum(axis=0), components.argmax(axis=0)
+
+# Catalogue partagé par base : (catalogue, dernière vérification)
+_catalogs: Dict[str, Tuple[FoodCatalog, float]] = {}
+_lock = threading.Lock()
+
+def get_food_catalog(session: Session) -> FoodCatalog:
+    """Catalogue d'une base (une instance par URL de moteur, chargé au premier appel).
+
+    Les écritures du worker courant le mettent à jour ligne par ligne ;
+    il est rechargé lorsque le nombre d'aliments ou l'id maximal en base
+    ne correspondent plus aux siens (écritures d'un autre worker).
+    """
+    key = str(session.get_bind().engine.url)
+    now = time.monotonic()
+    with _lock:
+        entry = _catalogs.get(key)
+        if entry is not None and now - entry[1] < RECOMMENDATIONS_CATALOG_REFRESH_SECONDS:
+            return entry[0]
+        signature = tuple(session.exec(select(func.count(Food.id), func.max(Food.id))).one())
+        catalog = entry[0] if entry is not None and entry[0].signature == signature else FoodCatalog(session.exec(select(Food)).all())
+        _catalogs[key] = (catalog, now)
+        return catalog
+
+class RecommendationService:
+    """Recommandations matérialisées dans la table Recommendation.
+
+    Le calcul complet charge le catalogue une fois, regroupe les
+    utilisateurs par ensemble d'allergies (un classement par groupe) et
+    réécrit les lignes par INSERT multi-valeurs, une transaction par
+    page d'utilisateurs. La lecture passe par l'index (user_id, score desc).
+    Les modifications d'un utilisateur ou d'un aliment ne recalculent que
+    les utilisateurs concernés.
+    """
+
+    def __init__(self, session: Session, per_user: int = RECOMMENDATIONS_PER_USER):
+        self.session = session
+        self.per_user = per_user
+
+    @property
+    def catalog(self) -> FoodCatalog:
+        return get_food_catalog(self.session)
+
+    def get_recommendations(self, user_id: int, limit: int = 10) -> List[RecommendationRead]:
+        statement = (
+            select(Recommendation)
+            .where(Recommendation.user_id == user_id)
+            .order_by(Recommendation.score.desc())
+            .limit(limit)
+        )
+        return [RecommendationRead(**r.dict()) for r in self.session.exec(statement).all()]
+
+    def _rows(self, users: List[Tuple[int, FrozenSet[Term]]]) -> List[dict]:
+        catalog = self.catalog
+        now = datetime.utcnow()
+        groups: Dict[FrozenSet[Term], List[int]] = defaultdict(list)
+        for user_id, terms in users:
+            groups[terms].append(user_id)
+        rows = []
+        for terms, user_ids in groups.items():
+            ranked = catalog.top(terms, self.per_user)
+            rows.extend(
+                {"user_id": user_id, "food_id": food_id, "reason": REASONS[reason], "score": score, "created_at": now}
+                for user_id in user_ids for food_id, reason, score in ranked
+            )
+        return rows
+
+    def _write(self, users: List[Tuple[int, FrozenSet[Term]]]) -> int:
+        """Remplacer les recommandations d'une page d'utilisateurs (sans valider la transaction)"""
+        self.session.execute(delete(Recommendation).where(Recommendation.user_id.in_([u for u, _ in users])))
+        rows = self._rows(users)
+        for start in range(0, len(rows), RECOMMENDATIONS_INSERT_BATCH):
+            self.session.execute(insert(Recommendation), rows[start:start + RECOMMENDATIONS_INSERT_BATCH])
+        return len(rows)
+
+    def refresh_all(self, users_per_commit: int = RECOMMENDATIONS_USERS_PER_COMMIT) -> dict:
+        """Recalculer les recommandations de tous les utilisateurs"""
+        debut = time.perf_counter()
+        users, rows, last_id = 0, 0, 0
+        while True:
+            page = self.session.exec(
+                select(User.id, User.allergies).where(User.id > last_id).order_by(User.id).limit(users_per_commit)
+            ).all()
+            if not page:
+                break
+            rows += self._write([(user_id, _allergy_terms(allergies)) for user_id, allergies in page])
+            self.session.commit()
+            users += len(page)
+            last_id = page[-1][0]
+        duree = time.perf_counter() - debut
+        return {"users": users, "recommendations": rows, "seconds": round(duree, 3),
+                "users_per_second": round(users / duree, 1) if duree else None}
+
+    def refresh_users(self, user_ids: Iterable[int], users_per_commit: int = RECOMMENDATIONS_USERS_PER_COMMIT) -> int:
+        """Recalculer les recommandations de certains utilisateurs (ex. allergies modifiées)"""
+        user_ids = sorted(set(user_ids))
+        rows = 0
+        for start in range(0, len(user_ids), users_per_commit):
+            page = user_ids[start:start + users_per_commit]
+            users = self.session.exec(select(User.id, User.allergies).where(User.id.in_(page))).all()
+            rows += self._write([(user_id, _allergy_terms(allergies)) for user_id, allergies in users])
+            self.session.commit()
+        return rows
+
+    def on_food_changed(self, food_id: int) -> int:
+        """Mettre à jour les recommandations après la création ou la modification d'un aliment.
+
+        Les utilisateurs qui recommandaient déjà l'aliment sont recalculés
+        (son score a pu baisser). Pour les autres, l'aliment n'est inséré
+        que là où il bat le dernier score de la liste (ou la complète) et
+        reste compatible avec les allergies, puis chaque liste est ramenée
+        à `per_user` lignes : deux écritures par utilisateur concerné.
+        Seule la ligne de l'aliment est recalculée dans le catalogue.
+        """
+        food = self.session.get(Food, food_id)
+        if food is not None:
+            self.catalog.upsert(food)
+        had = set(self.session.exec(select(Recommendation.user_id).where(Recommendation.food_id == food_id)).all())
+        inserted = 0
+        if food is not None:
+            scores, reasons = _score([food])
+            score, reason, tokens = float(scores[0]), REASONS[int(reasons[0])], _food_tokens(food)
+            candidates = [user_id for user_id in self.session.exec(
+                select(Recommendation.user_id)
+                .group_by(Recommendation.user_id)
+                .having((func.min(Recommendation.score) < score) | (func.count(Recommendation.id) < self.per_user))
+            ).all() if user_id not in had]
+            now = datetime.utcnow()
+            for start in range(0, len(candidates), RECOMMENDATIONS_USERS_PER_COMMIT):
+                page = candidates[start:start + RECOMMENDATIONS_USERS_PER_COMMIT]
+                users = self.session.exec(select(User.id, User.allergies).where(User.id.in_(page))).all()
+                rows = [
+                    {"user_id": user_id, "food_id": food_id, "reason": reason, "score": score, "created_at": now}
+                    for user_id, allergies in users if not any(_mentions(tokens, term) for term in _allergy_terms(allergies))
+                ]
+                if rows:
+                    self.session.execute(insert(Recommendation), rows)
+                    self._trim([r["user_id"] for r in rows])
+                self.session.commit()
+                inserted += len(rows)
+        return inserted + self.refresh_users(had)
+
+    def _trim(self, user_ids: List[int]) -> None:
+        """Supprimer les lignes classées au-delà de `per_user` pour ces utilisateurs"""
+        ranked = (
+            select(
+                Recommendation.id,
+                func.row_number().over(partition_by=Recommendation.user_id, order_by=Recommendation.score.desc()).label("rang"),
+            )
+            .where(Recommendation.user_id.in_(user_ids))
+            .subquery()
+        )
+        self.session.execute(delete(Recommendation).where(Recommendation.id.in_(select(ranked.c.id).where(ranked.c.rang > self.per_user))))
+
+    def on_food_deleted(self, food_id: int) -> List[int]:
+        """Retirer un aliment des recommandations avant sa suppression ; retourne les utilisateurs à recompléter"""
+        user_ids = list(self.session.exec(
+            select(Recommendation.user_id).where(Recommendation.food_id == food_id)
+        ).all())
+        self.session.execute(delete(Recommendation).where(Recommendation.food_id == food_id))
+        self.catalog.remove(food_id)
+        return user_ids
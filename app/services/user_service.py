@@ -0,0 +1,35 @@
+from sqlmodel import Session
+from typing import Optional
+from app.models import User
+from app.schemas import UserRead
+from app.services.recommendation_service import RecommendationService, _allergy_terms
+
+class UserService:
+    def __init__(self, session: Session):
+        self.session = session
+
+    def update_user(self, user_id: int, user_data: dict) -> Optional[UserRead]:
+        user = self.session.get(User, user_id)
+        if not user:
+            return None
+        termes_avant = _allergy_terms(user.allergies)
+
+        # Mettre à jour les champs fournis
+        for field, value in user_data.items():
+            if value is not None:
+                setattr(user, field, value)
+
+        self.session.add(user)
+        self.session.commit()
+        self.session.refresh(user)
+        # Allergies modifiées : recalculer les recommandations de cet utilisateur seulement
+        if _allergy_terms(user.allergies) != termes_avant:
+            RecommendationService(self.session).refresh_users([user.id])
+
+        return UserRead(
+            id=user.id,
+            name=user.name,
+            email=user.email,
+            allergies=user.allergies or [],
+            created_at=user.created_at
+        )
@@ -1,15 +1,407 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
 import os
+import queue
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Sequence
+from text_utils import normalize_text
 
+# Modèle d'embedding. Le préfixe choisit le moteur :
+#   "all-MiniLM-L6-v2"              SentenceTransformer (torch)
+#   "onnx:/chemin/vers/modele"      export ONNX local (model.onnx ou model_quantized.onnx + tokenizer.json)
+#   "hashing" ou "hashing:384"      n-grammes de caractères hachés, sans fichier de modèle
 MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# Forcer un moteur ("sentence-transformers", "onnx", "hashing") au lieu du préfixe
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "")
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 384))
+# Micro-batching : taille maximale d'un lot et attente maximale avant encodage
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", 5))
+# Cache des embeddings de requêtes : nombre d'entrées et fichier de persistance (optionnel)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 10000))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "")
+
+class SentenceTransformerBackend:
+    """Modèle SentenceTransformer (torch), téléchargé depuis le hub au besoin"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    def load(self):
+        # Import local : sentence_transformers (et torch) coûtent cher à importer
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(self.model_name)
+
+class OnnxBackend:
+    """Modèle exporté en ONNX exécuté par onnxruntime sur CPU, sans torch.
+
+    Le répertoire doit contenir `tokenizer.json` et `model_quantized.onnx`
+    (préféré) ou `model.onnx`, comme ceux produits par `optimum-cli export onnx`.
+    Le vecteur est la moyenne des états cachés pondérée par le masque
+    d'attention, normalisée, comme la tête de pooling de sentence-transformers.
+    """
+
+    def __init__(self, model_path: str, max_length: int = 128):
+        self.model_path = model_path
+        self.max_length = max_length
+        self.session = None
+        self.tokenizer = None
+
+    def load(self) -> "OnnxBackend":
+        import onnxruntime
+        from tokenizers import Tokenizer
+        fichier = next(
+            (os.path.join(self.model_path, nom) for nom in ("model_quantized.onnx", "model.onnx")
+             if os.path.exists(os.path.join(self.model_path, nom))),
+            None,
+        )
+        if fichier is None:
+            raise FileNotFoundError(f"Aucun modèle ONNX dans {self.model_path}")
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.model_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.max_length)
+        self.tokenizer.enable_padding()
+        self.session = onnxruntime.InferenceSession(fichier, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+        return self
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        sorties = []
+        for start in range(0, len(texts), batch_size):
+            encodages = self.tokenizer.encode_batch(list(texts[start:start + batch_size]))
+            mask = np.array([e.attention_mask for e in encodages], dtype=np.int64)
+            feed = {"input_ids": np.array([e.ids for e in encodages], dtype=np.int64), "attention_mask": mask}
+            if "token_type_ids" in self._inputs:
+                feed["token_type_ids"] = np.array([e.type_ids for e in encodages], dtype=np.int64)
+            hidden = self.session.run(None, feed)[0]
+            poids = mask[:, :, None].astype(np.float32)
+            pooled = (hidden * poids).sum(axis=1) / np.maximum(poids.sum(axis=1), 1e-9)
+            sorties.append(pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12))
+        return np.concatenate(sorties).astype(np.float32) if sorties else np.zeros((0, 0), dtype=np.float32)
+
+class HashingBackend:
+    """Embedding déterministe par hachage de n-grammes de caractères.
+
+    Chaque mot normalisé (casse et accents ignorés) et chacun de ses
+    n-grammes de caractères sont hachés (crc32, stable d'un processus à
+    l'autre) vers une dimension et un signe. Aucune dépendance ni fichier
+    de modèle : adapté aux tests, aux environnements hors ligne et aux
+    catalogues où la proximité orthographique suffit.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, ngram_range: tuple = (3, 4)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def load(self) -> "HashingBackend":
+        return self
+
+    def features(self, text: str) -> List[str]:
+        features = []
+        for mot in normalize_text(text).split():
+            features.append(mot)
+            mot = f"<{mot}>"
+            for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+                features.extend(mot[i:i + n] for i in range(len(mot) - n + 1))
+        return features
+
+    def encode(self, texts: Sequence[str], batch_size: int = 0) -> np.ndarray:
+        rows, cols, signes = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                rows.append(row)
+                cols.append(h % self.dim)
+                signes.append(1.0 if h & 0x80000000 else -1.0)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(vectors, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), np.array(signes, dtype=np.float32))
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def create_backend(model_name: str = MODEL_NAME, backend: str = EMBEDDING_BACKEND):
+    """Construire le moteur d'embedding désigné par le nom du modèle (ou forcé par `backend`)"""
+    prefixe, _, reste = model_name.partition(":")
+    if not backend:
+        backend = prefixe if prefixe in ("onnx", "hashing") else "sentence-transformers"
+    if prefixe != backend:
+        reste = model_name
+    if backend == "hashing":
+        return HashingBackend(int(reste) if reste.isdigit() else EMBEDDING_DIM)
+    if backend == "onnx":
+        return OnnxBackend(reste)
+    if backend == "sentence-transformers":
+        return SentenceTransformerBackend(model_name)
+    raise ValueError(f"Moteur d'embedding inconnu: {backend}")
+
+class EmbeddingCache:
+    """Cache LRU borné des embeddings de requêtes.
+
+    Les clés combinent le nom du modèle et le texte normalisé (casse et
+    accents ignorés), de sorte que « Épinards » et « epinards » partagent
+    la même entrée. Le contenu peut être sauvegardé puis rechargé pour
+    qu'un worker redémarré parte avec un cache chaud.
+    """
+
+    def __init__(self, max_size: int = EMBEDDING_CACHE_SIZE):
+        self.max_size = max_size
+        self._data: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model_name: str, text: str) -> tuple:
+        return (model_name, normalize_text(text))
+
+    def get(self, model_name: str, text: str) -> Optional[np.ndarray]:
+        key = self.key(model_name, text)
+        with self._lock:
+            vector = self._data.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, model_name: str, text: str, vector) -> None:
+        if self.max_size <= 0:
+            return
+        key = self.key(model_name, text)
+        with self._lock:
+            self._data[key] = np.asarray(vector, dtype=np.float32)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def save(self, path: str) -> int:
+        """Sauvegarder le cache dans un fichier .npz (écriture atomique)"""
+        with self._lock:
+            items = list(self._data.items())
+        vectors = [vector for _, vector in items]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                models=np.array([model for (model, _), _ in items], dtype=str),
+                texts=np.array([text for (_, text), _ in items], dtype=str),
+                lengths=np.array([len(v) for v in vectors], dtype=np.int64),
+                vectors=np.concatenate(vectors) if vectors else np.zeros(0, dtype=np.float32),
+            )
+        os.replace(tmp_path, path)
+        return len(items)
+
+    def load(self, path: str) -> int:
+        """Recharger un cache sauvegardé ; retourne le nombre d'entrées lues"""
+        if not os.path.exists(path):
+            return 0
+        with np.load(path) as data:
+            models, texts, lengths, flat = data["models"], data["texts"], data["lengths"], data["vectors"]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        # Les entrées sont stockées de la plus ancienne à la plus récente
+        for i, (model, text) in enumerate(zip(models, texts)):
+            self.put(str(model), str(text), flat[offsets[i]:offsets[i + 1]])
+        return len(texts)
+
+class MicroBatcher:
+    """Regroupe les appels concurrents en un seul appel d'encodage.
+
+    Chaque appelant dépose son texte dans une file ; un thread unique
+    rassemble jusqu'à `max_batch_size` textes arrivés dans une fenêtre de
+    `max_wait_ms`, les encode en une passe et rend à chacun son vecteur.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch_size: int = EMBEDDING_BATCH_SIZE, max_wait_ms: float = EMBEDDING_BATCH_WAIT_MS):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, text: str) -> np.ndarray:
+        """Encoder un texte en le joignant au prochain lot"""
+        future: Future = Future()
+        self._queue.put((text, future))
+        self._ensure_worker()
+        return future.result()
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch: list):
+        try:
+            vectors = self.encode_fn([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.items += len(batch)
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
 
 class EmbeddingService:
-    def __init__(self, model_name: str = MODEL_NAME):
-        self.model = SentenceTransformer(model_name)
+    """Service d'embedding dont le modèle est chargé à la demande.
+
+    Le modèle n'est pas construit à l'import : il est chargé au premier
+    appel de `embed` ou en arrière-plan via `warmup()`, ce qui permet à
+    uvicorn d'ouvrir son port immédiatement. Le moteur (SentenceTransformer,
+    ONNX ou hachage) est choisi par `create_backend`.
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, batch_size: int = EMBEDDING_BATCH_SIZE, batch_wait_ms: float = EMBEDDING_BATCH_WAIT_MS, cache: Optional[EmbeddingCache] = None, backend=None):
+        self.model_name = model_name
+        self.backend = backend or create_backend(model_name)
+        self.batch_size = batch_size
+        self.cache = cache
+        # Micro-batching désactivé si la fenêtre d'attente ou la taille de lot est nulle
+        self.batcher: Optional[MicroBatcher] = None
+        if batch_size > 1 and batch_wait_ms > 0:
+            self.batcher = MicroBatcher(self.encode, batch_size, batch_wait_ms)
+        self._model = None
+        self._lock = threading.Lock()
+        self._warmup_thread: Optional[threading.Thread] = None
+        self.load_seconds: Optional[float] = None
+        self.load_error: Optional[str] = None
+
+    @property
+    def model(self):
+        """Retourner le modèle, en le chargeant une seule fois (thread-safe)"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load_model()
+        return self._model
+
+    def _load_model(self):
+        debut = time.perf_counter()
+        try:
+            model = self.backend.load()
+        except Exception as e:
+            self.load_error = str(e)
+            raise
+        self.load_seconds = time.perf_counter() - debut
+        self.load_error = None
+        return model
+
+    @property
+    def is_ready(self) -> bool:
+        """Indiquer si le modèle est chargé en mémoire"""
+        return self._model is not None
+
+    def status(self) -> dict:
+        """État de chargement du modèle, exposé par les endpoints de santé"""
+        if self._model is not None:
+            state = "ready"
+        elif self._warmup_thread is not None and self._warmup_thread.is_alive():
+            state = "loading"
+        elif self.load_error:
+            state = "error"
+        else:
+            state = "not_loaded"
+        return {
+            "model": self.model_name,
+            "backend": type(self.backend).__name__,
+            "state": state,
+            "load_seconds": self.load_seconds,
+            "error": self.load_error,
+            "batching": self.batcher.stats() if self.batcher else None,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+    def warmup(self, background: bool = True) -> Optional[threading.Thread]:
+        """Précharger le modèle, par défaut dans un thread d'arrière-plan"""
+        if self.is_ready:
+            return None
+        if not background:
+            self.model
+            return None
+        if self._warmup_thread is None or not self._warmup_thread.is_alive():
+            self._warmup_thread = threading.Thread(target=self._warmup, name="embedding-warmup", daemon=True)
+            self._warmup_thread.start()
+        return self._warmup_thread
+
+    def _warmup(self):
+        try:
+            self.model
+            print(f"✅ Modèle d'embedding {self.model_name} chargé en {self.load_seconds:.1f}s")
+        except Exception as e:
+            print(f"⚠️ Échec du chargement du modèle d'embedding {self.model_name}: {e}")
+
+    def encode(self, texts: Sequence[str], batch_size: Optional[int] = None) -> np.ndarray:
+        """Encoder plusieurs textes en un seul appel au modèle (matrice float32)"""
+        embeddings = self.model.encode(list(texts), batch_size=batch_size or self.batch_size)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def embed_many(self, texts: Sequence[str], batch_size: Optional[int] = None) -> List[list]:
+        """Calculer les embeddings d'une liste de textes par lots"""
+        if not texts:
+            return []
+        return self.encode(texts, batch_size).tolist()
 
     def embed(self, text: str) -> list:
-        embedding = self.model.encode([text])[0]
-        return embedding.tolist() if isinstance(embedding, np.ndarray) else list(embedding)
+        """Calculer l'embedding d'un texte, regroupé avec les appels concurrents"""
+        if self.batcher is None:
+            return self.encode([text])[0].tolist()
+        return self.batcher.submit(text).tolist()
+
+    def embed_query(self, text: str) -> list:
+        """Embedding d'une requête de recherche, servi par le cache LRU si possible"""
+        if self.cache is None:
+            return self.embed(text)
+        vector = self.cache.get(self.model_name, text)
+        if vector is None:
+            vector = self.embed(text)
+            self.cache.put(self.model_name, text, vector)
+            return vector
+        return vector.tolist()
 
-embedding_service = EmbeddingService() 
\ No newline at end of file
+embedding_service = EmbeddingService(cache=EmbeddingCache())
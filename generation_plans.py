@@ -0,0 +1,199 @@
+import datetime
+import multiprocessing
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import delete, insert
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from models import AlimentRepasJour, PlanRepas, RepasJour, Utilisateur
+from allergens import allergen_mask
+from meal_planner import MealPlanner, get_planner, nom_jour, nom_repas
+from text_utils import parse_allergenes
+
+# Processus de planification (1 : dans le processus courant), utilisateurs par tâche,
+# utilisateurs écrits par transaction et lignes par INSERT multi-valeurs
+PLANS_WORKERS = int(os.getenv("PLANS_WORKERS", os.cpu_count() or 1))
+PLANS_USERS_PER_TASK = int(os.getenv("PLANS_USERS_PER_TASK", 256))
+PLANS_USERS_PER_COMMIT = int(os.getenv("PLANS_USERS_PER_COMMIT", 1000))
+PLANS_INSERT_BATCH = int(os.getenv("PLANS_INSERT_BATCH", 5000))
+# Démarrage des processus de travail : "spawn" (ou "forkserver") plutôt que fork, qui
+# copierait dans l'enfant le pool de connexions et les verrous du processus principal
+PLANS_MP_CONTEXT = os.getenv("PLANS_MP_CONTEXT", "spawn")
+# Nouvelles tentatives d'écriture d'une page en conflit avec des plans écrits entre-temps
+PLANS_WRITE_RETRIES = 3
+
+# Planificateur du processus de travail, reçu une fois à son démarrage
+_planner: Optional[MealPlanner] = None
+
+def debut_semaine(jour: Optional[datetime.date] = None) -> datetime.date:
+    """Lundi de la semaine d'une date (aujourd'hui par défaut)"""
+    jour = jour or datetime.date.today()
+    return jour - datetime.timedelta(days=jour.weekday())
+
+# Verrous par (base, utilisateur, semaine), avec le nombre de demandes qui les utilisent
+_verrous: Dict[tuple, list] = {}
+_verrous_lock = threading.Lock()
+
+@contextmanager
+def verrou_plan(bind, utilisateur_id: int, semaine: datetime.date):
+    """Sérialiser les générations d'un même plan dans le worker courant (verrou retiré quand plus personne ne l'attend)"""
+    key = (str(bind.engine.url), int(utilisateur_id), semaine)
+    with _verrous_lock:
+        entry = _verrous.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _verrous_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _verrous[key]
+
+def supprimer_plans(session: Session, plan_ids: List[int]) -> None:
+    """Supprimer des plans avec leurs repas et aliments (sans valider la transaction)"""
+    if not plan_ids:
+        return
+    repas_ids = select(RepasJour.id).where(RepasJour.plan_repas_id.in_(plan_ids))
+    session.execute(delete(AlimentRepasJour).where(AlimentRepasJour.repas_jour_id.in_(repas_ids)))
+    session.execute(delete(RepasJour).where(RepasJour.plan_repas_id.in_(plan_ids)))
+    session.execute(delete(PlanRepas).where(PlanRepas.id.in_(plan_ids)))
+
+def _plans_existants(session: Session, semaine: datetime.date, utilisateur_ids: Optional[List[int]] = None) -> Dict[int, int]:
+    statement = select(PlanRepas.utilisateur_id, PlanRepas.id).where(PlanRepas.semaine == semaine)
+    if utilisateur_ids is not None:
+        statement = statement.where(PlanRepas.utilisateur_id.in_(utilisateur_ids))
+    return dict(session.exec(statement).all())
+
+def _init_worker(planner: MealPlanner) -> None:
+    global _planner
+    _planner = planner
+
+def _planifier(tache: Tuple[int, List[int], int]) -> List[Tuple[int, list]]:
+    """Plans d'un groupe d'utilisateurs partageant le même masque d'allergènes"""
+    mask, utilisateur_ids, seed = tache
+    plans = _planner.plan_many(mask, len(utilisateur_ids), np.random.default_rng(seed))
+    return list(zip(utilisateur_ids, plans))
+
+def _insert(session: Session, model, rows: List[dict]) -> None:
+    for start in range(0, len(rows), PLANS_INSERT_BATCH):
+        session.execute(insert(model), rows[start:start + PLANS_INSERT_BATCH])
+
+def _write(session: Session, semaine: datetime.date, plans: List[Tuple[int, list]], regenerate: bool) -> int:
+    """Écrire une page de plans en une transaction : plans, repas puis aliments par INSERT multi-lignes.
+
+    Les plans de la semaine déjà en base sont remplacés (`regenerate`) ou
+    conservés, l'utilisateur étant alors retiré de la page.
+    """
+    existants = _plans_existants(session, semaine, [utilisateur_id for utilisateur_id, _ in plans])
+    if regenerate:
+        supprimer_plans(session, list(existants.values()))
+    else:
+        plans = [(utilisateur_id, plan) for utilisateur_id, plan in plans if utilisateur_id not in existants]
+    utilisateur_ids = [utilisateur_id for utilisateur_id, _ in plans]
+    if not plans:
+        session.commit()
+        return 0
+    _insert(session, PlanRepas, [{"utilisateur_id": u, "semaine": semaine} for u in utilisateur_ids])
+    # Ids relus (sans RETURNING) par la clé unique (utilisateur, semaine)
+    plan_ids = _plans_existants(session, semaine, utilisateur_ids)
+    _insert(session, RepasJour, [
+        {"plan_repas_id": plan_ids[utilisateur_id], "jour": nom_jour(j), "repas": nom_repas(r)}
+        for utilisateur_id, plan in plans for j, jour in enumerate(plan) for r in range(len(jour))
+    ])
+    repas_ids = {
+        (plan_id, jour, repas): repas_id
+        for plan_id, jour, repas, repas_id in session.exec(
+            select(RepasJour.plan_repas_id, RepasJour.jour, RepasJour.repas, RepasJour.id)
+            .where(RepasJour.plan_repas_id.in_(list(plan_ids.values())))
+        ).all()
+    }
+    _insert(session, AlimentRepasJour, [
+        {"repas_jour_id": repas_ids[plan_ids[utilisateur_id], nom_jour(j), nom_repas(r)], "aliment_id": aliment_id}
+        for utilisateur_id, plan in plans
+        for j, jour in enumerate(plan) for r, aliment_ids in enumerate(jour) for aliment_id in aliment_ids
+    ])
+    session.commit()
+    return len(plans)
+
+def _write_page(session: Session, semaine: datetime.date, plans: List[Tuple[int, list]], regenerate: bool) -> int:
+    # Un plan écrit entre-temps par une autre requête viole la contrainte unique : annuler et relire
+    for essai in range(PLANS_WRITE_RETRIES):
+        try:
+            return _write(session, semaine, plans, regenerate)
+        except IntegrityError:
+            session.rollback()
+            if essai == PLANS_WRITE_RETRIES - 1:
+                raise
+
+def generate_plans_lot(session: Session, semaine: Optional[datetime.date] = None,
+                       utilisateur_ids: Optional[Iterable[int]] = None, workers: int = PLANS_WORKERS,
+                       users_per_commit: int = PLANS_USERS_PER_COMMIT, seed: Optional[int] = None,
+                       regenerate: bool = False) -> dict:
+    """Générer les plans de la semaine (lundi de `semaine`) de tous les utilisateurs (ou de certains).
+
+    Le catalogue est chargé une fois et transmis à chaque processus de
+    travail à son démarrage. Les utilisateurs sont regroupés par masque
+    d'allergènes (candidats filtrés une fois par groupe) et découpés en
+    tâches de PLANS_USERS_PER_TASK utilisateurs, planifiées en parallèle.
+    Les plans sont écrits au fil de l'eau par le processus principal,
+    une transaction par page de `users_per_commit` utilisateurs. Les
+    utilisateurs qui ont déjà un plan pour la semaine sont ignorés, sauf
+    avec `regenerate` qui remplace leur plan.
+    """
+    debut = time.perf_counter()
+    semaine = debut_semaine(semaine)
+    statement = select(Utilisateur.id, Utilisateur.allergies).order_by(Utilisateur.id)
+    if utilisateur_ids is not None:
+        statement = statement.where(Utilisateur.id.in_(list(utilisateur_ids)))
+    existants = set() if regenerate else set(_plans_existants(session, semaine))
+    groupes: Dict[int, List[int]] = defaultdict(list)
+    ignores = 0
+    for utilisateur_id, allergies in session.exec(statement).all():
+        if utilisateur_id in existants:
+            ignores += 1
+            continue
+        groupes[allergen_mask(parse_allergenes(allergies))].append(utilisateur_id)
+    total = sum(len(ids) for ids in groupes.values())
+    planner = get_planner(session)
+    taches = [
+        (mask, ids[start:start + PLANS_USERS_PER_TASK])
+        for mask, ids in groupes.items() for start in range(0, len(ids), PLANS_USERS_PER_TASK)
+    ]
+    seeds = np.random.SeedSequence(seed).generate_state(len(taches)) if taches else []
+    taches = [(mask, ids, int(s)) for (mask, ids), s in zip(taches, seeds)]
+
+    ecrits, page = 0, []
+    executor = None
+    if workers > 1 and len(taches) > 1:
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(PLANS_MP_CONTEXT),
+                                       initializer=_init_worker, initargs=(planner,))
+    try:
+        if executor is None:
+            _init_worker(planner)
+            resultats = map(_planifier, taches)
+        else:
+            resultats = executor.map(_planifier, taches)
+        for plans in resultats:
+            page.extend(plans)
+            if len(page) >= users_per_commit:
+                n = _write_page(session, semaine, page, regenerate)
+                ecrits, ignores, page = ecrits + n, ignores + len(page) - n, []
+                print(f"  {ecrits}/{total} plans générés ({ecrits / (time.perf_counter() - debut):.0f} plans/s)")
+        if page:
+            n = _write_page(session, semaine, page, regenerate)
+            ecrits, ignores = ecrits + n, ignores + len(page) - n
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    duree = time.perf_counter() - debut
+    return {"semaine": semaine.isoformat(), "plans": ecrits, "existants": ignores,
+            "groupes": len(groupes), "seconds": round(duree, 3),
+            "plans_per_second": round(ecrits / duree, 1) if duree else None}
@@ -0,0 +1,363 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from text_utils import normalize_text
+from vector_index import top_k_indices
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    """Découper un texte en jetons normalisés (casse, accents, pluriels simples ignorés)"""
+    tokens = []
+    for token in _TOKEN.findall(normalize_text(text or "")):
+        # « épinards » et « épinard », « choux » et « chou » partagent le même jeton
+        if len(token) > 3 and token[-1] in "sx":
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+def trigrams(token: str) -> Set[str]:
+    """Trigrammes de caractères d'un jeton, bornés par des marqueurs de début et de fin"""
+    padded = f"<{token}>"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class LexicalIndex:
+    """Index inversé en mémoire sur des textes courts (noms d'aliments).
+
+    Chaque jeton normalisé pointe vers les lignes des documents qui le
+    contiennent (avec sa fréquence) ; le classement BM25 est calculé par
+    terme sur des tableaux NumPy (listes de postings converties à la
+    demande et gardées en cache tant que le terme ne change pas). Un
+    second index relie chaque trigramme de caractères aux jetons du
+    vocabulaire : un jeton de requête absent du vocabulaire (faute de
+    frappe) est étendu aux jetons proches (similarité de Dice sur les
+    trigrammes), pondérés par cette similarité.
+
+    Comme pour `VectorIndex`, des attributs numériques par document
+    (`attributes`) sont stockés en colonnes, ce qui permet de filtrer les
+    candidats avant l'extraction du top-k. Les ajouts et suppressions sont
+    incrémentaux.
+    """
+
+    def __init__(self, attributes: Iterable[str] = (), k1: float = 1.2, b: float = 0.75,
+                 fuzzy_threshold: float = 0.5, max_expansions: int = 5):
+        self.k1 = k1
+        self.b = b
+        self.fuzzy_threshold = fuzzy_threshold
+        self.max_expansions = max_expansions
+        self._attributes = tuple(attributes)
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._trigrams: Dict[str, Set[str]] = defaultdict(set)
+        self._tokens: List[List[str]] = []
+        self._ids = np.zeros(16, dtype=np.int64)
+        self._size = 0
+        self._positions: Dict[int, int] = {}
+        self._lengths = np.zeros(16, dtype=np.float32)
+        self._columns: Dict[str, np.ndarray] = {name: np.zeros(16, dtype=np.int64) for name in self._attributes}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, doc_id: int) -> bool:
+        return doc_id in self._positions
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self._postings)
+
+    def column(self, name: str) -> np.ndarray:
+        """Valeurs d'un attribut, alignées sur les lignes de l'index"""
+        return self._columns[name][:self._size]
+
+    def build(self, documents: Iterable[Tuple[int, str]], **attributes) -> None:
+        """Reconstruire l'index à partir de paires (id, texte)"""
+        with self._lock:
+            self._reset()
+            columns = {name: list(attributes.get(name) or ()) for name in self._attributes}
+            for row, (doc_id, text) in enumerate(documents):
+                self._add(int(doc_id), text, {name: values[row] for name, values in columns.items() if values})
+
+    def upsert(self, doc_id: int, text: str, **attributes) -> None:
+        """Ajouter ou remplacer le texte d'un document"""
+        with self._lock:
+            self._remove(int(doc_id))
+            self._add(int(doc_id), text, attributes)
+
+    def remove(self, doc_id: int) -> bool:
+        with self._lock:
+            return self._remove(int(doc_id))
+
+    def _add(self, doc_id: int, text: str, attributes: dict) -> None:
+        tokens = tokenize(text)
+        row = self._size
+        if row == len(self._lengths):
+            self._lengths = np.concatenate([self._lengths, np.zeros_like(self._lengths)])
+            self._ids = np.concatenate([self._ids, np.zeros_like(self._ids)])
+            for name, values in self._columns.items():
+                self._columns[name] = np.concatenate([values, np.zeros_like(values)])
+        self._ids[row] = doc_id
+        self._size += 1
+        self._tokens.append(tokens)
+        self._positions[doc_id] = row
+        self._lengths[row] = len(tokens)
+        for name, values in self._columns.items():
+            values[row] = attributes.get(name, 0)
+        self._total_length += len(tokens)
+        for token, count in Counter(tokens).items():
+            if token not in self._postings:
+                for trigram in trigrams(token):
+                    self._trigrams[trigram].add(token)
+            self._postings[token][row] = count
+            self._arrays.pop(token, None)
+
+    def _remove(self, doc_id: int) -> bool:
+        row = self._positions.pop(doc_id, None)
+        if row is None:
+            return False
+        tokens = self._tokens[row]
+        self._total_length -= len(tokens)
+        for token in set(tokens):
+            postings = self._postings[token]
+            del postings[row]
+            self._arrays.pop(token, None)
+            if not postings:
+                # Jeton sorti du vocabulaire : le retirer aussi de l'index des trigrammes
+                del self._postings[token]
+                for trigram in trigrams(token):
+                    self._trigrams[trigram].discard(token)
+                    if not self._trigrams[trigram]:
+                        del self._trigrams[trigram]
+        # La dernière ligne prend la place de la ligne libérée
+        last = self._size - 1
+        if row != last:
+            moved_id, moved_tokens = int(self._ids[last]), self._tokens[last]
+            self._ids[row], self._tokens[row] = moved_id, moved_tokens
+            self._positions[moved_id] = row
+            self._lengths[row] = self._lengths[last]
+            for values in self._columns.values():
+                values[row] = values[last]
+            for token in set(moved_tokens):
+                self._postings[token][row] = self._postings[token].pop(last)
+                self._arrays.pop(token, None)
+        self._size -= 1
+        self._tokens.pop()
+        return True
+
+    def _term_arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self._postings[term]
+            arrays = (np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                      np.fromiter(postings.values(), dtype=np.float32, count=len(postings)))
+            self._arrays[term] = arrays
+        return arrays
+
+    def expand(self, token: str) -> List[Tuple[str, float]]:
+        """Jetons du vocabulaire correspondant à un jeton de requête, avec leur poids"""
+        if token in self._postings:
+            return [(token, 1.0)]
+        query_trigrams = trigrams(token)
+        shared: Counter = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        candidates = []
+        for candidate, common in shared.items():
+            similarity = 2 * common / (len(query_trigrams) + len(trigrams(candidate)))
+            if similarity >= self.fuzzy_threshold:
+                candidates.append((candidate, similarity))
+        candidates.sort(key=lambda item: -item[1])
+        return candidates[:self.max_expansions]
+
+    def search(self, query: str, k: int = 10, allowed=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (ids, scores BM25) des documents correspondant à la requête.
+
+        `allowed` filtre les lignes avant l'extraction du top-k : masque
+        booléen aligné sur les lignes, ou fonction recevant l'index et
+        retournant ce masque (même contrat que `VectorIndex.search`).
+        """
+        with self._lock:
+            n_docs = self._size
+            terms = [(term, weight) for token in set(tokenize(query)) for term, weight in self.expand(token)] if n_docs else []
+            if not terms:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            lengths = self._lengths[:n_docs]
+            avg_length = self._total_length / n_docs
+            scores = np.zeros(n_docs, dtype=np.float32)
+            for term, weight in terms:
+                rows, tf = self._term_arrays(term)
+                idf = math.log(1 + (n_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+                norm = tf + self.k1 * (1 - self.b + self.b * lengths[rows] / avg_length)
+                scores[rows] += weight * idf * tf * (self.k1 + 1) / norm
+            if allowed is not None:
+                mask = allowed(self) if callable(allowed) else allowed
+                scores[~np.asarray(mask, dtype=bool)] = 0
+            matched = np.flatnonzero(scores > 0)
+            best = matched[top_k_indices(scores[matched], k)]
+            return self._ids[best], scores[best]
+
+class _ColumnSlice:
+    """Vue des colonnes d'attributs restreinte à une tranche d'entrées"""
+
+    def __init__(self, columns: Dict[str, np.ndarray], lo: int, hi: int):
+        self._columns, self._lo, self._hi = columns, lo, hi
+
+    def column(self, name: str) -> np.ndarray:
+        return self._columns[name][self._lo:self._hi]
+
+class PrefixIndex:
+    """Index de complétion par préfixe sur des noms (tableau trié en mémoire).
+
+    Chaque mot d'un nom normalisé donne une entrée « suffixe du nom à
+    partir de ce mot » : « Poutine québécoise » est trouvée par « pout »
+    comme par « queb ». Les entrées sont triées, de sorte que celles qui
+    commencent par un préfixe forment une tranche contiguë trouvée par
+    recherche dichotomique ; seuls ses éléments sont classés.
+
+    Les attributs numériques (`attributes`) sont stockés en colonnes
+    alignées sur les entrées, pour le classement (`order_by`) et le
+    filtrage (`allowed`, même contrat que `VectorIndex.search`, évalué sur
+    la seule tranche du préfixe).
+    """
+
+    def __init__(self, attributes: Iterable[str] = ()):
+        self._attributes = tuple(attributes)
+        self._lock = threading.RLock()
+        self._keys = np.empty(0, dtype=object)
+        self._ids = np.empty(0, dtype=np.int64)
+        # 1 si l'entrée commence au premier mot du nom (classée avant les autres)
+        self._starts = np.empty(0, dtype=np.int64)
+        self._columns: Dict[str, np.ndarray] = {name: np.empty(0, dtype=np.int64) for name in self._attributes}
+        self._names: Dict[int, str] = {}
+        self._values: Dict[int, Dict[str, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, doc_id: int) -> bool:
+        return doc_id in self._names
+
+    @property
+    def ids(self) -> np.ndarray:
+        return np.fromiter(self._names, dtype=np.int64, count=len(self._names))
+
+    def name(self, doc_id: int) -> str:
+        return self._names[int(doc_id)]
+
+    def value(self, name: str, doc_id: int, default: int = 0) -> int:
+        """Valeur d'un attribut pour un document"""
+        return self._values.get(int(doc_id), {}).get(name, default)
+
+    def column(self, name: str) -> np.ndarray:
+        """Valeurs d'un attribut, alignées sur les entrées"""
+        return self._columns[name]
+
+    @staticmethod
+    def _entries(text: str) -> List[Tuple[str, int]]:
+        words = normalize_text(text or "").split()
+        return [(" ".join(words[i:]), int(i == 0)) for i in range(len(words))]
+
+    def build(self, documents: Iterable[Tuple[int, str]], **attributes) -> None:
+        """Reconstruire l'index à partir de paires (id, nom)"""
+        documents = [(int(doc_id), text) for doc_id, text in documents]
+        keys, ids, starts, rows = [], [], [], []
+        for row, (doc_id, text) in enumerate(documents):
+            for key, start in self._entries(text):
+                keys.append(key)
+                ids.append(doc_id)
+                starts.append(start)
+                rows.append(row)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        rows = np.asarray(rows, dtype=np.int64)[order] if keys else np.empty(0, dtype=np.int64)
+        with self._lock:
+            self._keys = np.asarray([keys[i] for i in order], dtype=object)
+            self._ids = np.asarray(ids, dtype=np.int64)[order] if keys else np.empty(0, dtype=np.int64)
+            self._starts = np.asarray(starts, dtype=np.int64)[order] if keys else np.empty(0, dtype=np.int64)
+            columns = {name: np.asarray(attributes.get(name) or np.zeros(len(documents)), dtype=np.int64)
+                       for name in self._attributes}
+            for name, values in columns.items():
+                self._columns[name] = values[rows] if len(rows) else np.empty(0, dtype=np.int64)
+            self._names = {doc_id: text for doc_id, text in documents}
+            self._values = {doc_id: {name: int(values[row]) for name, values in columns.items()}
+                            for row, (doc_id, _) in enumerate(documents)}
+
+    def upsert(self, doc_id: int, text: str, **attributes) -> None:
+        """Ajouter ou remplacer un nom (insertion à sa place dans le tableau trié)"""
+        doc_id = int(doc_id)
+        with self._lock:
+            self._remove(doc_id)
+            for key, start in self._entries(text):
+                position = int(np.searchsorted(self._keys, key))
+                self._keys = np.insert(self._keys, position, key)
+                self._ids = np.insert(self._ids, position, doc_id)
+                self._starts = np.insert(self._starts, position, start)
+                for name in self._attributes:
+                    self._columns[name] = np.insert(self._columns[name], position, attributes.get(name, 0))
+            self._names[doc_id] = text
+            self._values[doc_id] = {name: int(attributes.get(name, 0)) for name in self._attributes}
+
+    def remove(self, doc_id: int) -> bool:
+        with self._lock:
+            return self._remove(int(doc_id))
+
+    def _remove(self, doc_id: int) -> bool:
+        if self._names.pop(doc_id, None) is None:
+            return False
+        self._values.pop(doc_id, None)
+        keep = self._ids != doc_id
+        self._keys, self._ids, self._starts = self._keys[keep], self._ids[keep], self._starts[keep]
+        for name in self._attributes:
+            self._columns[name] = self._columns[name][keep]
+        return True
+
+    def search(self, prefix: str, k: int = 10, order_by: Optional[str] = None, descending: bool = True,
+               allowed=None) -> np.ndarray:
+        """Ids des k noms dont un mot commence par `prefix`.
+
+        Les noms qui commencent par le préfixe passent en premier, puis
+        le classement suit la colonne `order_by` (décroissante par défaut).
+        """
+        prefix = normalize_text(prefix or "")
+        if not prefix:
+            return np.empty(0, dtype=np.int64)
+        with self._lock:
+            lo, hi = np.searchsorted(self._keys, [prefix, prefix + "\U0010ffff"])
+            candidates = np.arange(lo, hi)
+            if allowed is not None:
+                # Le filtre n'est évalué que sur la tranche du préfixe
+                mask = allowed(_ColumnSlice(self._columns, lo, hi)) if callable(allowed) else np.asarray(allowed)[lo:hi]
+                candidates = candidates[np.asarray(mask, dtype=bool)]
+            if not len(candidates):
+                return np.empty(0, dtype=np.int64)
+            # Noms qui commencent par le préfixe d'abord, puis l'attribut demandé : chaque groupe
+            # est classé séparément sur les valeurs entières (pas de clé combinée en flottant)
+            starts = self._starts[candidates] != 0
+            groups = (np.flatnonzero(starts), np.flatnonzero(~starts))
+            values = None
+            if order_by is not None:
+                values = self._columns[order_by][candidates]
+                values = values if descending else -values
+            ids = self._ids[candidates]
+            # Un même nom peut avoir plusieurs entrées dans la tranche : élargir jusqu'à k ids distincts
+            n = k
+            while True:
+                best = ids[np.concatenate([
+                    group[:n] if values is None else group[top_k_indices(values[group], n)] for group in groups
+                ])]
+                _, first = np.unique(best, return_index=True)
+                unique = best[np.sort(first)]
+                if len(unique) >= k or n >= len(candidates):
+                    return unique[:k]
+                n *= 2
@@ -1,10 +1,13 @@
 from fastapi import FastAPI, Depends
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlmodel import SQLModel
 from database import engine, create_db_and_tables
 from routers import aliments, utilisateurs, plans_repas, buffets
 from utils import load_initial_data
 from security import create_access_token
+from embedding import embedding_service, EMBEDDING_CACHE_PATH
+from search import ensure_pgvector_index
 from datetime import timedelta
 import os
 
@@ -28,6 +31,16 @@ async def on_startup():
     """Initialisation de l'application au démarrage"""
     # Créer les tables
     create_db_and_tables()
+    ensure_pgvector_index(engine)
+    
+    # Recharger le cache des embeddings de requêtes sauvegardé par le worker précédent
+    if EMBEDDING_CACHE_PATH and embedding_service.cache is not None:
+        nb = embedding_service.cache.load(EMBEDDING_CACHE_PATH)
+        print(f"✅ {nb} embeddings de requêtes rechargés depuis {EMBEDDING_CACHE_PATH}")
+    
+    # Précharger le modèle d'embedding en arrière-plan sans bloquer le démarrage
+    if os.getenv("EMBEDDING_WARMUP", "true").lower() == "true":
+        embedding_service.warmup()
     
     # Charger les données initiales si configuré
     if os.getenv("LOAD_INITIAL_DATA", "false").lower() == "true":
@@ -36,6 +49,12 @@ async def on_startup():
             load_initial_data(session)
             print("✅ Données initiales chargées avec succès")
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Sauvegarder le cache des embeddings de requêtes à l'arrêt"""
+    if EMBEDDING_CACHE_PATH and embedding_service.cache is not None:
+        embedding_service.cache.save(EMBEDDING_CACHE_PATH)
+
 @app.get("/")
 async def root():
     """Point d'entrée de l'API"""
@@ -49,7 +68,15 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Point de contrôle de santé de l'API"""
-    return {"status": "healthy", "message": "API opérationnelle"}
+    return {"status": "healthy", "message": "API opérationnelle", "embedding": embedding_service.status()}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Indiquer si le modèle d'embedding est chargé (503 tant qu'il ne l'est pas)"""
+    status = embedding_service.status()
+    if not embedding_service.is_ready:
+        return JSONResponse(status_code=503, content={"status": "not_ready", "embedding": status})
+    return {"status": "ready", "embedding": status}
 
 if __name__ == "__main__":
     import uvicorn
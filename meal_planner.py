@@ -0,0 +1,235 @@
+import math
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession, object_session
+from sqlmodel import Session, select
+from models import Aliment, aliment_signature
+from allergen_cache import AllergenSafeCache
+
+# Fichier de configuration partagé (section « recommendations »)
+CONFIG_PATH = os.getenv("CONFIG_PATH", "config.yaml")
+# Aliments par repas au plus, nombre d'apparitions d'un même aliment dans un plan
+# (relevé automatiquement si le catalogue est trop petit) et essais par repas
+PLAN_ALIMENTS_PAR_REPAS = int(os.getenv("PLAN_ALIMENTS_PAR_REPAS", 3))
+PLAN_MAX_REPETITIONS = int(os.getenv("PLAN_MAX_REPETITIONS", 1))
+PLAN_ESSAIS_PAR_REPAS = int(os.getenv("PLAN_ESSAIS_PAR_REPAS", 8))
+# Délai entre deux vérifications du catalogue en base (écritures d'un autre worker)
+PLAN_CATALOGUE_REFRESH_SECONDS = float(os.getenv("PLAN_CATALOGUE_REFRESH_SECONDS", 5))
+
+JOURS_SEMAINE = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
+NOMS_REPAS = ["Petit-déjeuner", "Déjeuner", "Dîner", "Collation"]
+
+def nom_jour(index: int) -> str:
+    return JOURS_SEMAINE[index] if index < len(JOURS_SEMAINE) else f"Jour {index + 1}"
+
+def nom_repas(index: int) -> str:
+    return NOMS_REPAS[index] if index < len(NOMS_REPAS) else f"Repas {index + 1}"
+
+class PlanLimits(NamedTuple):
+    """Contraintes d'un plan (section « recommendations » de config.yaml)"""
+    min_calories_per_meal: int = 300
+    max_calories_per_meal: int = 800
+    max_meals_per_day: int = 3
+    days_per_plan: int = 7
+
+def load_plan_limits(path: str = CONFIG_PATH) -> PlanLimits:
+    """Lire les contraintes de plan dans config.yaml (valeurs par défaut si absent)"""
+    if not os.path.exists(path):
+        return PlanLimits()
+    import yaml
+    with open(path, encoding="utf-8") as f:
+        section = (yaml.safe_load(f) or {}).get("recommendations") or {}
+    return PlanLimits(**{name: int(section[name]) for name in PlanLimits._fields if name in section})
+
+PLAN_LIMITS = load_plan_limits()
+
+class MealPlanner:
+    """Planificateur de repas sous contraintes sur un catalogue en colonnes NumPy.
+
+    Les aliments admissibles (sans allergène de l'utilisateur, pas plus
+    caloriques qu'un repas) sont filtrés en une opération, puis triés par
+    calories : les aliments qui complètent un repas dans les bornes
+    forment une tranche contiguë trouvée par recherche dichotomique.
+    Chaque repas est rempli aliment par aliment en tirant dans la tranche
+    compatible avec le budget restant (sac à dos randomisé), sans
+    dépasser le nombre de répétitions autorisé ; un repas qui reste hors
+    bornes après plusieurs essais est réparé par recherche locale (échange
+    d'un aliment contre le meilleur remplaçant).
+    """
+
+    def __init__(self, ids: Sequence[int], calories: Sequence[int], allergenes_mask: Sequence[int],
+                 limits: PlanLimits = PLAN_LIMITS, max_items: int = PLAN_ALIMENTS_PAR_REPAS,
+                 max_repetitions: int = PLAN_MAX_REPETITIONS):
+        self.limits = limits
+        self.max_items = max_items
+        self.max_repetitions = max_repetitions
+        calories = np.asarray(calories, dtype=np.int64)
+        order = np.argsort(calories, kind="stable")
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.calories = calories[order]
+        self.masks = np.asarray(allergenes_mask, dtype=np.int64)[order]
+        # Candidats (lignes, calories) par masque d'allergènes : le catalogue ne change pas après construction
+        self.candidates = AllergenSafeCache(self._candidates)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getstate__(self) -> dict:
+        # Transmis aux processus de travail sans le cache (ni son verrou)
+        state = self.__dict__.copy()
+        del state["candidates"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.candidates = AllergenSafeCache(self._candidates)
+
+    def _candidates(self, mask: int) -> Tuple[np.ndarray, np.ndarray]:
+        admissible = ((self.masks & mask) == 0) & (self.calories > 0) & (self.calories <= self.limits.max_calories_per_meal)
+        rows = np.flatnonzero(admissible)
+        return rows, self.calories[rows]
+
+    def plan(self, allergy_mask: int = 0, rng: Optional[np.random.Generator] = None) -> List[List[List[int]]]:
+        """Ids d'aliments par jour puis par repas : days_per_plan x max_meals_per_day listes"""
+        return self.plan_many(allergy_mask, 1, rng)[0]
+
+    def plan_many(self, allergy_mask: int, count: int, rng: Optional[np.random.Generator] = None) -> List[List[List[List[int]]]]:
+        """`count` plans indépendants pour un même masque d'allergènes (candidats filtrés une seule fois)"""
+        rng = rng or np.random.default_rng()
+        rows, calories = self.candidates.get(allergy_mask)
+        per_day, days = self.limits.max_meals_per_day, self.limits.days_per_plan
+        if len(rows) == 0:
+            return [[[[] for _ in range(per_day)] for _ in range(days)] for _ in range(count)]
+        # Assez de répétitions pour remplir tous les repas d'un petit catalogue
+        cap = max(self.max_repetitions, math.ceil(days * per_day * 2 / len(rows)))
+        plans = []
+        for _ in range(count):
+            uses = np.zeros(len(rows), dtype=np.int32)
+            picked = [self._meal(calories, uses, cap, rng) for _ in range(days * per_day)]
+            plans.append([[[int(self.ids[rows[i]]) for i in picked[d * per_day + m]] for m in range(per_day)]
+                          for d in range(days)])
+        return plans
+
+    def _meal(self, calories: np.ndarray, uses: np.ndarray, cap: int, rng: np.random.Generator) -> List[int]:
+        lo, hi = self.limits.min_calories_per_meal, self.limits.max_calories_per_meal
+        best: List[int] = []
+        for _ in range(PLAN_ESSAIS_PAR_REPAS):
+            items = self._fill(calories, uses, cap, rng, lo, hi)
+            total = int(calories[items].sum()) if items else 0
+            if lo <= total <= hi:
+                uses[items] += 1
+                return items
+            if not best or abs(total - (lo + hi) / 2) < abs(int(calories[best].sum()) - (lo + hi) / 2):
+                best = items
+        best = self._repair(calories, uses, cap, rng, best, lo, hi)
+        uses[best] += 1
+        return best
+
+    def _pick(self, calories: np.ndarray, uses: np.ndarray, cap: int, rng: np.random.Generator,
+              low: float, high: float, taken: List[int]) -> Optional[int]:
+        """Un aliment au hasard parmi ceux dont les calories sont dans [low, high] et encore disponibles"""
+        start = int(np.searchsorted(calories, low, side="left"))
+        stop = int(np.searchsorted(calories, high, side="right"))
+        if start >= stop:
+            return None
+        # Quelques tirages directs suffisent presque toujours ; sinon, balayage de la tranche
+        for i in rng.integers(start, stop, size=min(8, stop - start)):
+            if uses[i] < cap and int(i) not in taken:
+                return int(i)
+        free = [start + int(i) for i in np.flatnonzero(uses[start:stop] < cap) if start + int(i) not in taken]
+        return free[int(rng.integers(len(free)))] if free else None
+
+    def _fill(self, calories: np.ndarray, uses: np.ndarray, cap: int, rng: np.random.Generator, lo: int, hi: int) -> List[int]:
+        # Nombre d'aliments visé : 1 à max_items, le dernier doit faire entrer le total dans les bornes
+        items: List[int] = []
+        total = 0
+        target = int(rng.integers(1, self.max_items + 1))
+        for slot in range(target):
+            last = slot == target - 1
+            low = lo - total if last else 0
+            # Garder de la place pour les aliments suivants (au moins le plus petit du catalogue chacun)
+            high = hi - total - (0 if last else (target - slot - 1) * int(calories[0]))
+            i = self._pick(calories, uses, cap, rng, low, high, items)
+            if i is None:
+                break
+            items.append(i)
+            total += int(calories[i])
+        return items
+
+    def _repair(self, calories: np.ndarray, uses: np.ndarray, cap: int, rng: np.random.Generator,
+                items: List[int], lo: int, hi: int) -> List[int]:
+        """Recherche locale : compléter le repas ou échanger un de ses aliments pour entrer dans les bornes
+        (une répétition de plus est tolérée plutôt que de laisser le repas hors bornes)"""
+        items = list(items)
+        total = int(calories[items].sum()) if items else 0
+        if len(items) < self.max_items:
+            for limit in (cap, cap + 1):
+                i = self._pick(calories, uses, limit, rng, lo - total, hi - total, items)
+                if i is not None:
+                    return items + [i]
+        for position in range(len(items)):
+            rest = total - int(calories[items[position]])
+            for limit in (cap, cap + 1):
+                i = self._pick(calories, uses, limit, rng, lo - rest, hi - rest, items)
+                if i is not None:
+                    items[position] = i
+                    return items
+        return items
+
+def load_planner(session: Session) -> MealPlanner:
+    """Planificateur sur le catalogue courant (ids, calories, masque d'allergènes, sans embeddings)"""
+    catalogue = session.exec(select(Aliment.id, Aliment.calories, Aliment.allergenes_mask)).all()
+    return MealPlanner(*zip(*catalogue)) if catalogue else MealPlanner([], [], [])
+
+# Planificateur partagé par base : (planificateur, signature du catalogue, dernière vérification)
+_planners: Dict[str, Tuple[MealPlanner, tuple, float]] = {}
+
+def get_planner(session: Session) -> MealPlanner:
+    """Planificateur partagé d'une base (une instance par URL de moteur).
+
+    Ses candidats par ensemble d'allergies restent en cache d'un plan à
+    l'autre. Il est écarté au commit de chaque écriture d'aliment du
+    worker courant (événements ORM) et rechargé lorsque le nombre
+    d'aliments, l'id maximal ou la somme des versions en base ne
+    correspondent plus (écritures d'un autre worker ou des scripts de
+    backfill).
+    """
+    key = str(session.get_bind().engine.url)
+    entry = _planners.get(key)
+    now = time.monotonic()
+    if entry is not None and now - entry[2] < PLAN_CATALOGUE_REFRESH_SECONDS:
+        return entry[0]
+    signature = aliment_signature(session)
+    planner = entry[0] if entry is not None and entry[1] == signature else load_planner(session)
+    _planners[key] = (planner, signature, now)
+    return planner
+
+def invalidate_planner(bind) -> None:
+    """Écarter le planificateur d'une base (après des écritures groupées hors ORM)"""
+    _planners.pop(str(bind.engine.url), None)
+
+# Bases dont le planificateur est à écarter au commit de la session (un rollback ne change rien)
+_PLANNERS_TO_INVALIDATE = "planificateurs_a_invalider"
+
+@event.listens_for(Aliment, "after_insert")
+@event.listens_for(Aliment, "after_update")
+@event.listens_for(Aliment, "after_delete")
+def _invalidate_planner(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        invalidate_planner(connection)
+    else:
+        session.info.setdefault(_PLANNERS_TO_INVALIDATE, set()).add(str(connection.engine.url))
+
+@event.listens_for(OrmSession, "after_commit")
+def _invalidate_planners_after_commit(session):
+    for key in session.info.pop(_PLANNERS_TO_INVALIDATE, ()):
+        _planners.pop(key, None)
+
+@event.listens_for(OrmSession, "after_rollback")
+def _keep_planners_after_rollback(session):
+    session.info.pop(_PLANNERS_TO_INVALIDATE, None)
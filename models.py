@@ -1,8 +1,53 @@
 from typing import List, Optional
-from sqlmodel import SQLModel, Field, Relationship
+from sqlmodel import SQLModel, Field, Relationship, select
 from datetime import datetime , date
 import json
-from sqlalchemy import Column, JSON
+import os
+import numpy as np
+from sqlalchemy import BigInteger, Column, Index, Integer, JSON, LargeBinary, event, func
+from sqlalchemy.types import TypeDecorator
+from allergens import allergen_mask
+from text_utils import parse_allergenes
+
+# Dimension des embeddings (384 pour all-MiniLM-L6-v2)
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", 384))
+
+class EmbeddingVector(TypeDecorator):
+    """Colonne d'embedding : type vector de pgvector sur PostgreSQL, blob float32 ailleurs (SQLite)"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        super().__init__()
+        self.dim = dim
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            from pgvector.sqlalchemy import Vector
+            return dialect.type_descriptor(Vector(self.dim))
+        return dialect.type_descriptor(LargeBinary())
+
+    def bind_processor(self, dialect):
+        if dialect.name == "postgresql" and dialect.driver == "psycopg":
+            # psycopg 3 : le tableau numpy est transmis tel quel et encodé en binaire
+            # par le dumper pgvector enregistré sur chaque connexion (database.py)
+            return lambda value: None if value is None else np.asarray(value, dtype=np.float32)
+        return super().bind_processor(dialect)
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        vector = np.asarray(value, dtype=np.float32)
+        if dialect.name == "postgresql":
+            return vector
+        return vector.tobytes()
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name == "postgresql":
+            return np.asarray(value, dtype=np.float32)
+        return np.frombuffer(value, dtype=np.float32)
 
 class Aliment(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -11,6 +56,42 @@ class Aliment(SQLModel, table=True):
     calories: int
     allergenes: Optional[List[str]] = Field(default_factory=list, sa_column=Column(JSON))
     image_url: Optional[str] = None
+    embedding: Optional[List[float]] = Field(default=None, sa_column=Column(EmbeddingVector()))
+    # Nom à partir duquel l'embedding a été calculé (pour détecter les renommages)
+    embedding_nom: Optional[str] = None
+    # Allergènes encodés en masque de bits (voir allergens.py), tenu à jour à chaque écriture
+    allergenes_mask: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, server_default="0"))
+    # Incrémenté à chaque modification : les caches en mémoire des autres workers comparent sa somme
+    version: int = Field(default=0, sa_column=Column(Integer, nullable=False, server_default="0"))
+
+@event.listens_for(Aliment, "before_insert")
+def _update_allergenes_mask(mapper, connection, target):
+    target.allergenes_mask = allergen_mask(parse_allergenes(target.allergenes))
+
+@event.listens_for(Aliment, "before_update")
+def _update_allergenes_mask_and_version(mapper, connection, target):
+    _update_allergenes_mask(mapper, connection, target)
+    target.version = (target.version or 0) + 1
+
+def aliment_signature(session, *conditions) -> tuple:
+    """(nombre d'aliments, id maximal, somme des versions) en base : change à chaque création,
+    suppression ou modification, y compris par un autre worker"""
+    return tuple(session.exec(
+        select(func.count(Aliment.id), func.max(Aliment.id), func.coalesce(func.sum(Aliment.version), 0)).where(*conditions)
+    ).one())
+
+class AlimentSimilaire(SQLModel, table=True):
+    """Arête du graphe des k plus proches voisins (embeddings) d'un aliment"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    aliment_id: int = Field(foreign_key="aliment.id")
+    similaire_id: int = Field(foreign_key="aliment.id")
+    score: float
+
+# Lecture des voisins d'un aliment par ordre de similarité, des listes où figure un aliment
+# et du plus petit score du graphe (mise à jour incrémentale)
+Index("ix_alimentsimilaire_aliment_score", AlimentSimilaire.aliment_id, AlimentSimilaire.score.desc())
+Index("ix_alimentsimilaire_similaire", AlimentSimilaire.similaire_id)
+Index("ix_alimentsimilaire_score", AlimentSimilaire.score)
 
 class Utilisateur(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -29,10 +110,16 @@ class PlanRepas(SQLModel, table=True):
     repas: List["RepasJour"] = Relationship(back_populates="plan_repas")
     utilisateur: Optional[Utilisateur] = Relationship(back_populates="plans_repas")
 
+# Un seul plan par utilisateur et par semaine (sert aussi aux lectures par utilisateur).
+# create_all ne l'ajoute pas à une table existante : ramener les semaines au lundi, supprimer
+# les doublons puis CREATE UNIQUE INDEX uq_planrepas_utilisateur_semaine ON planrepas (utilisateur_id, semaine);
+Index("uq_planrepas_utilisateur_semaine", PlanRepas.utilisateur_id, PlanRepas.semaine, unique=True)
+
 class RepasJour(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    plan_repas_id: int = Field(foreign_key="planrepas.id")
+    plan_repas_id: int = Field(foreign_key="planrepas.id", index=True)
     jour: str
+    repas: Optional[str] = None  # Petit-déjeuner, Déjeuner, Dîner...
     aliments: List["AlimentRepasJour"] = Relationship(back_populates="repas_jour")
     plan_repas: Optional[PlanRepas] = Relationship(back_populates="repas")
 
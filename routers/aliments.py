@@ -2,8 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlmodel import Session
 from typing import List, Optional
 from database import get_session
-from schemas import AlimentCreate, AlimentRead
-from services import create_aliment, get_aliment, search_aliments, get_all_aliments, get_aliments_by_categorie, get_aliments_low_calories, recommend_aliments
+from schemas import AlimentCreate, AlimentRead, AlimentSuggestion, RecommandationLot
+from services import create_aliment, get_aliment, search_aliments, autocomplete_aliments, get_all_aliments, get_aliments_by_categorie, get_aliments_low_calories, recommend_aliments, recommend_aliments_batch, get_aliments_similaires
 from security import get_current_active_user
 
 router = APIRouter(prefix="/aliments", tags=["aliments"])
@@ -16,6 +16,18 @@ def create_aliment_route(aliment: AlimentCreate, session: Session = Depends(get_
     except Exception as e:
         raise HTTPException(status_code=500, detail="Erreur lors de la création de l'aliment")
 
+@router.get("/autocomplete", response_model=List[AlimentSuggestion])
+def autocomplete_aliments_route(
+    prefix: str = Query(..., min_length=1, description="Début du nom (casse et accents ignorés)"),
+    allergies: Optional[str] = Query(None, description="Allergies séparées par des virgules"),
+    limit: int = Query(10, ge=1, le=50),
+    tri: str = Query("popularite", pattern="^(popularite|calories)$", description="popularite ou calories"),
+    session: Session = Depends(get_session)
+):
+    """Suggestions d'aliments pour la saisie, sans embedding ni requête SQL par frappe"""
+    allergies_list = allergies.split(",") if allergies else []
+    return autocomplete_aliments(session, prefix, allergies_list, limit, tri)
+
 @router.get("/{aliment_id}", response_model=AlimentRead)
 def get_aliment_route(aliment_id: int, session: Session = Depends(get_session)):
     """Récupérer un aliment par son ID"""
@@ -24,11 +36,27 @@ def get_aliment_route(aliment_id: int, session: Session = Depends(get_session)):
         raise HTTPException(status_code=404, detail="Aliment non trouvé")
     return aliment
 
+@router.get("/{aliment_id}/similaires", response_model=List[AlimentRead])
+def get_aliments_similaires_route(
+    aliment_id: int,
+    limit: int = Query(10, ge=1, le=50),
+    session: Session = Depends(get_session)
+):
+    """Aliments les plus proches d'un aliment, lus dans le graphe précalculé"""
+    if not get_aliment(session, aliment_id):
+        raise HTTPException(status_code=404, detail="Aliment non trouvé")
+    return get_aliments_similaires(session, aliment_id, limit)
+
 @router.get("/", response_model=List[AlimentRead])
-def search_aliments_route(q: str = Query("", description="Recherche sémantique"), allergies: Optional[str] = Query(None), session: Session = Depends(get_session)):
-    """Rechercher des aliments par requête sémantique"""
+def search_aliments_route(
+    q: str = Query("", description="Recherche"),
+    allergies: Optional[str] = Query(None),
+    mode: str = Query("semantic", pattern="^(semantic|lexical|hybrid)$", description="semantic, lexical (noms) ou hybrid (fusion RRF)"),
+    session: Session = Depends(get_session)
+):
+    """Rechercher des aliments par requête sémantique, lexicale ou hybride"""
     allergies_list = allergies.split(",") if allergies else []
-    return search_aliments(session, q, allergies_list)
+    return search_aliments(session, q, allergies_list, mode=mode)
 
 @router.get("/tous/", response_model=List[AlimentRead])
 def get_all_aliments_route(session: Session = Depends(get_session)):
@@ -50,8 +78,16 @@ def get_recommendations_route(
     query: str = Query(..., description="Requête pour les recommandations"),
     allergies: Optional[str] = Query(None, description="Allergies séparées par des virgules"),
     max_calories: int = Query(800, description="Calories maximum"),
+    mmr_lambda: Optional[float] = Query(None, ge=0, le=1, description="Compromis pertinence / diversité (1 : pertinence seule)"),
     session: Session = Depends(get_session)
 ):
     """Obtenir des recommandations d'aliments personnalisées"""
     allergies_list = allergies.split(",") if allergies else []
-    return recommend_aliments(session, query, allergies_list, max_calories) 
\ No newline at end of file
+    return recommend_aliments(session, query, allergies_list, max_calories, mmr_lambda)
+
+@router.post("/recommandations/lot", response_model=List[List[AlimentRead]])
+def get_recommendations_batch_route(lot: RecommandationLot, session: Session = Depends(get_session)):
+    """Recommandations pour plusieurs requêtes en un appel (une liste de résultats par requête, dans l'ordre)"""
+    if len(lot.requetes) > 10000:
+        raise HTTPException(status_code=413, detail="Au plus 10000 requêtes par lot")
+    return recommend_aliments_batch(session, [r.dict() for r in lot.requetes], lot.top_k)
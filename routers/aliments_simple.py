@@ -2,9 +2,12 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlmodel import Session, select
 from typing import List, Optional
 from database_simple import get_session
-from schemas import AlimentCreate, AlimentRead
+from schemas import AlimentCreate, AlimentRead, AlimentSuggestion
 from models import Aliment
 from security_simple import get_current_active_user
+from search import search_aliments, search_aliments_lexical, autocomplete_aliments
+from embedding import embedding_service
+from text_utils import parse_allergenes
 import json
 
 router = APIRouter(prefix="/aliments", tags=["aliments"])
@@ -16,6 +19,12 @@ def create_aliment_route(aliment: AlimentCreate, session: Session = Depends(get_
         aliment_data = aliment.dict()
         # Convertir les allergènes en JSON string
         aliment_data["allergenes"] = json.dumps(aliment_data["allergenes"])
+        try:
+            aliment_data["embedding"] = embedding_service.embed(aliment_data["nom"])
+            aliment_data["embedding_nom"] = aliment_data["nom"]
+        except (ImportError, OSError) as e:
+            # Modèle indisponible : l'embedding sera calculé par scripts/backfill_embeddings.py
+            print(f"⚠️ Embedding non calculé pour {aliment_data['nom']} ({e})")
         aliment_obj = Aliment(**aliment_data)
         session.add(aliment_obj)
         session.commit()
@@ -24,6 +33,18 @@ def create_aliment_route(aliment: AlimentCreate, session: Session = Depends(get_
     except Exception as e:
         raise HTTPException(status_code=500, detail="Erreur lors de la création de l'aliment")
 
+@router.get("/autocomplete", response_model=List[AlimentSuggestion])
+def autocomplete_aliments_route(
+    prefix: str = Query(..., min_length=1, description="Début du nom (casse et accents ignorés)"),
+    allergies: Optional[str] = Query(None, description="Allergies séparées par des virgules"),
+    limit: int = Query(10, ge=1, le=50),
+    tri: str = Query("popularite", pattern="^(popularite|calories)$", description="popularite ou calories"),
+    session: Session = Depends(get_session)
+):
+    """Suggestions d'aliments pour la saisie, sans embedding ni requête SQL par frappe"""
+    allergies_list = allergies.split(",") if allergies else []
+    return autocomplete_aliments(session, prefix, allergies_list, limit, tri)
+
 @router.get("/{aliment_id}", response_model=AlimentRead)
 def get_aliment_route(aliment_id: int, session: Session = Depends(get_session)):
     """Récupérer un aliment par son ID"""
@@ -33,25 +54,36 @@ def get_aliment_route(aliment_id: int, session: Session = Depends(get_session)):
     return aliment
 
 @router.get("/", response_model=List[AlimentRead])
-def search_aliments_route(q: str = Query("", description="Recherche par nom"), allergies: Optional[str] = Query(None), session: Session = Depends(get_session)):
-    """Rechercher des aliments par nom (version simplifiée)"""
-    query = select(Aliment)
+def search_aliments_route(
+    q: str = Query("", description="Recherche"),
+    allergies: Optional[str] = Query(None),
+    mode: str = Query("lexical", pattern="^(semantic|lexical|hybrid)$", description="lexical (noms, par défaut), semantic ou hybrid (fusion RRF)"),
+    session: Session = Depends(get_session)
+):
+    """Rechercher des aliments par nom (index inversé, par défaut), par requête sémantique ou hybride (index en mémoire)"""
+    allergies_list = allergies.split(",") if allergies else []
     if q:
-        query = query.where(Aliment.nom.contains(q))
-    
-    aliments = session.exec(query).all()
+        try:
+            aliments = search_aliments(session, q, allergies_list, mode=mode)
+        except (ImportError, OSError) as e:
+            # Modèle d'embedding indisponible : repli sur l'index lexical des noms
+            print(f"⚠️ Recherche sémantique indisponible ({e}), repli sur la recherche par nom")
+            aliments = search_aliments_lexical(session, q, allergies_list)
+        if not aliments and mode != "lexical":
+            # Aucun vecteur indexé (aliments sans embedding) : repli sur la recherche par nom
+            aliments = search_aliments_lexical(session, q, allergies_list)
+    else:
+        aliments = session.exec(select(Aliment)).all()
     
-    # Filtrer par allergies si spécifiées
-    if allergies:
-        allergies_list = allergies.split(",")
-        filtered_aliments = []
-        for aliment in aliments:
-            aliment_allergenes = json.loads(aliment.allergenes)
-            if not set(aliment_allergenes) & set(allergies_list):
-                filtered_aliments.append(aliment)
-        aliments = filtered_aliments
+    # Filtrer par allergies et convertir les allergènes JSON en listes pour la réponse
+    filtered_aliments = []
+    for aliment in aliments:
+        aliment_allergenes = parse_allergenes(aliment.allergenes)
+        if not set(aliment_allergenes) & set(allergies_list):
+            aliment.allergenes = aliment_allergenes
+            filtered_aliments.append(aliment)
     
-    return aliments
+    return filtered_aliments
 
 @router.get("/tous/", response_model=List[AlimentRead])
 def get_all_aliments_route(session: Session = Depends(get_session)):
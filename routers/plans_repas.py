@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from sqlmodel import Session
-from typing import List
+from typing import List, Optional
 from database import get_session
 from schemas import PlanRepasCreate, PlanRepasRead
 from services import generate_plan_repas, get_plan_repas_by_id, get_plans_repas_utilisateur
-from security import get_current_active_user
+from generation_plans import debut_semaine, generate_plans_lot
+from security import get_current_active_superuser, get_current_active_user
 import datetime
 
 router = APIRouter(prefix="/plans_repas", tags=["plans_repas"])
@@ -13,7 +14,7 @@ router = APIRouter(prefix="/plans_repas", tags=["plans_repas"])
 def generate_plan_repas_route(plan: PlanRepasCreate, session: Session = Depends(get_session), current_user=Depends(get_current_active_user)):
     """Générer un plan de repas hebdomadaire pour un utilisateur"""
     try:
-        plan_repas = generate_plan_repas(session, plan.utilisateur_id, plan.semaine)
+        plan_repas = generate_plan_repas(session, plan.utilisateur_id, plan.semaine, plan.regenerate)
         return plan_repas
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -35,17 +36,26 @@ def get_plans_repas_utilisateur_route(utilisateur_id: int, session: Session = De
     return plans
 
 @router.post("/generer-auto/{utilisateur_id}")
-def generer_plan_repas_auto_route(utilisateur_id: int, session: Session = Depends(get_session), current_user=Depends(get_current_active_user)):
-    """Générer automatiquement un plan de repas pour la semaine en cours"""
-    semaine_courante = datetime.date.today()
-    # Ajuster au début de la semaine (lundi)
-    jours_jusquau_lundi = semaine_courante.weekday()
-    debut_semaine = semaine_courante - datetime.timedelta(days=jours_jusquau_lundi)
-    
+def generer_plan_repas_auto_route(utilisateur_id: int, regenerate: bool = False, session: Session = Depends(get_session), current_user=Depends(get_current_active_user)):
+    """Générer automatiquement un plan de repas pour la semaine en cours (plan existant retourné, sauf `regenerate`)"""
     try:
-        plan_repas = generate_plan_repas(session, utilisateur_id, debut_semaine)
+        plan_repas = generate_plan_repas(session, utilisateur_id, debut_semaine(), regenerate)
         return {"message": "Plan de repas généré avec succès", "plan_id": plan_repas.id}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail="Erreur lors de la génération du plan de repas") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Erreur lors de la génération du plan de repas") 
+
+def _generer_plans_lot(bind, semaine: datetime.date) -> None:
+    # Tâche de fond : sa propre session, la session de la requête est fermée avec la réponse
+    with Session(bind) as session:
+        stats = generate_plans_lot(session, semaine)
+    print(f"✅ {stats['plans']} plans pour la semaine du {stats['semaine']} ({stats['existants']} déjà générés)")
+
+@router.post("/generer-lot", status_code=202)
+def generer_plans_lot_route(background_tasks: BackgroundTasks, semaine: Optional[datetime.date] = None, session: Session = Depends(get_session), current_user=Depends(get_current_active_superuser)):
+    """Lancer en tâche de fond la génération des plans de la semaine (lundi de la semaine courante par défaut)
+    des utilisateurs qui n'en ont pas encore (administrateurs ; remplacement via scripts/generate_plans.py --regenerate)"""
+    semaine = debut_semaine(semaine)
+    background_tasks.add_task(_generer_plans_lot, session.get_bind(), semaine)
+    return {"message": "Génération des plans lancée", "semaine": semaine}
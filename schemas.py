@@ -1,5 +1,5 @@
 from typing import List, Optional
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 import datetime
 
 class AlimentBase(BaseModel):
@@ -17,6 +17,22 @@ class AlimentRead(AlimentBase):
     class Config:
         from_attributes = True
 
+class AlimentSuggestion(BaseModel):
+    id: int
+    nom: str
+    categorie: str
+    calories: int
+
+class RecommandationRequete(BaseModel):
+    query: str
+    allergies: List[str] = []
+    max_calories: Optional[int] = 800
+
+class RecommandationLot(BaseModel):
+    requetes: List[RecommandationRequete]
+    # Même borne que la route unitaire : la matrice des scores du lot reste bornée
+    top_k: int = Field(10, ge=1, le=50)
+
 class UtilisateurBase(BaseModel):
     nom: str
     email: EmailStr
@@ -35,6 +51,7 @@ class UtilisateurRead(UtilisateurBase):
 class PlanRepasCreate(BaseModel):
     utilisateur_id: int
     semaine: datetime.date
+    regenerate: bool = False  # Remplacer le plan existant de la semaine
 
 class PlanRepasRead(BaseModel):
     id: int
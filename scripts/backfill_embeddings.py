@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Calculer les embeddings des aliments qui n'en ont pas (ou dont le nom a changé),
+après avoir recalculé les masques d'allergènes écrits hors ORM.
+
+Usage (depuis la racine du projet) :
+    python -m scripts.backfill_embeddings --batch-size 256 --commit-every 2048
+    python -m scripts.backfill_embeddings --database-url sqlite:///./nutrition_test.db
+"""
+
+import argparse
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill des embeddings d'aliments")
+    parser.add_argument("--database-url", default=None, help="URL de la base (par défaut DATABASE_URL)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Taille des lots d'encodage")
+    parser.add_argument("--commit-every", type=int, default=2048, help="Nombre de lignes par transaction")
+    parser.add_argument("--force", action="store_true", help="Recalculer tous les embeddings")
+    args = parser.parse_args()
+
+    from sqlmodel import Session, create_engine
+    from database import engine, create_db_and_tables
+    from services import backfill_allergenes_masks, backfill_embeddings
+
+    if args.database_url:
+        engine = create_engine(args.database_url)
+    else:
+        create_db_and_tables()
+
+    debut = time.perf_counter()
+    with Session(engine) as session:
+        masques = backfill_allergenes_masks(session, args.commit_every)
+        print(f"✅ {masques} masques d'allergènes recalculés")
+        total = backfill_embeddings(session, args.batch_size, args.commit_every, args.force)
+    duree = time.perf_counter() - debut
+    print(f"✅ {total} embeddings calculés en {duree:.1f}s ({total / duree if duree else 0:.0f} aliments/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Reconstruire le graphe des aliments similaires (table alimentsimilaire).
+
+Usage (depuis la racine du projet) :
+    python -m scripts.build_similarites
+    python -m scripts.build_similarites --database-url sqlite:///./nutrition.db -k 20
+    python -m scripts.build_similarites --manquants
+"""
+
+import argparse
+
+def main():
+    parser = argparse.ArgumentParser(description="Graphe des k plus proches voisins des aliments")
+    parser.add_argument("--database-url", default=None, help="URL de la base (par défaut DATABASE_URL)")
+    parser.add_argument("-k", type=int, default=None, help="Voisins conservés par aliment")
+    parser.add_argument("--commit-every", type=int, default=4096, help="Aliments traités par transaction")
+    parser.add_argument("--manquants", action="store_true",
+                        help="Calculer seulement les listes manquantes (aliments créés hors de l'API)")
+    args = parser.parse_args()
+
+    from sqlmodel import Session, SQLModel, create_engine
+    from database import engine, create_db_and_tables
+    from similarites import build_similarites, SIMILAIRES_K
+
+    if args.database_url:
+        engine = create_engine(args.database_url)
+        SQLModel.metadata.create_all(engine)
+    else:
+        create_db_and_tables()
+
+    with Session(engine) as session:
+        stats = build_similarites(session, args.k or SIMILAIRES_K, args.commit_every, missing_only=args.manquants)
+    print(f"✅ {stats['aretes']} voisins pour {stats['aliments']} aliments en {stats['seconds']:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Générer les plans de repas de la semaine pour tous les utilisateurs.
+
+Usage (depuis la racine du projet) :
+    python -m scripts.generate_plans
+    python -m scripts.generate_plans --semaine 2024-01-01 --workers 8 --users-per-commit 2000
+"""
+
+import argparse
+import datetime
+
+def main():
+    parser = argparse.ArgumentParser(description="Plans de repas hebdomadaires de tous les utilisateurs")
+    parser.add_argument("--database-url", default=None, help="URL de la base (par défaut DATABASE_URL)")
+    parser.add_argument("--semaine", type=datetime.date.fromisoformat, default=None,
+                        help="Une date de la semaine visée (par défaut la semaine courante)")
+    parser.add_argument("--workers", type=int, default=None, help="Processus de planification")
+    parser.add_argument("--users-per-commit", type=int, default=None, help="Utilisateurs écrits par transaction")
+    parser.add_argument("--regenerate", action="store_true", help="Remplacer les plans déjà générés pour la semaine")
+    parser.add_argument("--seed", type=int, default=None, help="Graine pour des plans reproductibles")
+    args = parser.parse_args()
+
+    from sqlmodel import Session, SQLModel, create_engine
+    from database import engine, create_db_and_tables
+    from generation_plans import debut_semaine, generate_plans_lot, PLANS_USERS_PER_COMMIT, PLANS_WORKERS
+
+    if args.database_url:
+        engine = create_engine(args.database_url)
+        SQLModel.metadata.create_all(engine)
+    else:
+        create_db_and_tables()
+
+    with Session(engine) as session:
+        stats = generate_plans_lot(session, debut_semaine(args.semaine), workers=args.workers or PLANS_WORKERS,
+                                   users_per_commit=args.users_per_commit or PLANS_USERS_PER_COMMIT, seed=args.seed,
+                                   regenerate=args.regenerate)
+    print(f"✅ {stats['plans']} plans pour la semaine du {stats['semaine']} ({stats['groupes']} groupes d'allergies, "
+          f"{stats['existants']} déjà générés) "
+          f"en {stats['seconds']:.1f}s ({stats['plans_per_second']} plans/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Précalculer les recommandations de tous les utilisateurs (table recommendation).
+
+Usage (depuis la racine du projet) :
+    python -m scripts.materialize_recommendations
+    python -m scripts.materialize_recommendations --database-url sqlite:///./nutrition.db --users-per-commit 2000
+"""
+
+import argparse
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommandations précalculées par utilisateur")
+    parser.add_argument("--database-url", default=None, help="URL de la base (par défaut DATABASE_URL)")
+    parser.add_argument("--users-per-commit", type=int, default=None, help="Utilisateurs traités par transaction")
+    parser.add_argument("--per-user", type=int, default=None, help="Recommandations conservées par utilisateur")
+    args = parser.parse_args()
+
+    from sqlmodel import Session, SQLModel, create_engine
+    from app.database import engine, create_db_and_tables
+    from app.services.recommendation_service import RecommendationService, RECOMMENDATIONS_PER_USER, RECOMMENDATIONS_USERS_PER_COMMIT
+
+    if args.database_url:
+        engine = create_engine(args.database_url)
+        SQLModel.metadata.create_all(engine)
+    else:
+        create_db_and_tables()
+
+    with Session(engine) as session:
+        service = RecommendationService(session, args.per_user or RECOMMENDATIONS_PER_USER)
+        stats = service.refresh_all(args.users_per_commit or RECOMMENDATIONS_USERS_PER_COMMIT)
+    print(f"✅ {stats['recommendations']} recommandations pour {stats['users']} utilisateurs "
+          f"en {stats['seconds']:.1f}s ({stats['users_per_second']} utilisateurs/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,536 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, NamedTuple, Optional
+import numpy as np
+from sqlalchemy import BigInteger, Integer, bindparam, event, func, text
+from sqlalchemy.orm import Session as OrmSession, defer, object_session
+from sqlmodel import Session, select
+from models import Aliment, AlimentRepasJour, EmbeddingVector, aliment_signature
+from allergens import allergen_mask
+from allergen_cache import AllergenSafeCache
+from embedding import embedding_service
+from vector_index import IVFIndex, QuantizedVectorIndex, VectorIndex, mmr_rerank
+from lexical_index import LexicalIndex, PrefixIndex
+
+# Moteur de recherche sémantique : "auto" (pgvector sur PostgreSQL, index en mémoire sinon),
+# "pgvector" ou "memory"
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+# Intervalle minimal entre deux vérifications de fraîcheur de l'index en mémoire
+SEARCH_INDEX_REFRESH_SECONDS = float(os.getenv("SEARCH_INDEX_REFRESH_SECONDS", 30))
+# Index en mémoire : "exact" ou "ivf" (approximatif, pour les grands catalogues)
+SEARCH_INDEX = os.getenv("SEARCH_INDEX", "exact")
+IVF_NLIST = int(os.getenv("IVF_NLIST", 0)) or None  # 0 : racine carrée du nombre d'aliments
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 8))
+# Compression des vecteurs de l'index exact : "none", "int8" ou "float16",
+# avec reclassement exact en float32 des rerank_factor * top_k meilleurs candidats
+SEARCH_QUANTIZATION = os.getenv("SEARCH_QUANTIZATION", "none")
+SEARCH_RERANK_FACTOR = int(os.getenv("SEARCH_RERANK_FACTOR", 4))
+# Recherche hybride : constante de la fusion RRF, candidats par liste (multiple de top_k)
+# et budget de latence au-delà duquel seul le classement lexical est retenu
+SEARCH_RRF_K = int(os.getenv("SEARCH_RRF_K", 60))
+SEARCH_HYBRID_CANDIDATES = int(os.getenv("SEARCH_HYBRID_CANDIDATES", 3))
+SEARCH_HYBRID_BUDGET_MS = float(os.getenv("SEARCH_HYBRID_BUDGET_MS", 200))
+SEARCH_MODES = ("semantic", "lexical", "hybrid")
+# Réordonnancement MMR (pertinence contre diversité) : lambda par défaut des recommandations
+# (vide : désactivé, 1 : pertinence seule) et candidats examinés (multiple de top_k)
+SEARCH_MMR_LAMBDA = float(os.getenv("SEARCH_MMR_LAMBDA")) if os.getenv("SEARCH_MMR_LAMBDA") else None
+SEARCH_MMR_CANDIDATES = int(os.getenv("SEARCH_MMR_CANDIDATES", 4))
+# Index ANN pgvector : "hnsw", "ivfflat" ou "none", et paramètres de requête associés
+PGVECTOR_INDEX = os.getenv("PGVECTOR_INDEX", "none")
+PGVECTOR_HNSW_M = int(os.getenv("PGVECTOR_HNSW_M", 16))
+PGVECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv("PGVECTOR_HNSW_EF_CONSTRUCTION", 64))
+PGVECTOR_HNSW_EF_SEARCH = int(os.getenv("PGVECTOR_HNSW_EF_SEARCH", 0))
+PGVECTOR_IVFFLAT_LISTS = int(os.getenv("PGVECTOR_IVFFLAT_LISTS", 100))
+PGVECTOR_IVFFLAT_PROBES = int(os.getenv("PGVECTOR_IVFFLAT_PROBES", 0))
+# pgvector >= 0.8 : poursuivre le parcours de l'index ANN tant que le filtre d'allergènes
+# écarte des lignes (relaxed_order par défaut avec un index ; "off" pour pgvector < 0.8,
+# qui rend alors moins de top_k résultats quand le filtre est sélectif)
+PGVECTOR_ITERATIVE_SCAN = os.getenv("PGVECTOR_ITERATIVE_SCAN") or ("relaxed_order" if PGVECTOR_INDEX in ("hnsw", "ivfflat") else "off")
+
+def new_vector_index(attributes=("allergenes_mask", "calories", "version")) -> VectorIndex:
+    """Créer l'index en mémoire configuré par SEARCH_INDEX"""
+    if SEARCH_INDEX == "ivf":
+        return IVFIndex(attributes=attributes, nlist=IVF_NLIST, nprobe=IVF_NPROBE)
+    if SEARCH_QUANTIZATION != "none":
+        return QuantizedVectorIndex(attributes=attributes, dtype=SEARCH_QUANTIZATION, rerank_factor=SEARCH_RERANK_FACTOR)
+    return VectorIndex(attributes=attributes)
+
+class AlimentIndex:
+    """Index en mémoire des embeddings d'aliments d'une base de données.
+
+    Chargé au premier usage, tenu à jour aux commits des écritures ORM du worker
+    courant et rechargé lorsque le nombre d'aliments indexés, l'id maximal
+    ou la somme des versions en base ne correspondent plus (écritures d'un
+    autre worker ou des scripts de backfill). Les lignes
+    sans allergène d'un utilisateur sont gardées en cache par masque
+    (`safe_rows`), avec la version de l'index pour laquelle elles ont été
+    calculées : une entrée d'une version antérieure n'est jamais utilisée.
+    """
+
+    def __init__(self):
+        self.vectors = new_vector_index()
+        self.safe_rows = AllergenSafeCache(lambda mask: (self.vectors.version, (self.vectors.column("allergenes_mask") & mask) == 0))
+        self.loaded = False
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _signature(self) -> tuple:
+        ids = self.vectors.ids
+        return (len(ids), int(ids.max()) if len(ids) else None, int(self.vectors.column("version").sum()))
+
+    def ensure_loaded(self, session: Session) -> "AlimentIndex":
+        now = time.monotonic()
+        if self.loaded and now - self._checked_at < SEARCH_INDEX_REFRESH_SECONDS:
+            return self
+        with self._lock:
+            signature = aliment_signature(session, Aliment.embedding != None)
+            self._checked_at = now
+            if self.loaded and signature == self._signature():
+                return self
+            self.load(session)
+        return self
+
+    def load(self, session: Session) -> None:
+        rows = session.exec(
+            select(Aliment.id, Aliment.embedding, Aliment.allergenes_mask, Aliment.calories, Aliment.version)
+            .where(Aliment.embedding != None)
+        ).all()
+        self.vectors.build(
+            [row[0] for row in rows],
+            np.stack([row[1] for row in rows]) if rows else [],
+            allergenes_mask=[row[2] for row in rows],
+            calories=[row[3] for row in rows],
+            version=[row[4] for row in rows],
+        )
+        self.safe_rows.clear()
+        self.loaded = True
+
+    def invalidate(self) -> None:
+        self.loaded = False
+
+_indexes: Dict[str, AlimentIndex] = {}
+
+def get_aliment_index(bind) -> AlimentIndex:
+    """Index en mémoire associé à une base (une instance par URL de moteur)"""
+    key = str(bind.engine.url)
+    index = _indexes.get(key)
+    if index is None:
+        index = _indexes.setdefault(key, AlimentIndex())
+    return index
+
+class LexicalAliment:
+    """Index des noms d'aliments d'une base : inversé (BM25, tolérance aux
+    fautes) pour la recherche et trié par préfixe pour l'autocomplétion.
+
+    Construit au premier usage puis tenu à jour par les mêmes événements
+    ORM et la même vérification de fraîcheur que l'index vectoriel. La
+    popularité (nombre d'apparitions dans les plans de repas) est relue à
+    chaque rechargement.
+    """
+
+    def __init__(self):
+        self.index = LexicalIndex(attributes=["allergenes_mask", "calories", "version"])
+        self.prefixes = PrefixIndex(attributes=["allergenes_mask", "calories", "popularite"])
+        self.categories: Dict[int, str] = {}
+        self.loaded = False
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _signature(self) -> tuple:
+        ids = self.index.ids
+        return (len(ids), int(ids.max()) if len(ids) else None, int(self.index.column("version").sum()))
+
+    def ensure_loaded(self, session: Session) -> "LexicalAliment":
+        now = time.monotonic()
+        if self.loaded and now - self._checked_at < SEARCH_INDEX_REFRESH_SECONDS:
+            return self
+        with self._lock:
+            signature = aliment_signature(session)
+            self._checked_at = now
+            if self.loaded and signature == self._signature():
+                return self
+            self.load(session)
+        return self
+
+    def load(self, session: Session) -> None:
+        rows = session.exec(
+            select(Aliment.id, Aliment.nom, Aliment.allergenes_mask, Aliment.calories, Aliment.categorie, Aliment.version)
+        ).all()
+        popularite = dict(session.exec(
+            select(AlimentRepasJour.aliment_id, func.count(AlimentRepasJour.id)).group_by(AlimentRepasJour.aliment_id)
+        ).all())
+        documents = [(row[0], row[1]) for row in rows]
+        masks = [row[2] or 0 for row in rows]
+        calories = [row[3] for row in rows]
+        self.index.build(documents, allergenes_mask=masks, calories=calories, version=[row[5] for row in rows])
+        self.prefixes.build(documents, allergenes_mask=masks, calories=calories,
+                            popularite=[popularite.get(row[0], 0) for row in rows])
+        self.categories = {row[0]: row[4] for row in rows}
+        self.loaded = True
+
+    def upsert(self, aliment: Aliment) -> None:
+        self.index.upsert(aliment.id, aliment.nom, allergenes_mask=aliment.allergenes_mask, calories=aliment.calories,
+                          version=aliment.version)
+        popularite = self.prefixes.value("popularite", aliment.id)
+        self.prefixes.upsert(aliment.id, aliment.nom, allergenes_mask=aliment.allergenes_mask,
+                             calories=aliment.calories, popularite=popularite)
+        self.categories[aliment.id] = aliment.categorie
+
+    def remove(self, aliment_id: int) -> None:
+        self.index.remove(aliment_id)
+        self.prefixes.remove(aliment_id)
+        self.categories.pop(aliment_id, None)
+
+    def invalidate(self) -> None:
+        self.loaded = False
+
+_lexical_indexes: Dict[str, LexicalAliment] = {}
+
+def get_lexical_index(bind) -> LexicalAliment:
+    """Index lexical associé à une base (une instance par URL de moteur)"""
+    key = str(bind.engine.url)
+    index = _lexical_indexes.get(key)
+    if index is None:
+        index = _lexical_indexes.setdefault(key, LexicalAliment())
+    return index
+
+def _use_pgvector(session: Session) -> bool:
+    if SEARCH_BACKEND == "memory":
+        return False
+    return SEARCH_BACKEND == "pgvector" or session.get_bind().dialect.name == "postgresql"
+
+def allergen_filter(mask: int):
+    """Filtre de lignes de l'index excluant les aliments dont les allergènes intersectent `mask`"""
+    if not mask:
+        return None
+    return lambda vectors: (vectors.column("allergenes_mask") & mask) == 0
+
+def aliment_filter(mask: int = 0, max_calories: Optional[int] = None):
+    """Filtre de lignes de l'index : allergènes exclus et calories plafonnées, appliqué avant le top-k"""
+    if max_calories is None:
+        return allergen_filter(mask)
+    if not mask:
+        return lambda vectors: vectors.column("calories") <= max_calories
+    return lambda vectors: ((vectors.column("allergenes_mask") & mask) == 0) & (vectors.column("calories") <= max_calories)
+
+def ensure_pgvector_index(engine, kind: str = PGVECTOR_INDEX) -> None:
+    """Créer l'index ANN pgvector sur aliment.embedding (produit scalaire, opérateur <#>)"""
+    if kind == "none" or engine.dialect.name != "postgresql":
+        return
+    if kind == "hnsw":
+        ddl = (f"CREATE INDEX IF NOT EXISTS aliment_embedding_hnsw ON aliment USING hnsw (embedding vector_ip_ops) "
+               f"WITH (m = {PGVECTOR_HNSW_M}, ef_construction = {PGVECTOR_HNSW_EF_CONSTRUCTION})")
+    elif kind == "ivfflat":
+        ddl = (f"CREATE INDEX IF NOT EXISTS aliment_embedding_ivfflat ON aliment USING ivfflat (embedding vector_ip_ops) "
+               f"WITH (lists = {PGVECTOR_IVFFLAT_LISTS})")
+    else:
+        raise ValueError(f"Index pgvector inconnu: {kind}")
+    with engine.begin() as conn:
+        conn.execute(text(ddl))
+
+def drop_pgvector_index(engine) -> None:
+    """Supprimer les index ANN pgvector (retour à la recherche exacte)"""
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS aliment_embedding_hnsw"))
+        conn.execute(text("DROP INDEX IF EXISTS aliment_embedding_ivfflat"))
+
+def _set_pgvector_search_params(session: Session) -> None:
+    # SET LOCAL : les paramètres ne valent que pour la transaction en cours
+    if PGVECTOR_HNSW_EF_SEARCH:
+        session.execute(text(f"SET LOCAL hnsw.ef_search = {PGVECTOR_HNSW_EF_SEARCH}"))
+    if PGVECTOR_IVFFLAT_PROBES:
+        session.execute(text(f"SET LOCAL ivfflat.probes = {PGVECTOR_IVFFLAT_PROBES}"))
+    if PGVECTOR_ITERATIVE_SCAN != "off":
+        session.execute(text(f"SET LOCAL hnsw.iterative_scan = {PGVECTOR_ITERATIVE_SCAN}"))
+        session.execute(text(f"SET LOCAL ivfflat.iterative_scan = {PGVECTOR_ITERATIVE_SCAN}"))
+
+# Requête construite une seule fois : SQLAlchemy réutilise sa compilation, le vecteur
+# et les bornes sont des paramètres liés (préparée côté serveur avec psycopg 3).
+# Les embeddings des résultats ne sont pas relus. Les candidats sont calculés dans
+# une CTE matérialisée puis retriés par distance : avec iterative_scan = relaxed_order,
+# l'index peut rendre des lignes légèrement dans le désordre.
+_PGVECTOR_DISTANCE = Aliment.embedding.op("<#>")(bindparam("query_embedding", type_=EmbeddingVector())).label("distance")
+_PGVECTOR_CANDIDATS = (
+    select(Aliment.id, _PGVECTOR_DISTANCE)
+    .where(Aliment.embedding != None)
+    .where(Aliment.allergenes_mask.op("&")(bindparam("mask", type_=BigInteger)) == 0)
+    .where(Aliment.calories <= bindparam("max_calories", type_=Integer))
+    .order_by(_PGVECTOR_DISTANCE)
+    .limit(bindparam("top_k", type_=Integer))
+    .cte("candidats")
+    .prefix_with("MATERIALIZED")
+)
+PGVECTOR_SEARCH = (
+    select(Aliment)
+    .options(defer(Aliment.embedding))
+    .join(_PGVECTOR_CANDIDATS, _PGVECTOR_CANDIDATS.c.id == Aliment.id)
+    .order_by(_PGVECTOR_CANDIDATS.c.distance)
+)
+
+# Plafond de calories lié quand aucune limite n'est demandée (la requête reste unique)
+NO_CALORIE_LIMIT = 2 ** 31 - 1
+
+def _search_pgvector(session: Session, query_embedding: list, top_k: int, mask: int = 0,
+                     max_calories: Optional[int] = None) -> List[Aliment]:
+    # Recherche par produit scalaire avec pgvector ; l'exclusion des allergènes et le
+    # plafond de calories sont appliqués avant le LIMIT pour obtenir top_k aliments admissibles
+    _set_pgvector_search_params(session)
+    params = {"query_embedding": np.asarray(query_embedding, dtype=np.float32), "mask": int(mask), "top_k": top_k,
+              "max_calories": NO_CALORIE_LIMIT if max_calories is None else int(max_calories)}
+    return session.exec(PGVECTOR_SEARCH, params=params).all()
+
+def _safe_rows(index: AlimentIndex, vectors, mask: int) -> np.ndarray:
+    # Appelé par le filtre de la recherche, sous le verrou de l'index : la version lue est celle des colonnes
+    version, safe = index.safe_rows.get(mask)
+    if version != vectors.version:
+        # Index modifié depuis le calcul (écriture, rechargement) : repartir d'un cache vide
+        index.safe_rows.clear()
+        version, safe = index.safe_rows.get(mask)
+    return safe
+
+def _index_filter(index: AlimentIndex, mask: int = 0, max_calories: Optional[int] = None):
+    """Comme aliment_filter, avec les lignes sans allergène lues dans le cache de l'index"""
+    if not mask:
+        return aliment_filter(0, max_calories)
+    def allowed(vectors):
+        safe = _safe_rows(index, vectors, mask)
+        return safe if max_calories is None else safe & (vectors.column("calories") <= max_calories)
+    return allowed
+
+def _memory_ids(session: Session, query_embedding: list, top_k: int, mask: int = 0, max_calories: Optional[int] = None):
+    index = get_aliment_index(session.get_bind()).ensure_loaded(session)
+    allowed = _index_filter(index, mask, max_calories)
+    if isinstance(index.vectors, QuantizedVectorIndex):
+        ids, _ = index.vectors.search(query_embedding, top_k, allowed=allowed,
+                                      rerank_fn=lambda ids: load_embeddings(session, ids))
+    else:
+        ids, _ = index.vectors.search(query_embedding, top_k, allowed=allowed)
+    return ids
+
+def _search_memory(session: Session, query_embedding: list, top_k: int, mask: int = 0,
+                   max_calories: Optional[int] = None) -> List[Aliment]:
+    return get_aliments_ordered(session, _memory_ids(session, query_embedding, top_k, mask, max_calories))
+
+def load_embeddings(session: Session, ids) -> np.ndarray:
+    """Embeddings float32 exacts des aliments `ids`, dans le même ordre (zéros si absents)"""
+    ids = [int(i) for i in ids]
+    rows = dict(session.exec(select(Aliment.id, Aliment.embedding).where(Aliment.id.in_(ids))).all())
+    dim = next((len(v) for v in rows.values() if v is not None), 0)
+    return np.stack([rows[i] if rows.get(i) is not None else np.zeros(dim, dtype=np.float32) for i in ids])
+
+def get_aliments_ordered(session: Session, ids) -> List[Aliment]:
+    """Charger des aliments en une requête en conservant l'ordre des ids"""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return []
+    par_id = {a.id: a for a in session.exec(select(Aliment).where(Aliment.id.in_(ids))).all()}
+    return [par_id[i] for i in ids if i in par_id]
+
+def _semantic_ids(session: Session, query: str, top_k: int, mask: int = 0, max_calories: Optional[int] = None) -> List[int]:
+    query_embedding = embedding_service.embed_query(query)
+    if _use_pgvector(session):
+        return [a.id for a in _search_pgvector(session, query_embedding, top_k, mask, max_calories)]
+    return [int(i) for i in _memory_ids(session, query_embedding, top_k, mask, max_calories)]
+
+def _lexical_ids(session: Session, query: str, top_k: int, mask: int = 0, max_calories: Optional[int] = None) -> List[int]:
+    index = get_lexical_index(session.get_bind()).ensure_loaded(session)
+    ids, _ = index.index.search(query, top_k, allowed=aliment_filter(mask, max_calories))
+    return [int(i) for i in ids]
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = SEARCH_RRF_K) -> List[int]:
+    """Fusionner des classements : score(d) = somme des 1 / (k + rang de d), rangs à partir de 1"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda item_id: -scores[item_id])
+
+# Le classement sémantique tourne dans ce pool (avec sa propre session)
+# pendant que le classement lexical est calculé dans le thread de la requête
+_hybrid_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="recherche-hybride")
+
+def _semantic_ids_in_own_session(bind, query: str, top_k: int, mask: int, max_calories: Optional[int]) -> List[int]:
+    with Session(bind) as session:
+        return _semantic_ids(session, query, top_k, mask, max_calories)
+
+def search_aliments_hybrid(session: Session, query: str, allergies: Optional[List[str]] = None, top_k: int = 10,
+                           budget_ms: float = SEARCH_HYBRID_BUDGET_MS, max_calories: Optional[int] = None) -> List[Aliment]:
+    """Recherche hybride : classements lexical et sémantique en parallèle, fusionnés par RRF.
+
+    Si le classement sémantique n'est pas prêt dans le budget de latence
+    (modèle en cours de chargement, base lente), seul le classement
+    lexical est retourné.
+    """
+    debut = time.monotonic()
+    mask = allergen_mask(allergies)
+    candidates = top_k * SEARCH_HYBRID_CANDIDATES
+    semantic = _hybrid_executor.submit(_semantic_ids_in_own_session, session.get_bind(), query, candidates, mask, max_calories)
+    rankings = [_lexical_ids(session, query, candidates, mask, max_calories)]
+    try:
+        rankings.append(semantic.result(timeout=max(0.0, budget_ms / 1000 - (time.monotonic() - debut))))
+    except FutureTimeoutError:
+        # Cas attendu sous charge : pas de message par requête, le classement lexical suffit
+        pass
+    return get_aliments_ordered(session, reciprocal_rank_fusion(rankings)[:top_k])
+
+def search_aliments(session: Session, query: str, allergies: Optional[List[str]] = None, top_k: int = 10,
+                    mode: str = "semantic", max_calories: Optional[int] = None,
+                    mmr_lambda: Optional[float] = None) -> List[Aliment]:
+    """Recherche d'aliments excluant les allergies (et les aliments au-delà de
+    `max_calories`) dans le classement même : top_k résultats admissibles.
+
+    `mode` : "semantic" (embeddings), "lexical" (index inversé des noms)
+    ou "hybrid" (les deux, fusionnés par RRF). En mode sémantique,
+    `mmr_lambda` active le réordonnancement MMR des candidats.
+    """
+    if mode == "lexical":
+        return search_aliments_lexical(session, query, allergies, top_k, max_calories)
+    if mode == "hybrid":
+        return search_aliments_hybrid(session, query, allergies, top_k, max_calories=max_calories)
+    if mode != "semantic":
+        raise ValueError(f"Mode de recherche inconnu: {mode}")
+    query_embedding = embedding_service.embed_query(query)
+    mask = allergen_mask(allergies)
+
+    if mmr_lambda is not None:
+        return _search_diverse(session, query_embedding, top_k, mmr_lambda, mask, max_calories)
+    if _use_pgvector(session):
+        return _search_pgvector(session, query_embedding, top_k, mask, max_calories)
+    return _search_memory(session, query_embedding, top_k, mask, max_calories)
+
+def _search_diverse(session: Session, query_embedding, top_k: int, mmr_lambda: float, mask: int = 0,
+                    max_calories: Optional[int] = None) -> List[Aliment]:
+    """Top-k sémantique réordonné par MMR parmi top_k * SEARCH_MMR_CANDIDATES candidats admissibles.
+
+    Les vecteurs des candidats viennent de l'index en mémoire (sans
+    requête supplémentaire) ou, avec pgvector, sont relus en une requête.
+    """
+    candidates = top_k * SEARCH_MMR_CANDIDATES
+    if _use_pgvector(session):
+        ids = [a.id for a in _search_pgvector(session, query_embedding, candidates, mask, max_calories)]
+        vectors = load_embeddings(session, ids) if ids else None
+    else:
+        ids = [int(i) for i in _memory_ids(session, query_embedding, candidates, mask, max_calories)]
+        vectors = get_aliment_index(session.get_bind()).vectors.vectors(ids) if ids else None
+    if not ids:
+        return []
+    order = mmr_rerank(query_embedding, vectors, top_k, mmr_lambda)
+    return get_aliments_ordered(session, [ids[i] for i in order])
+
+def search_aliments_batch(session: Session, queries: List[str], allergies: List[Optional[List[str]]],
+                         max_calories: List[Optional[int]], top_k: int = 10, chunk_size: int = 256) -> List[List[Aliment]]:
+    """Recherche sémantique de plusieurs requêtes en une passe vectorisée.
+
+    Les requêtes sont encodées en un seul lot, puis classées contre la
+    matrice des aliments de l'index en mémoire (chargée depuis la base,
+    PostgreSQL compris) par un produit matriciel par tranche de
+    `chunk_size` requêtes. Allergènes et calories sont filtrés par requête
+    avant le top-k ; avec un index compressé, les candidats du lot sont
+    reclassés en float32 comme pour une requête seule. Les aliments
+    retenus sont lus en une seule requête.
+    """
+    if not queries:
+        return []
+    embeddings = embedding_service.encode(queries)
+    index = get_aliment_index(session.get_bind()).ensure_loaded(session)
+    masks = np.array([allergen_mask(a) for a in allergies], dtype=np.int64)
+    caps = np.array([NO_CALORIE_LIMIT if c is None else c for c in max_calories], dtype=np.int64)
+    resultats = []
+    for start in range(0, len(queries), chunk_size):
+        chunk_caps = caps[start:start + chunk_size, None]
+        # Lignes sans allergène par masque distinct du lot (cache de l'index), puis une ligne par requête
+        distinct, inverse = np.unique(masks[start:start + chunk_size], return_inverse=True)
+        allowed = lambda vectors: (np.stack([_safe_rows(index, vectors, int(m)) for m in distinct])[inverse]
+                                   & (vectors.column("calories")[None, :] <= chunk_caps))
+        if isinstance(index.vectors, QuantizedVectorIndex):
+            # Même reclassement float32 exact que la recherche unitaire (_memory_ids)
+            lot = index.vectors.search_many(embeddings[start:start + chunk_size], top_k, allowed,
+                                            rerank_fn=lambda ids: load_embeddings(session, ids))
+        else:
+            lot = index.vectors.search_many(embeddings[start:start + chunk_size], top_k, allowed)
+        resultats.extend(ids for ids, _ in lot)
+    par_id = {a.id: a for a in get_aliments_ordered(session, np.unique(np.concatenate(resultats)) if resultats else [])}
+    return [[par_id[int(i)] for i in ids if int(i) in par_id] for ids in resultats]
+
+def search_aliments_lexical(session: Session, query: str, allergies: Optional[List[str]] = None, top_k: int = 10,
+                            max_calories: Optional[int] = None) -> List[Aliment]:
+    """Recherche par nom (index inversé BM25, accents et fautes de frappe tolérés)"""
+    return get_aliments_ordered(session, _lexical_ids(session, query, top_k, allergen_mask(allergies), max_calories))
+
+def autocomplete_aliments(session: Session, prefix: str, allergies: Optional[List[str]] = None, limit: int = 10,
+                          tri: str = "popularite") -> List[dict]:
+    """Suggestions de noms d'aliments commençant par `prefix`, servies depuis la mémoire.
+
+    `tri` : "popularite" (les plus utilisés dans les plans d'abord) ou
+    "calories" (les moins caloriques d'abord).
+    """
+    index = get_lexical_index(session.get_bind()).ensure_loaded(session)
+    ids = index.prefixes.search(prefix, limit, order_by=tri, descending=tri == "popularite",
+                                allowed=allergen_filter(allergen_mask(allergies)))
+    return [{"id": int(i), "nom": index.prefixes.name(i), "categorie": index.categories.get(int(i), ""),
+             "calories": index.prefixes.value("calories", i)} for i in ids]
+
+# Synchronisation des index en mémoire avec les écritures ORM du worker courant : les écritures
+# sont notées sur la session pendant le flush et appliquées après le commit (un rollback les oublie)
+
+class _AlimentWrite(NamedTuple):
+    """Valeurs d'un aliment au moment du flush (les attributs sont expirés après le commit)"""
+    id: int
+    nom: str
+    categorie: str
+    calories: int
+    allergenes_mask: int
+    embedding: Optional[List[float]]
+    version: int
+
+_PENDING_WRITES = "aliments_a_indexer"
+
+def _queue_write(connection, target, aliment: Optional[_AlimentWrite]) -> None:
+    # La dernière écriture d'un aliment dans la transaction l'emporte (None : supprimé)
+    session = object_session(target)
+    key = str(connection.engine.url)
+    if session is None:
+        _apply_write(key, target.id, aliment)
+    else:
+        session.info.setdefault(_PENDING_WRITES, {})[(key, target.id)] = aliment
+
+def _apply_write(key: str, aliment_id: int, aliment: Optional[_AlimentWrite]) -> None:
+    lexical = _lexical_indexes.get(key)
+    if lexical is not None and lexical.loaded:
+        if aliment is None:
+            lexical.remove(aliment_id)
+        else:
+            lexical.upsert(aliment)
+    index = _indexes.get(key)
+    if index is None or not index.loaded:
+        return
+    if aliment is None or aliment.embedding is None:
+        index.vectors.remove(aliment_id)
+    else:
+        try:
+            index.vectors.upsert(aliment_id, aliment.embedding, allergenes_mask=aliment.allergenes_mask,
+                                 calories=aliment.calories, version=aliment.version)
+        except ValueError:
+            # Dimension différente de l'index (changement de modèle) : ne pas bloquer l'écriture
+            index.invalidate()
+
+@event.listens_for(Aliment, "after_insert")
+@event.listens_for(Aliment, "after_update")
+def _index_aliment(mapper, connection, target):
+    _queue_write(connection, target, _AlimentWrite(target.id, target.nom, target.categorie, target.calories,
+                                                   target.allergenes_mask, target.embedding, target.version))
+
+@event.listens_for(Aliment, "after_delete")
+def _unindex_aliment(mapper, connection, target):
+    _queue_write(connection, target, None)
+
+@event.listens_for(OrmSession, "after_commit")
+def _apply_index_writes(session):
+    for (key, aliment_id), aliment in session.info.pop(_PENDING_WRITES, {}).items():
+        _apply_write(key, aliment_id, aliment)
+
+@event.listens_for(OrmSession, "after_rollback")
+def _drop_index_writes(session):
+    session.info.pop(_PENDING_WRITES, None)
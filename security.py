@@ -49,4 +49,9 @@ def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Dep
 def get_current_active_user(current_user: Utilisateur = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user 
\ No newline at end of file
+    return current_user 
+
+def get_current_active_superuser(current_user: Utilisateur = Depends(get_current_active_user)):
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Droits administrateur requis")
+    return current_user
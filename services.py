@@ -1,54 +1,105 @@
 from typing import List, Optional
 from sqlmodel import Session, select
+from sqlalchemy import insert, update, or_
+from sqlalchemy.exc import IntegrityError
 from models import Aliment, Utilisateur, PlanRepas, Buffet, RepasJour, AlimentRepasJour, BuffetAliment
 from embedding import embedding_service
+from search import search_aliments, search_aliments_batch, autocomplete_aliments, get_aliment_index, get_lexical_index, SEARCH_MMR_LAMBDA
+from similarites import get_aliments_similaires, update_similarites
 from security import get_password_hash
-import random
+from allergens import allergen_mask
+from text_utils import parse_allergenes
+from meal_planner import get_planner, invalidate_planner, nom_jour, nom_repas
+from generation_plans import debut_semaine, supprimer_plans, verrou_plan
 import datetime
 
 # CRUD Aliment
 
 def create_aliment(session: Session, aliment_data: dict) -> Aliment:
-    """Créer un nouvel aliment avec embedding"""
+    """Créer un nouvel aliment avec embedding et sa liste d'aliments similaires"""
     embedding = embedding_service.embed(aliment_data["nom"])
-    aliment = Aliment(**aliment_data, embedding=embedding)
+    aliment = Aliment(**aliment_data, embedding=embedding, embedding_nom=aliment_data["nom"])
     session.add(aliment)
     session.commit()
     session.refresh(aliment)
+    update_similarites(session, [aliment.id])
     return aliment
 
 def get_aliment(session: Session, aliment_id: int) -> Optional[Aliment]:
     """Récupérer un aliment par son ID"""
     return session.get(Aliment, aliment_id)
 
-def search_aliments(session: Session, query: str, allergies: Optional[List[str]] = None, top_k: int = 10) -> List[Aliment]:
-    """Recherche sémantique d'aliments avec filtrage par allergies"""
-    query_embedding = embedding_service.embed(query)
-    
-    # Recherche par similarité cosinus avec pgvector
-    sql = f"""
-        SELECT *, (embedding <#> '[{','.join(map(str, query_embedding))}]') AS distance
-        FROM aliment
-        ORDER BY distance ASC
-        LIMIT {top_k}
-    """
-    results = session.exec(sql)
-    aliments = []
-    for row in results:
-        aliment_dict = dict(row)
-        aliment = Aliment(**aliment_dict)
-        aliments.append(aliment)
-    
-    # Filtrer par allergies si spécifiées
-    if allergies:
-        aliments = [a for a in aliments if not set(a.allergenes) & set(allergies)]
-    
-    return aliments
-
 def get_all_aliments(session: Session) -> List[Aliment]:
     """Récupérer tous les aliments"""
     return session.exec(select(Aliment)).all()
 
+def _bump_versions(session: Session, aliment_ids: List[int]) -> None:
+    # Les UPDATE groupés ne passent pas par le hook before_update : signaler la modification aux autres workers
+    session.execute(update(Aliment).where(Aliment.id.in_(aliment_ids)).values(version=Aliment.version + 1))
+
+def backfill_embeddings(session: Session, batch_size: int = 256, commit_every: int = 2048, force: bool = False) -> int:
+    """Calculer les embeddings manquants ou périmés (nom modifié) par lots.
+
+    Seuls l'id et le nom des aliments à traiter sont lus ; les noms sont
+    encodés par gros lots puis écrits en UPDATE groupés, avec un commit
+    toutes les `commit_every` lignes. Retourne le nombre d'aliments mis à jour.
+    """
+    statement = select(Aliment.id, Aliment.nom).order_by(Aliment.id)
+    if not force:
+        statement = statement.where(or_(
+            Aliment.embedding == None,
+            Aliment.embedding_nom == None,
+            Aliment.embedding_nom != Aliment.nom,
+        ))
+    lignes = session.exec(statement).all()
+
+    total = 0
+    for debut in range(0, len(lignes), commit_every):
+        chunk = lignes[debut:debut + commit_every]
+        # Encoder chaque nom distinct une seule fois
+        noms = list(dict.fromkeys(nom for _, nom in chunk))
+        vecteurs = dict(zip(noms, embedding_service.encode(noms, batch_size=batch_size)))
+        session.execute(
+            update(Aliment),
+            [{"id": aliment_id, "embedding": vecteurs[nom], "embedding_nom": nom} for aliment_id, nom in chunk],
+        )
+        _bump_versions(session, [aliment_id for aliment_id, _ in chunk])
+        session.commit()
+        total += len(chunk)
+        print(f"  {total}/{len(lignes)} embeddings calculés")
+    # Les UPDATE groupés ne passent pas par les événements ORM : recharger l'index en mémoire
+    if total:
+        get_aliment_index(session.get_bind()).invalidate()
+        update_similarites(session, [aliment_id for aliment_id, _ in lignes])
+    return total
+
+def backfill_allergenes_masks(session: Session, commit_every: int = 2048) -> int:
+    """Recalculer les masques d'allergènes écrits hors ORM (INSERT/UPDATE groupés, lignes
+    antérieures à la colonne, qui valent alors 0 par défaut).
+
+    Seules les lignes dont le masque stocké diffère du masque calculé sont
+    réécrites, en UPDATE groupés. Retourne le nombre d'aliments corrigés.
+    """
+    lignes = [
+        (aliment_id, mask)
+        for aliment_id, allergenes, stocke in session.exec(
+            select(Aliment.id, Aliment.allergenes, Aliment.allergenes_mask).order_by(Aliment.id)
+        ).all()
+        if (mask := allergen_mask(parse_allergenes(allergenes))) != stocke
+    ]
+    for debut in range(0, len(lignes), commit_every):
+        chunk = lignes[debut:debut + commit_every]
+        session.execute(update(Aliment), [{"id": aliment_id, "allergenes_mask": mask} for aliment_id, mask in chunk])
+        _bump_versions(session, [aliment_id for aliment_id, _ in chunk])
+        session.commit()
+    # Mêmes UPDATE groupés sans événements ORM : recharger les index et le planificateur
+    if lignes:
+        bind = session.get_bind()
+        get_aliment_index(bind).invalidate()
+        get_lexical_index(bind).invalidate()
+        invalidate_planner(bind)
+    return len(lignes)
+
 # CRUD Utilisateur
 
 def create_utilisateur(session: Session, user_data: dict) -> Utilisateur:
@@ -122,52 +173,63 @@ def get_buffet_aliments(session: Session, buffet_id: int) -> List[Aliment]:
 
 # CRUD Plan de Repas
 
-def generate_plan_repas(session: Session, utilisateur_id: int, semaine: datetime.date) -> PlanRepas:
-    """Générer un plan de repas hebdomadaire pour un utilisateur"""
-    utilisateur = get_utilisateur_by_id(session, utilisateur_id)
-    if not utilisateur:
-        raise ValueError("Utilisateur non trouvé")
-    
-    # Créer le plan de repas
-    plan_repas = PlanRepas(utilisateur_id=utilisateur_id, semaine=semaine)
-    session.add(plan_repas)
-    session.commit()
-    session.refresh(plan_repas)
-    
-    # Jours de la semaine
-    jours = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
-    
-    # Récupérer tous les aliments disponibles
-    aliments_disponibles = get_all_aliments(session)
-    
-    # Filtrer par allergies de l'utilisateur
-    if utilisateur.allergies:
-        aliments_disponibles = [
-            a for a in aliments_disponibles 
-            if not set(a.allergenes) & set(utilisateur.allergies)
-        ]
-    
-    # Générer les repas pour chaque jour
-    for jour in jours:
-        repas_jour = RepasJour(plan_repas_id=plan_repas.id, jour=jour)
-        session.add(repas_jour)
-        session.commit()
-        session.refresh(repas_jour)
+def get_plan_repas_semaine(session: Session, utilisateur_id: int, semaine: datetime.date) -> Optional[PlanRepas]:
+    """Récupérer le plan d'un utilisateur pour une semaine"""
+    return session.exec(
+        select(PlanRepas).where(PlanRepas.utilisateur_id == utilisateur_id, PlanRepas.semaine == semaine)
+    ).first()
+
+def generate_plan_repas(session: Session, utilisateur_id: int, semaine: datetime.date, regenerate: bool = False) -> PlanRepas:
+    """Générer le plan de la semaine (ramenée au lundi) d'un utilisateur, ou retourner le plan existant sauf avec `regenerate`"""
+    # Un seul plan par (utilisateur, semaine) : verrou par clé dans le worker, contrainte unique entre workers
+    semaine = debut_semaine(semaine)
+    with verrou_plan(session.get_bind(), utilisateur_id, semaine):
+        existant = get_plan_repas_semaine(session, utilisateur_id, semaine)
+        if existant is not None and not regenerate:
+            return existant
+        utilisateur = get_utilisateur_by_id(session, utilisateur_id)
+        if not utilisateur:
+            raise ValueError("Utilisateur non trouvé")
         
-        # Sélectionner 2-3 aliments par jour (entrée + plat + dessert)
-        nb_aliments = random.randint(2, 3)
-        aliments_selectionnes = random.sample(aliments_disponibles, min(nb_aliments, len(aliments_disponibles)))
+        planner = get_planner(session)
+        mask = allergen_mask(parse_allergenes(utilisateur.allergies))
+        menu = {
+            (nom_jour(j), nom_repas(r)): aliment_ids
+            for j, repas in enumerate(planner.plan(mask))
+            for r, aliment_ids in enumerate(repas)
+        }
         
-        for aliment in aliments_selectionnes:
-            aliment_repas = AlimentRepasJour(
-                repas_jour_id=repas_jour.id,
-                aliment_id=aliment.id
-            )
-            session.add(aliment_repas)
-    
-    session.commit()
-    session.refresh(plan_repas)
-    return plan_repas
+        try:
+            if existant is not None:
+                supprimer_plans(session, [existant.id])
+                session.expunge(existant)
+            plan_repas = PlanRepas(utilisateur_id=utilisateur_id, semaine=semaine)
+            session.add(plan_repas)
+            session.flush()
+            session.execute(insert(RepasJour), [
+                {"plan_repas_id": plan_repas.id, "jour": jour, "repas": repas} for jour, repas in menu
+            ])
+            repas_ids = {
+                (jour, repas): repas_id
+                for jour, repas, repas_id in session.exec(
+                    select(RepasJour.jour, RepasJour.repas, RepasJour.id).where(RepasJour.plan_repas_id == plan_repas.id)
+                ).all()
+            }
+            lignes = [
+                {"repas_jour_id": repas_ids[cle], "aliment_id": aliment_id}
+                for cle, aliment_ids in menu.items() for aliment_id in aliment_ids
+            ]
+            if lignes:
+                session.execute(insert(AlimentRepasJour), lignes)
+            session.commit()
+        except IntegrityError:
+            # Plan de la même semaine écrit entre-temps par un autre worker
+            session.rollback()
+            existant = get_plan_repas_semaine(session, utilisateur_id, semaine)
+            if existant is None:
+                raise
+            return existant
+        return plan_repas
 
 def get_plan_repas_by_id(session: Session, plan_id: int) -> Optional[PlanRepas]:
     """Récupérer un plan de repas par son ID"""
@@ -181,15 +243,29 @@ def get_plans_repas_utilisateur(session: Session, utilisateur_id: int) -> List[P
 
 # Services de recommandation
 
-def recommend_aliments(session: Session, query: str, allergies: List[str] = None, max_calories: int = 800) -> List[Aliment]:
-    """Recommandation d'aliments basée sur une requête et des contraintes"""
-    aliments = search_aliments(session, query, allergies, top_k=20)
-    
-    # Filtrer par calories si spécifié
-    if max_calories:
-        aliments = [a for a in aliments if a.calories <= max_calories]
-    
-    return aliments[:10]  # Retourner les 10 meilleurs
+def recommend_aliments(session: Session, query: str, allergies: List[str] = None, max_calories: int = 800,
+                       mmr_lambda: Optional[float] = None) -> List[Aliment]:
+    """Recommandation d'aliments basée sur une requête et des contraintes.
+
+    Le plafond de calories et l'exclusion des allergènes sont appliqués
+    dans le classement (index ou requête pgvector), avant le top-k : les
+    10 meilleurs aliments admissibles sont retournés en une passe.
+    `mmr_lambda` (par défaut SEARCH_MMR_LAMBDA) écarte les quasi-doublons
+    par réordonnancement MMR : 1 garde la pertinence seule, 0 la diversité seule.
+    """
+    if mmr_lambda is None:
+        mmr_lambda = SEARCH_MMR_LAMBDA
+    return search_aliments(session, query, allergies, top_k=10, max_calories=max_calories or None, mmr_lambda=mmr_lambda)
+
+def recommend_aliments_batch(session: Session, requetes: List[dict], top_k: int = 10) -> List[List[Aliment]]:
+    """Recommandations de plusieurs requêtes (query, allergies, max_calories) en une passe"""
+    return search_aliments_batch(
+        session,
+        [r["query"] for r in requetes],
+        [r.get("allergies") or [] for r in requetes],
+        [r.get("max_calories") or None for r in requetes],
+        top_k,
+    )
 
 def get_aliments_by_categorie(session: Session, categorie: str) -> List[Aliment]:
     """Récupérer tous les aliments d'une catégorie"""
@@ -0,0 +1,159 @@
+import os
+import time
+from typing import Iterable, List, Set
+
+import numpy as np
+from sqlalchemy import delete, func, insert
+from sqlmodel import Session, select
+from models import Aliment, AlimentSimilaire
+from search import get_aliment_index
+from vector_index import normalize_rows
+
+# Nombre de voisins conservés par aliment dans le graphe des similaires
+SIMILAIRES_K = int(os.getenv("SIMILAIRES_K", 10))
+# Aliments traités par produit matriciel et lignes par INSERT multi-valeurs
+SIMILAIRES_CHUNK = int(os.getenv("SIMILAIRES_CHUNK", 256))
+SIMILAIRES_INSERT_BATCH = int(os.getenv("SIMILAIRES_INSERT_BATCH", 5000))
+# Au-delà de cette part du catalogue modifiée d'un coup, reconstruire tout le graphe
+SIMILAIRES_REBUILD_RATIO = float(os.getenv("SIMILAIRES_REBUILD_RATIO", 0.1))
+
+def _insert(session: Session, rows: List[dict]) -> None:
+    for start in range(0, len(rows), SIMILAIRES_INSERT_BATCH):
+        session.execute(insert(AlimentSimilaire), rows[start:start + SIMILAIRES_INSERT_BATCH])
+
+def _neighbour_rows(session: Session, aliment_ids: List[int], k: int) -> List[dict]:
+    """Listes de voisins d'aliments, calculées par lots sur l'index en mémoire (l'aliment lui-même exclu)"""
+    vectors = get_aliment_index(session.get_bind()).ensure_loaded(session).vectors
+    rows = []
+    for start in range(0, len(aliment_ids), SIMILAIRES_CHUNK):
+        page = session.exec(
+            select(Aliment.id, Aliment.embedding)
+            .where(Aliment.id.in_(aliment_ids[start:start + SIMILAIRES_CHUNK]), Aliment.embedding != None)
+        ).all()
+        if not page:
+            continue
+        ids = np.array([row[0] for row in page], dtype=np.int64)
+        results = vectors.search_many(np.stack([row[1] for row in page]), k, allowed=lambda v: v.ids[None, :] != ids[:, None])
+        for aliment_id, (voisins, scores) in zip(ids, results):
+            rows.extend(
+                {"aliment_id": int(aliment_id), "similaire_id": int(voisin), "score": float(score)}
+                for voisin, score in zip(voisins, scores)
+            )
+    return rows
+
+def _replace_lists(session: Session, aliment_ids: Iterable[int], k: int) -> int:
+    """Recalculer entièrement les listes de voisins de ces aliments (sans valider la transaction)"""
+    aliment_ids = sorted(set(aliment_ids))
+    if not aliment_ids:
+        return 0
+    session.execute(delete(AlimentSimilaire).where(AlimentSimilaire.aliment_id.in_(aliment_ids)))
+    rows = _neighbour_rows(session, aliment_ids, k)
+    _insert(session, rows)
+    return len(rows)
+
+def build_similarites(session: Session, k: int = SIMILAIRES_K, commit_every: int = 4096, missing_only: bool = False) -> dict:
+    """Reconstruire tout le graphe des aliments similaires (ou seulement les listes manquantes)"""
+    debut = time.perf_counter()
+    statement = select(Aliment.id).where(Aliment.embedding != None).order_by(Aliment.id)
+    if missing_only:
+        statement = statement.where(~select(AlimentSimilaire.id).where(AlimentSimilaire.aliment_id == Aliment.id).exists())
+    else:
+        session.execute(delete(AlimentSimilaire))
+    aliment_ids = list(session.exec(statement).all())
+    rows = 0
+    for start in range(0, len(aliment_ids), commit_every):
+        rows += _replace_lists(session, aliment_ids[start:start + commit_every], k)
+        session.commit()
+        print(f"  {min(start + commit_every, len(aliment_ids))}/{len(aliment_ids)} listes de similaires calculées")
+    session.commit()
+    duree = time.perf_counter() - debut
+    return {"aliments": len(aliment_ids), "aretes": rows, "seconds": round(duree, 3)}
+
+def update_similarites(session: Session, aliment_ids: Iterable[int], k: int = SIMILAIRES_K) -> int:
+    """Mettre à jour le graphe après la création, la modification ou la suppression d'aliments.
+
+    Les aliments modifiés reçoivent une nouvelle liste ; les listes qui
+    les contenaient déjà sont recalculées (leur score a pu baisser). Pour
+    les autres, un aliment modifié n'est inséré que là où il bat le
+    dernier voisin (ou complète la liste), puis chaque liste est ramenée
+    à k lignes. Le reste du graphe n'est pas touché.
+    """
+    changed: Set[int] = {int(i) for i in aliment_ids}
+    if not changed:
+        return 0
+    vectors = get_aliment_index(session.get_bind()).ensure_loaded(session).vectors
+    total = len(vectors)
+    if len(changed) > SIMILAIRES_REBUILD_RATIO * total:
+        return build_similarites(session, k)["aretes"]
+    stale = set(session.exec(
+        select(AlimentSimilaire.aliment_id).where(AlimentSimilaire.similaire_id.in_(changed)).distinct()
+    ).all()) - changed
+    written = _replace_lists(session, changed, k)
+
+    # Plus petit score du graphe (index sur score) : un aliment ne peut entrer que dans
+    # les listes des voisins dont il est plus proche (toutes si les listes sont incomplètes)
+    floor = session.exec(select(func.min(AlimentSimilaire.score))).one()
+    if total <= k:
+        floor = -np.inf
+    joined: Set[int] = set()
+    changed_ids = sorted(changed)
+    for start in range(0, len(changed_ids) if floor is not None else 0, SIMILAIRES_CHUNK):
+        page = session.exec(
+            select(Aliment.id, Aliment.embedding)
+            .where(Aliment.id.in_(changed_ids[start:start + SIMILAIRES_CHUNK]), Aliment.embedding != None)
+        ).all()
+        if not page:
+            continue
+        scores = vectors.scores_many(normalize_rows(np.stack([row[1] for row in page])))
+        columns = np.flatnonzero((scores > floor).any(axis=0))
+        candidates = [int(i) for i in vectors.ids[columns] if int(i) not in changed and int(i) not in stale]
+        thresholds = {}
+        for offset in range(0, len(candidates), SIMILAIRES_CHUNK):
+            thresholds.update(
+                (aliment_id, score if count >= k else -np.inf)
+                for aliment_id, score, count in session.exec(
+                    select(AlimentSimilaire.aliment_id, func.min(AlimentSimilaire.score), func.count(AlimentSimilaire.id))
+                    .where(AlimentSimilaire.aliment_id.in_(candidates[offset:offset + SIMILAIRES_CHUNK]))
+                    .group_by(AlimentSimilaire.aliment_id)
+                ).all()
+            )
+        keep = np.array([int(i) in thresholds for i in vectors.ids[columns]], dtype=bool)
+        columns = columns[keep]
+        owners_ids = vectors.ids[columns]
+        minimum = np.array([thresholds[int(i)] for i in owners_ids], dtype=np.float32)
+        joins = [
+            {"aliment_id": int(owners_ids[j]), "similaire_id": int(aliment_id), "score": float(row_scores[j])}
+            for (aliment_id, _), row_scores in zip(page, scores[:, columns])
+            for j in np.flatnonzero(row_scores > minimum)
+        ]
+        _insert(session, joins)
+        joined.update(row["aliment_id"] for row in joins)
+        written += len(joins)
+    if joined:
+        _trim(session, sorted(joined), k)
+    written += _replace_lists(session, stale, k)
+    session.commit()
+    return written
+
+def _trim(session: Session, aliment_ids: List[int], k: int) -> None:
+    """Supprimer les voisins classés au-delà de k pour ces aliments"""
+    ranked = (
+        select(
+            AlimentSimilaire.id,
+            func.row_number().over(partition_by=AlimentSimilaire.aliment_id, order_by=AlimentSimilaire.score.desc()).label("rang"),
+        )
+        .where(AlimentSimilaire.aliment_id.in_(aliment_ids))
+        .subquery()
+    )
+    session.execute(delete(AlimentSimilaire).where(AlimentSimilaire.id.in_(select(ranked.c.id).where(ranked.c.rang > k))))
+
+def get_aliments_similaires(session: Session, aliment_id: int, limit: int = SIMILAIRES_K) -> List[Aliment]:
+    """Voisins d'un aliment lus dans le graphe (lecture seule : liste vide si elle n'a pas encore été calculée)"""
+    statement = (
+        select(Aliment)
+        .join(AlimentSimilaire, AlimentSimilaire.similaire_id == Aliment.id)
+        .where(AlimentSimilaire.aliment_id == aliment_id)
+        .order_by(AlimentSimilaire.score.desc())
+        .limit(limit)
+    )
+    return session.exec(statement).all()
@@ -0,0 +1,57 @@
+import pytest
+from sqlmodel import SQLModel, Session, create_engine
+from sqlmodel.pool import StaticPool
+from app.models import Food
+from app.services import nutrition_service
+from app.services.nutrition_service import NutritionService, get_nutrient_index
+
+def aliment(id, calories, proteins):
+    return Food(id=id, name=f"Aliment {id}", category="Test", calories=calories, proteins=proteins,
+                carbohydrates=10, fats=5, fiber=2)
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(nutrition_service, "NUTRIENT_INDEX_REFRESH_SECONDS", 0)
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    nutrition_service._indexes.clear()
+    with Session(engine) as session:
+        yield session
+    nutrition_service._indexes.clear()
+    SQLModel.metadata.drop_all(engine)
+
+class TestNutrientIndexFreshness:
+    def test_rebuilt_after_other_worker_writes(self, session):
+        """Test que la matrice suit les écritures locales et est reconstruite après celles d'un autre worker"""
+        session.add_all([aliment(i, 100 + i, 10) for i in range(1, 21)])
+        session.commit()
+        index = get_nutrient_index(session)
+        food = aliment(21, 110, 10)
+        session.add(food)
+        session.commit()
+        NutritionService(session).on_food_changed(food)
+        assert get_nutrient_index(session) is index
+        # Écriture hors de ce worker : le nombre d'aliments en base ne correspond plus
+        session.add(aliment(22, 115, 10))
+        session.commit()
+        rebuilt = get_nutrient_index(session)
+        assert rebuilt is not index and 22 in rebuilt
+
+    def test_rebuilt_after_empty_build_or_drift(self, session):
+        """Test qu'une matrice construite à vide, ou dont les statistiques ont dérivé, est reconstruite"""
+        index = get_nutrient_index(session)
+        assert len(index) == 0
+        service = NutritionService(session)
+        for i in range(1, 11):
+            food = aliment(i, 100 + i, 10)
+            session.add(food)
+            session.commit()
+            service.on_food_changed(food)
+        rebuilt = get_nutrient_index(session)
+        assert rebuilt is not index and len(rebuilt) == 10
+        for i in range(11, 41):
+            food = aliment(i, 2000 + i, 80)
+            session.add(food)
+            session.commit()
+            service.on_food_changed(food)
+        assert get_nutrient_index(session) is not rebuilt
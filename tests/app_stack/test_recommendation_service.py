@@ -0,0 +1,138 @@
+import pytest
+from sqlmodel import SQLModel, Session, create_engine, select
+from sqlmodel.pool import StaticPool
+from app.models import Food, Recommendation, User
+from app.services import recommendation_service
+from app.services.recommendation_service import REASONS, FoodCatalog, RecommendationService, _allergy_terms, get_food_catalog
+
+def aliment(id, name, category, calories, proteins, fiber, fats, vitamins=(), minerals=()):
+    return Food(id=id, name=name, category=category, calories=calories, proteins=proteins, carbohydrates=0,
+                fiber=fiber, fats=fats, vitamins=list(vitamins), minerals=list(minerals))
+
+CATALOGUE = [
+    aliment(1, "Poulet grillé", "Viande", 165, 31, 0, 3.6),
+    aliment(2, "Lentilles", "Légumineuses", 116, 9, 8, 0.4),
+    aliment(3, "Beurre", "Produits laitiers", 717, 0.9, 0, 81),
+    aliment(4, "Épinards", "Légumes", 23, 2.9, 2.2, 0.4, vitamins=["A", "C", "K"], minerals=["Fer"]),
+]
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    recommendation_service._catalogs.clear()
+    yield engine
+    recommendation_service._catalogs.clear()
+    SQLModel.metadata.drop_all(engine)
+
+class TestFoodCatalog:
+    def test_scores_and_reasons(self):
+        """Test des échelles fixes du score et du motif retenu (composante dominante)"""
+        catalog = FoodCatalog(CATALOGUE)
+        ranked = catalog.top(frozenset(), 10)
+        assert [food_id for food_id, _, _ in ranked] == [4, 2, 1, 3]
+        assert [REASONS[reason] for _, reason, _ in ranked[:3]] == ["Riche en fibres", "Riche en fibres", "Riche en protéines"]
+        assert ranked[2][2] == pytest.approx((10 * 31 - 9 * 3.6) / 165)
+        assert ranked[3][2] < 0
+
+    def test_allergies_exclude_names_and_categories(self):
+        """Test que les allergies écartent les aliments par nom ou catégorie, sans accents ni pluriel"""
+        catalog = FoodCatalog(CATALOGUE)
+        terms = _allergy_terms(["produits LAITIERS", "Épinard"])
+        assert list(catalog.excluded(terms)) == [False, False, True, True]
+        assert [food_id for food_id, _, _ in catalog.top(terms, 10)] == [2, 1]
+        assert [food_id for food_id, _, _ in catalog.top(_allergy_terms(["lentilles"]), 2)] == [4, 1]
+        assert catalog.top(frozenset(), 0) == []
+
+    def test_allergies_match_whole_tokens(self):
+        """Test que les allergies sont comparées jeton par jeton (« oeuf » n'exclut pas « boeuf »)"""
+        catalog = FoodCatalog([
+            aliment(1, "Bœuf bourguignon", "Viande", 200, 25, 0, 10),
+            aliment(2, "Œufs brouillés", "Plats", 150, 12, 0, 10),
+            aliment(3, "Noix de cajou", "Fruits à coque", 550, 18, 3, 44),
+            aliment(4, "Pain aux noix", "Boulangerie", 300, 9, 5, 8),
+        ])
+        assert list(catalog.excluded(_allergy_terms(["Oeufs"]))) == [False, True, False, False]
+        assert list(catalog.excluded(_allergy_terms(["fruits à coque"]))) == [False, False, True, False]
+        assert list(catalog.excluded(_allergy_terms(["Noix"]))) == [False, False, True, True]
+
+    def test_upsert_and_remove_keep_cached_exclusions(self):
+        """Test que l'ajout, la modification et le retrait d'une ligne suivent les masques en cache"""
+        catalog = FoodCatalog(CATALOGUE)
+        terms = _allergy_terms(["Viande"])
+        assert list(catalog.excluded(terms)) == [True, False, False, False]
+        catalog.upsert(aliment(5, "Bœuf haché", "Viande", 250, 26, 0, 15))
+        catalog.upsert(aliment(3, "Beurre allégé", "Produits laitiers", 380, 0.5, 0, 1))
+        assert list(catalog.excluded(terms)) == [True, False, False, False, True]
+        assert catalog.signature == (5, 5)
+        assert catalog.top(frozenset(), 5)[-1][::2] == (3, pytest.approx((10 * 0.5 - 9 * 1) / 380))
+        assert catalog.remove(1) and not catalog.remove(1)
+        assert list(catalog.excluded(terms)) == [False, False, False, True]
+        assert catalog.signature == (4, 5)
+
+class TestRecommendationService:
+    def test_new_food_is_inserted_then_trimmed(self, engine):
+        """Test que on_food_changed insère l'aliment là où il bat le dernier score, ramène chaque liste
+        à per_user lignes et donne le même résultat qu'un recalcul complet, sans recharger le catalogue"""
+        with Session(engine) as session:
+            session.add_all([aliment(f.id, f.name, f.category, f.calories, f.proteins, f.fiber, f.fats, f.vitamins, f.minerals)
+                             for f in CATALOGUE])
+            session.add_all([
+                User(id=1, name="Ana", email="ana@example.com", hashed_password="x", allergies=[]),
+                User(id=2, name="Bo", email="bo@example.com", hashed_password="x", allergies=["Légumineuses"]),
+                User(id=3, name="Cy", email="cy@example.com", hashed_password="x", allergies=["Soja"]),
+            ])
+            session.commit()
+            service = RecommendationService(session, per_user=2)
+            assert service.refresh_all()["recommendations"] == 6
+            catalog = get_food_catalog(session)
+
+            session.add(aliment(5, "Tofu au soja", "Légumineuses", 60, 14, 1, 1, minerals=["Fer", "Calcium"]))
+            session.add(aliment(6, "Pomme", "Fruits", 40, 0.3, 4, 0.2))
+            session.commit()
+            # Tofu : liste d'Ana seulement (allergies de Bo et Cy) ; pomme : bat le dernier score de Bo
+            assert service.on_food_changed(5) == 1
+            assert service.on_food_changed(6) == 1
+            assert get_food_catalog(session) is catalog and len(catalog) == 6
+
+            def lignes():
+                return sorted(session.exec(select(Recommendation.user_id, Recommendation.food_id)).all())
+            incremental = lignes()
+            assert all(sum(1 for u, _ in incremental if u == user_id) == 2 for user_id in (1, 2, 3))
+            assert (2, 5) not in incremental and (3, 5) not in incremental
+            service.refresh_all()
+            assert lignes() == incremental
+
+    def test_allergy_update_refreshes_user_recommendations(self, engine):
+        """Test que la modification des allergies d'un utilisateur recalcule ses seules recommandations"""
+        from app.services.user_service import UserService
+        with Session(engine) as session:
+            session.add_all([aliment(f.id, f.name, f.category, f.calories, f.proteins, f.fiber, f.fats, f.vitamins, f.minerals)
+                             for f in CATALOGUE])
+            session.add_all([
+                User(id=1, name="Ana", email="ana@example.com", hashed_password="x", allergies=[]),
+                User(id=2, name="Bo", email="bo@example.com", hashed_password="x", allergies=[]),
+            ])
+            session.commit()
+            RecommendationService(session, per_user=2).refresh_all()
+
+            def aliments(user_id):
+                return sorted(session.exec(select(Recommendation.food_id).where(Recommendation.user_id == user_id)).all())
+            assert aliments(1) == aliments(2) == [2, 4]
+            user = UserService(session).update_user(1, {"allergies": ["Légumes"]})
+            assert user.allergies == ["Légumes"]
+            assert 4 not in aliments(1) and aliments(2) == [2, 4]
+            assert UserService(session).update_user(99, {"name": "Personne"}) is None
+
+    def test_catalog_reloaded_after_other_worker_writes(self, engine, monkeypatch):
+        """Test que le catalogue est rechargé quand le nombre d'aliments en base ne correspond plus"""
+        monkeypatch.setattr(recommendation_service, "RECOMMENDATIONS_CATALOG_REFRESH_SECONDS", 0)
+        with Session(engine) as session:
+            session.add(aliment(1, "Poulet grillé", "Viande", 165, 31, 0, 3.6))
+            session.commit()
+            catalog = get_food_catalog(session)
+            assert get_food_catalog(session) is catalog
+            session.add(aliment(2, "Lentilles", "Légumineuses", 116, 9, 8, 0.4))
+            session.commit()
+            reloaded = get_food_catalog(session)
+            assert reloaded is not catalog and reloaded.signature == (2, 2)
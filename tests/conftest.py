@@ -0,0 +1,7 @@
+import os
+
+# Les tests utilisent le moteur d'embedding par hachage : aucun modèle à télécharger
+os.environ.setdefault("EMBEDDING_MODEL_NAME", "hashing")
+
+# Les tests de la pile app/ tournent dans leur propre processus (voir test_app_stack.py)
+collect_ignore = [] if os.getenv("APP_STACK_TESTS") else ["app_stack"]
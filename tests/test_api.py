@@ -1,7 +1,8 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import Session, create_engine
+from sqlmodel import Session, create_engine, select
 from sqlmodel.pool import StaticPool
+from sqlalchemy.exc import IntegrityError
 from main import app
 from models import Aliment, Utilisateur
 from database import get_session
@@ -97,6 +98,106 @@ class TestAliments:
         # Vérifier que la réponse est une liste
         assert isinstance(response.json(), list)
 
+    def test_search_modes(self):
+        """Test des modes de recherche lexical, sémantique et hybride"""
+        from embedding import embedding_service
+        from search import get_aliment_index, get_lexical_index
+        get_aliment_index(engine).invalidate()
+        get_lexical_index(engine).invalidate()
+        noms = ["Épinards à la crème", "Poutine québécoise", "Soupe aux pois", "Tarte au sucre"]
+        with Session(engine) as session:
+            for nom in noms:
+                session.add(Aliment(nom=nom, categorie="Test", calories=300, allergenes=["Lactose"] if "crème" in nom else [],
+                                    embedding=embedding_service.embed(nom), embedding_nom=nom))
+            session.commit()
+        for mode in ["lexical", "semantic", "hybrid"]:
+            response = client.get(f"/aliments/?q=epinards&mode={mode}")
+            assert response.status_code == 200
+            assert response.json()[0]["nom"] == "Épinards à la crème"
+        response = client.get("/aliments/?q=epinards&mode=lexical&allergies=Lactose")
+        assert response.json() == []
+        assert client.get("/aliments/?q=epinards&mode=inconnu").status_code == 422
+
+    def test_recommendations_mmr(self):
+        """Test que le réordonnancement MMR fait remonter un aliment différent des variantes de poulet"""
+        from embedding import embedding_service
+        from search import get_aliment_index
+        get_aliment_index(engine).invalidate()
+        noms = [f"Poulet rôti {i}" for i in range(12)] + ["Poisson braisé", "Salade de fruits"]
+        with Session(engine) as session:
+            for nom in noms:
+                session.add(Aliment(nom=nom, categorie="Test", calories=300, embedding=embedding_service.embed(nom), embedding_nom=nom))
+            session.commit()
+        pertinence = [a["nom"] for a in client.get("/aliments/recommandations/?query=poulet rôti").json()]
+        diversite = [a["nom"] for a in client.get("/aliments/recommandations/?query=poulet rôti&mmr_lambda=0.3").json()]
+        assert all(nom.startswith("Poulet") for nom in pertinence)
+        assert len(diversite) == 10 and not all(nom.startswith("Poulet") for nom in diversite)
+        assert client.get("/aliments/recommandations/?query=poulet&mmr_lambda=2").status_code == 422
+
+    def test_autocomplete(self):
+        """Test de l'autocomplétion par préfixe (route déclarée avant /{aliment_id})"""
+        from search import get_lexical_index
+        get_lexical_index(engine).invalidate()
+        with Session(engine) as session:
+            session.add(Aliment(nom="Poutine québécoise", categorie="Plat principal", calories=700, allergenes=["Lactose"]))
+            session.add(Aliment(nom="Pouding chômeur", categorie="Dessert", calories=400))
+            session.commit()
+        response = client.get("/aliments/autocomplete?prefix=pou&tri=calories")
+        assert response.status_code == 200
+        assert [s["nom"] for s in response.json()] == ["Pouding chômeur", "Poutine québécoise"]
+        response = client.get("/aliments/autocomplete?prefix=pou&allergies=Lactose")
+        assert [s["nom"] for s in response.json()] == ["Pouding chômeur"]
+        assert client.get("/aliments/autocomplete").status_code == 422
+
+    def test_similar_aliments(self, auth_token):
+        """Test de la route des aliments similaires (graphe rempli à la création, lecture seule)"""
+        from search import get_aliment_index
+        from similarites import build_similarites
+        get_aliment_index(engine).invalidate()
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        ids = [client.post("/aliments/", json={"nom": nom, "categorie": "Test", "calories": 300}, headers=headers).json()["id"]
+               for nom in ["Soupe aux pois", "Soupe aux légumes", "Tarte au sucre"]]
+        response = client.get(f"/aliments/{ids[0]}/similaires?limit=2")
+        assert response.status_code == 200
+        assert [a["nom"] for a in response.json()] == ["Soupe aux légumes", "Tarte au sucre"]
+        assert client.get("/aliments/9999/similaires").status_code == 404
+        # Aliment écrit hors de l'API : pas de calcul à la lecture, liste complétée par build_similarites
+        from embedding import embedding_service
+        with Session(engine) as session:
+            aliment = Aliment(nom="Soupe à l'oignon", categorie="Test", calories=200,
+                              embedding=embedding_service.embed("Soupe à l'oignon"), embedding_nom="Soupe à l'oignon")
+            session.add(aliment)
+            session.commit()
+            aliment_id = aliment.id
+            assert client.get(f"/aliments/{aliment_id}/similaires").json() == []
+            assert build_similarites(session, missing_only=True)["aliments"] == 1
+        assert len(client.get(f"/aliments/{aliment_id}/similaires").json()) == 3
+
+    def test_batch_recommendations_match_single_requests(self):
+        """Test que le lot retourne, par requête, les mêmes résultats que la route unitaire"""
+        from embedding import embedding_service
+        from search import get_aliment_index
+        get_aliment_index(engine).invalidate()
+        noms = ["Soupe aux pois", "Poutine québécoise", "Tarte au sucre", "Salade verte", "Pâté chinois", "Crème brûlée"]
+        with Session(engine) as session:
+            for i, nom in enumerate(noms):
+                session.add(Aliment(nom=nom, categorie="Test", calories=200 * (i + 1), allergenes=["Lactose"] if i % 2 else [],
+                                    embedding=embedding_service.embed(nom), embedding_nom=nom))
+            session.commit()
+        requetes = [
+            {"query": "soupe", "allergies": [], "max_calories": 800},
+            {"query": "dessert sucré", "allergies": ["Lactose"], "max_calories": 1200},
+        ]
+        response = client.post("/aliments/recommandations/lot", json={"requetes": requetes, "top_k": 3})
+        assert response.status_code == 200
+        lots = response.json()
+        assert len(lots) == 2
+        for requete, lot in zip(requetes, lots):
+            params = {"query": requete["query"], "max_calories": requete["max_calories"], "allergies": ",".join(requete["allergies"])}
+            unitaire = client.get("/aliments/recommandations/", params=params).json()
+            assert [a["id"] for a in lot] == [a["id"] for a in unitaire][:3]
+        assert client.post("/aliments/recommandations/lot", json={"requetes": requetes, "top_k": 51}).status_code == 422
+
     def test_get_all_aliments(self):
         """Test de récupération de tous les aliments"""
         response = client.get("/aliments/tous/")
@@ -115,6 +216,43 @@ class TestAliments:
         assert response.status_code == 200
         assert isinstance(response.json(), list)
 
+    def test_embedding_column_roundtrip(self):
+        """Test du stockage de l'embedding en blob float32 sous SQLite"""
+        with Session(engine) as session:
+            aliment = Aliment(nom="Poutine", categorie="Plat principal", calories=700,
+                              allergenes=["Lactose"], embedding=[0.5, -1.0, 2.0], embedding_nom="Poutine")
+            session.add(aliment)
+            session.commit()
+            aliment_id = aliment.id
+        with Session(engine) as session:
+            aliment = session.get(Aliment, aliment_id)
+            assert aliment.embedding.dtype.name == "float32"
+            assert list(aliment.embedding) == [0.5, -1.0, 2.0]
+            assert aliment.embedding_nom == "Poutine"
+
+    def test_simple_stack_search(self):
+        """Test de la recherche de la version SQLite : aliments chargés avec embeddings, repli par nom sans vecteur"""
+        from main_simple import app as app_simple
+        from database_simple import get_session as get_session_simple
+        from search import get_aliment_index, get_lexical_index
+        from utils_simple import load_initial_data
+        app_simple.dependency_overrides[get_session_simple] = override_get_session
+        client_simple = TestClient(app_simple)
+        get_aliment_index(engine).invalidate()
+        get_lexical_index(engine).invalidate()
+        with Session(engine) as session:
+            session.add(Aliment(nom="Poulet rôti à l'érable", categorie="Plat principal", calories=450, allergenes="[]"))
+            session.commit()
+            response = client_simple.get("/aliments/?q=poulet&mode=semantic")
+            assert [a["nom"] for a in response.json()] == ["Poulet rôti à l'érable"]
+            session.add(Aliment(nom="Épinards à la crème", categorie="Accompagnement", calories=150, allergenes="[]"))
+            session.commit()
+            response = client_simple.get("/aliments/?q=epinards")
+            assert [a["nom"] for a in response.json()] == ["Épinards à la crème"]
+            load_initial_data(session)
+            assert session.exec(select(Aliment).where(Aliment.embedding == None)).all()[0].nom == "Poulet rôti à l'érable"
+            assert len(session.exec(select(Aliment).where(Aliment.embedding != None)).all()) > 0
+
 class TestPlansRepas:
     def test_generate_plan_repas(self, auth_token):
         """Test de génération de plan de repas"""
@@ -127,6 +265,120 @@ class TestPlansRepas:
         # Le test peut échouer si l'utilisateur n'existe pas, mais on vérifie la structure
         assert response.status_code in [200, 400, 404]
 
+    def test_plan_written_in_one_transaction(self):
+        """Test que le plan, ses 21 repas et leurs aliments sont écrits avec un seul commit, dans les bornes de config.yaml"""
+        from sqlalchemy import event
+        from meal_planner import PLAN_LIMITS
+        from services import generate_plan_repas
+        import datetime
+        with Session(engine) as session:
+            utilisateur = Utilisateur(nom="Plan", email="plan@example.com", hashed_password="x", allergies=["Gluten"])
+            session.add(utilisateur)
+            for i in range(12):
+                session.add(Aliment(nom=f"Aliment {i}", categorie="Test", calories=150 + 50 * (i % 6), allergenes=["Gluten"] if i < 3 else []))
+            session.commit()
+            commits = []
+            compter = lambda connection: commits.append(connection)
+            event.listen(engine, "commit", compter)
+            try:
+                plan = generate_plan_repas(session, utilisateur.id, datetime.date(2024, 1, 1))
+            finally:
+                event.remove(engine, "commit", compter)
+            assert len(commits) == 1
+            assert len(plan.repas) == PLAN_LIMITS.days_per_plan * PLAN_LIMITS.max_meals_per_day == 21
+            assert [r.jour for r in plan.repas[::3]] == ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
+            assert [r.repas for r in plan.repas[:3]] == ["Petit-déjeuner", "Déjeuner", "Dîner"]
+            for repas in plan.repas:
+                calories = sum(a.aliment.calories for a in repas.aliments)
+                assert PLAN_LIMITS.min_calories_per_meal <= calories <= PLAN_LIMITS.max_calories_per_meal
+                assert all("Gluten" not in a.aliment.allergenes for a in repas.aliments)
+
+    def test_plan_is_generated_once_per_week(self):
+        """Test qu'un plan existant est retourné tel quel, même sous requêtes simultanées, et remplacé avec regenerate"""
+        from concurrent.futures import ThreadPoolExecutor
+        from sqlmodel import select
+        from models import PlanRepas, RepasJour
+        from services import generate_plan_repas
+        import datetime
+        semaine = datetime.date(2024, 1, 8)
+        with Session(engine) as session:
+            utilisateur = Utilisateur(nom="Idem", email="idem@example.com", hashed_password="x", allergies=[])
+            session.add(utilisateur)
+            for i in range(6):
+                session.add(Aliment(nom=f"Aliment {i}", categorie="Test", calories=200 + 50 * i))
+            session.commit()
+            utilisateur_id = utilisateur.id
+
+        def generer(_):
+            with Session(engine) as session:
+                return generate_plan_repas(session, utilisateur_id, semaine).id
+
+        with ThreadPoolExecutor(4) as executor:
+            plan_ids = set(executor.map(generer, range(8)))
+        assert len(plan_ids) == 1
+        # Une autre date de la même semaine désigne le même plan
+        with Session(engine) as session:
+            plan = generate_plan_repas(session, utilisateur_id, semaine + datetime.timedelta(days=3))
+            assert plan.id in plan_ids and plan.semaine == semaine
+        with Session(engine) as session:
+            nouveau = generate_plan_repas(session, utilisateur_id, semaine, regenerate=True)
+            plans = session.exec(select(PlanRepas).where(PlanRepas.utilisateur_id == utilisateur_id)).all()
+            assert [p.id for p in plans] == [nouveau.id]
+            # Repas de l'ancien plan supprimés avec lui
+            assert len(session.exec(select(RepasJour)).all()) == 21
+            doublon = PlanRepas(utilisateur_id=utilisateur_id, semaine=semaine)
+            session.add(doublon)
+            with pytest.raises(IntegrityError):
+                session.commit()
+
+    def test_generate_plans_lot(self):
+        """Test de la génération des plans de tous les utilisateurs par groupes d'allergies, en parallèle"""
+        from sqlmodel import select
+        from models import PlanRepas
+        from generation_plans import _write_page, generate_plans_lot
+        import datetime
+        with Session(engine) as session:
+            utilisateurs = [
+                Utilisateur(nom=f"Lot {i}", email=f"lot{i}@example.com", hashed_password="x", allergies=["Gluten"] if i % 2 else [])
+                for i in range(5)
+            ]
+            session.add_all(utilisateurs)
+            for i in range(12):
+                session.add(Aliment(nom=f"Aliment {i}", categorie="Test", calories=150 + 50 * (i % 6), allergenes=["Gluten"] if i < 3 else []))
+            session.commit()
+            stats = generate_plans_lot(session, datetime.date(2024, 1, 1), workers=2, users_per_commit=2, seed=0)
+            assert stats["plans"] == 5 and stats["groupes"] == 2
+            stats = generate_plans_lot(session, datetime.date(2024, 1, 3), workers=1)
+            assert stats["plans"] == 0 and stats["existants"] == 5
+            # Plan écrit entre la lecture des plans existants et l'écriture de la page : ignoré, pas complété
+            assert _write_page(session, datetime.date(2024, 1, 1), [(utilisateurs[0].id, [[[1]]])], False) == 0
+            for utilisateur in utilisateurs:
+                plan, = session.exec(select(PlanRepas).where(PlanRepas.utilisateur_id == utilisateur.id)).all()
+                assert plan.semaine == datetime.date(2024, 1, 1) and len(plan.repas) == 21
+                aliments = [a.aliment for repas in plan.repas for a in repas.aliments]
+                assert all(300 <= sum(a.aliment.calories for a in repas.aliments) <= 800 for repas in plan.repas)
+                if utilisateur.allergies:
+                    assert all("Gluten" not in a.allergenes for a in aliments)
+
+    def test_generer_plans_lot_route(self, auth_token):
+        """Test de l'endpoint de génération des plans de la semaine (administrateurs, en tâche de fond)"""
+        from models import PlanRepas
+        import datetime
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        assert client.post("/plans_repas/generer-lot?semaine=2024-01-03", headers=headers).status_code == 403
+        with Session(engine) as session:
+            utilisateur = session.exec(select(Utilisateur).where(Utilisateur.email == "test@example.com")).one()
+            utilisateur.is_superuser = True
+            session.add(utilisateur)
+            session.commit()
+        response = client.post("/plans_repas/generer-lot?semaine=2024-01-03&regenerate=true", headers=headers)
+        assert response.status_code == 202
+        assert response.json()["semaine"] == "2024-01-01"
+        # Le client de test exécute les tâches de fond avant de rendre la réponse
+        with Session(engine) as session:
+            plans = session.exec(select(PlanRepas).where(PlanRepas.semaine == datetime.date(2024, 1, 1))).all()
+            assert len(plans) == 1
+
 class TestBuffets:
     def test_create_buffet(self, auth_token):
         """Test de création de buffet"""
@@ -155,6 +407,21 @@ class TestAPI:
         data = response.json()
         assert data["status"] == "healthy"
 
+    def test_embedding_model_not_loaded_at_import(self):
+        """Test que l'import de l'application ne charge pas le modèle d'embedding"""
+        from embedding import EmbeddingService
+        service = EmbeddingService()
+        assert service.is_ready is False
+        assert service.status()["state"] == "not_loaded"
+
+    def test_health_reports_embedding_state(self):
+        """Test que l'état du modèle est exposé par les endpoints de santé"""
+        response = client.get("/health")
+        assert "embedding" in response.json()
+        response = client.get("/health/ready")
+        assert response.status_code in [200, 503]
+        assert response.json()["embedding"]["state"] in ["not_loaded", "loading", "ready", "error"]
+
     def test_docs_endpoint(self):
         """Test de l'endpoint de documentation"""
         response = client.get("/docs")
@@ -0,0 +1,13 @@
+import os
+import subprocess
+import sys
+
+def test_app_stack_in_own_process():
+    """Tests de la pile app/ (tests/app_stack) : app.models et models.py ne peuvent pas partager
+    une même metadata SQLModel, ils tournent donc dans un processus pytest séparé"""
+    racine = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sortie = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", os.path.join("tests", "app_stack")],
+        cwd=racine, env={**os.environ, "APP_STACK_TESTS": "1"}, capture_output=True, text=True,
+    )
+    assert sortie.returncode == 0, sortie.stdout + sortie.stderr
@@ -0,0 +1,100 @@
+import pytest
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from embedding import MicroBatcher, EmbeddingCache, EmbeddingService, HashingBackend, SentenceTransformerBackend, create_backend
+
+def encode_longueurs(texts):
+    """Encodeur de test : le vecteur d'un texte contient sa longueur"""
+    appels.append(len(texts))
+    return np.array([[len(t), 1.0] for t in texts], dtype=np.float32)
+
+appels = []
+
+@pytest.fixture(autouse=True)
+def reset_appels():
+    appels.clear()
+    yield
+
+class TestMicroBatcher:
+    def test_concurrent_calls_share_one_encode(self):
+        """Test que les appels concurrents sont regroupés et reçoivent leur propre vecteur"""
+        batcher = MicroBatcher(encode_longueurs, max_batch_size=16, max_wait_ms=50)
+        textes = ["a" * n for n in range(1, 17)]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            vecteurs = list(executor.map(batcher.submit, textes))
+        assert [int(v[0]) for v in vecteurs] == list(range(1, 17))
+        assert len(appels) < len(textes)
+        assert sum(appels) == len(textes)
+
+    def test_batch_size_is_bounded(self):
+        """Test que la taille de lot configurée n'est jamais dépassée"""
+        batcher = MicroBatcher(encode_longueurs, max_batch_size=4, max_wait_ms=20)
+        with ThreadPoolExecutor(max_workers=12) as executor:
+            list(executor.map(batcher.submit, ["x"] * 12))
+        assert max(appels) <= 4
+
+    def test_errors_are_propagated_to_callers(self):
+        """Test qu'une erreur d'encodage est remontée à chaque appelant"""
+        def encode_en_erreur(texts):
+            raise RuntimeError("modèle indisponible")
+        batcher = MicroBatcher(encode_en_erreur, max_batch_size=4, max_wait_ms=1)
+        with pytest.raises(RuntimeError):
+            batcher.submit("poulet")
+
+class TestEmbeddingCache:
+    def test_key_is_case_and_accent_insensitive(self):
+        """Test que « Épinards » et « epinards » partagent la même entrée"""
+        cache = EmbeddingCache(max_size=10)
+        cache.put("modele", "Épinards", [1.0, 2.0])
+        assert cache.get("modele", "  epinards ") is not None
+        assert cache.get("autre-modele", "epinards") is None
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_lru_eviction(self):
+        """Test que l'entrée la moins récemment utilisée est évincée"""
+        cache = EmbeddingCache(max_size=2)
+        cache.put("m", "poulet", [1.0])
+        cache.put("m", "soupe", [2.0])
+        cache.get("m", "poulet")
+        cache.put("m", "dessert", [3.0])
+        assert cache.get("m", "soupe") is None
+        assert cache.get("m", "poulet") is not None
+        assert len(cache) == 2
+
+    def test_save_and_load(self, tmp_path):
+        """Test de la persistance du cache sur disque"""
+        path = str(tmp_path / "cache.npz")
+        cache = EmbeddingCache(max_size=10)
+        cache.put("m", "poulet", [1.0, 2.0, 3.0])
+        cache.put("m", "soupe", [4.0, 5.0, 6.0])
+        assert cache.save(path) == 2
+        recharge = EmbeddingCache(max_size=10)
+        assert recharge.load(path) == 2
+        np.testing.assert_allclose(recharge.get("m", "Soupe"), [4.0, 5.0, 6.0])
+
+class TestBackends:
+    def test_backend_is_chosen_from_model_name(self):
+        """Test du choix du moteur par le préfixe du nom de modèle"""
+        assert isinstance(create_backend("all-MiniLM-L6-v2"), SentenceTransformerBackend)
+        assert create_backend("onnx:models/minilm").model_path == "models/minilm"
+        assert create_backend("hashing:64").dim == 64
+        assert create_backend("models/minilm", backend="onnx").model_path == "models/minilm"
+        with pytest.raises(ValueError):
+            create_backend("all-MiniLM-L6-v2", backend="inconnu")
+
+    def test_hashing_backend_is_deterministic_and_normalized(self):
+        """Test que le hachage ne dépend ni du processus ni des accents"""
+        backend = HashingBackend(dim=64)
+        vecteurs = backend.encode(["Crème brûlée", "creme brulee", "Poulet rôti"])
+        assert vecteurs.shape == (3, 64)
+        assert np.allclose(np.linalg.norm(vecteurs, axis=1), 1.0)
+        assert np.allclose(vecteurs[0], vecteurs[1])
+        assert vecteurs[0] @ vecteurs[2] < 0.5
+
+    def test_service_uses_backend_without_model_files(self):
+        """Test que le service est prêt sans téléchargement avec le moteur par hachage"""
+        service = EmbeddingService("hashing:32", batch_size=1, batch_wait_ms=0)
+        assert len(service.embed("soupe aux pois")) == 32
+        assert service.status()["state"] == "ready"
+        assert service.status()["backend"] == "HashingBackend"
@@ -0,0 +1,621 @@
+import pytest
+import numpy as np
+import search
+from sqlmodel import SQLModel, Session, create_engine, select
+from sqlmodel.pool import StaticPool
+from models import Aliment
+from allergens import allergen_mask
+from search import AlimentIndex, LexicalAliment, PGVECTOR_SEARCH, allergen_filter, get_aliments_ordered, reciprocal_rank_fusion
+from lexical_index import LexicalIndex, PrefixIndex, tokenize
+from vector_index import IVFIndex, QuantizedVectorIndex, VectorIndex, mmr_rerank, normalize_rows
+from app.services.nutrient_index import Goal, NutrientIndex
+from meal_planner import MealPlanner, PlanLimits, get_planner, load_plan_limits
+from similarites import build_similarites, get_aliments_similaires, update_similarites
+
+@pytest.fixture
+def vecteurs():
+    rng = np.random.default_rng(42)
+    return rng.standard_normal((500, 16)).astype(np.float32)
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    SQLModel.metadata.drop_all(engine)
+
+class TestVectorIndex:
+    def test_search_matches_brute_force(self, vecteurs):
+        """Test que le top-k correspond à un calcul cosinus exhaustif"""
+        index = VectorIndex()
+        index.build(range(100, 600), vecteurs)
+        query = vecteurs[7] + 0.1
+        ids, scores = index.search(query, k=10)
+
+        normes = vecteurs / np.linalg.norm(vecteurs, axis=1, keepdims=True)
+        attendus = np.argsort(-(normes @ (query / np.linalg.norm(query))))[:10] + 100
+        assert list(ids) == list(attendus)
+        assert np.all(np.diff(scores) <= 0)
+        assert index.matrix.flags["C_CONTIGUOUS"]
+
+    def test_upsert_and_remove(self, vecteurs):
+        """Test des mises à jour incrémentales de l'index"""
+        index = VectorIndex()
+        for i, v in enumerate(vecteurs[:20]):
+            index.upsert(i, v)
+        assert len(index) == 20
+        index.upsert(5, vecteurs[30])
+        assert index.search(vecteurs[30], k=1)[0][0] == 5
+        assert index.remove(5)
+        assert 5 not in index
+        assert len(index) == 19
+        assert 5 not in index.search(vecteurs[30], k=19)[0]
+
+    def test_filtered_search_returns_k_allowed_rows(self, vecteurs):
+        """Test que le filtre est appliqué avant le top-k et non après"""
+        index = VectorIndex(attributes=["allergenes_mask"])
+        masks = [allergen_mask(["Gluten"]) if i % 10 else 0 for i in range(500)]
+        index.build(range(500), vecteurs, allergenes_mask=masks)
+        ids, _ = index.search(vecteurs[3], k=10, allowed=allergen_filter(allergen_mask(["Gluten"])))
+        assert len(ids) == 10
+        assert all(i % 10 == 0 for i in ids)
+
+    def test_search_many_matches_single_searches(self, vecteurs):
+        """Test que le produit matriciel par lot redonne chaque top-k, filtre par requête compris"""
+        index = VectorIndex(attributes=["allergenes_mask"])
+        masks = np.array([allergen_mask(["Gluten"]) if i % 3 else 0 for i in range(500)])
+        index.build(range(500), vecteurs, allergenes_mask=masks)
+        requetes = vecteurs[:4] + 0.05
+        exclus = np.array([0, allergen_mask(["Gluten"]), 0, allergen_mask(["Gluten"])])[:, None]
+        resultats = index.search_many(requetes, k=5, allowed=lambda v: (v.column("allergenes_mask")[None, :] & exclus) == 0)
+        for requete, masque, (ids, _) in zip(requetes, exclus[:, 0], resultats):
+            assert list(ids) == list(index.search(requete, k=5, allowed=allergen_filter(int(masque)))[0])
+
+class TestIVFIndex:
+    def test_full_probe_matches_exact_search(self, vecteurs):
+        """Test que sonder toutes les listes redonne le résultat exact"""
+        exact = VectorIndex()
+        exact.build(range(500), vecteurs)
+        ivf = IVFIndex(nlist=8, nprobe=8, min_train_size=0)
+        ivf.build(range(500), vecteurs)
+        assert ivf.trained
+        assert list(ivf.search(vecteurs[11], k=10)[0]) == list(exact.search(vecteurs[11], k=10)[0])
+
+    def test_probe_widens_until_k_allowed(self, vecteurs):
+        """Test que la sonde s'élargit quand le filtre écarte la plupart des candidats"""
+        ivf = IVFIndex(attributes=["allergenes_mask"], nlist=16, nprobe=1, min_train_size=0)
+        masks = [0 if i % 50 == 0 else allergen_mask(["Gluten"]) for i in range(500)]
+        ivf.build(range(500), vecteurs, allergenes_mask=masks)
+        ids, _ = ivf.search(vecteurs[1], k=10, allowed=allergen_filter(allergen_mask(["Gluten"])))
+        assert sorted(ids) == list(range(0, 500, 50))
+
+    def test_upsert_after_training(self, vecteurs):
+        """Test qu'un vecteur ajouté après l'entraînement est retrouvé"""
+        ivf = IVFIndex(nlist=8, nprobe=2, min_train_size=0)
+        ivf.build(range(400), vecteurs[:400])
+        ivf.upsert(9999, vecteurs[450])
+        assert ivf.search(vecteurs[450], k=1)[0][0] == 9999
+
+class TestMMR:
+    def test_near_duplicates_are_pushed_down(self, vecteurs):
+        """Test que les quasi-doublons cèdent la place à des candidats différents"""
+        requete = vecteurs[0]
+        doublons = [requete + 0.01 * vecteurs[i] for i in range(1, 4)]
+        candidats = np.stack(doublons + [requete + 0.8 * vecteurs[10], requete + 0.8 * vecteurs[11]])
+        assert set(mmr_rerank(requete, candidats, 3, lambda_=1.0)) == {0, 1, 2}
+        diversifie = list(mmr_rerank(requete, candidats, 3, lambda_=0.3))
+        assert diversifie[0] in (0, 1, 2) and {3, 4} <= set(diversifie)
+
+    def test_lambda_one_keeps_relevance_order(self, vecteurs):
+        """Test que lambda = 1 redonne le classement par pertinence"""
+        pertinence = normalize_rows(vecteurs[:40]) @ normalize_rows(vecteurs[99])[0]
+        assert list(mmr_rerank(vecteurs[99], vecteurs[:40], 10, lambda_=1.0)) == list(np.argsort(-pertinence)[:10])
+        assert len(mmr_rerank(vecteurs[99], vecteurs[:3], 10)) == 3
+
+class TestQuantizedVectorIndex:
+    def test_int8_with_rerank_matches_exact_search(self, vecteurs):
+        """Test que le reclassement float32 redonne le top-k exact avec 4x moins de mémoire"""
+        exact = VectorIndex()
+        exact.build(range(500), vecteurs)
+        index = QuantizedVectorIndex(dtype="int8", rerank_factor=4)
+        index.build(range(500), vecteurs)
+        assert index.matrix.dtype == np.int8
+        assert index.matrix.nbytes * 4 == exact.matrix.nbytes
+        query = vecteurs[21] + 0.2
+        ids, scores = index.search(query, k=10, rerank_fn=lambda ids: vecteurs[ids])
+        attendus, scores_exacts = exact.search(query, k=10)
+        assert list(ids) == list(attendus)
+        assert np.allclose(scores, scores_exacts, atol=1e-5)
+
+    def test_search_many_reranks_like_single_search(self, vecteurs):
+        """Test que le lot reclasse en float32 comme la recherche unitaire, filtre par requête compris"""
+        index = QuantizedVectorIndex(dtype="int8", attributes=["allergenes_mask"], rerank_factor=2)
+        masks = np.array([allergen_mask(["Gluten"]) if i % 3 else 0 for i in range(500)])
+        index.build(range(500), vecteurs, allergenes_mask=masks)
+        requetes = vecteurs[:4] + 0.3
+        exclus = np.array([0, allergen_mask(["Gluten"]), 0, allergen_mask(["Gluten"])])[:, None]
+        lues = []
+        rerank = lambda ids: lues.append(len(ids)) or vecteurs[ids]
+        resultats = index.search_many(requetes, k=5, rerank_fn=rerank,
+                                      allowed=lambda v: (v.column("allergenes_mask")[None, :] & exclus) == 0)
+        assert len(lues) == 1
+        for requete, masque, (ids, scores) in zip(requetes, exclus[:, 0], resultats):
+            attendus, scores_unitaires = index.search(requete, k=5, allowed=allergen_filter(int(masque)), rerank_fn=lambda i: vecteurs[i])
+            assert list(ids) == list(attendus)
+            assert np.allclose(scores, scores_unitaires, atol=1e-5)
+
+    def test_float16_and_upsert(self, vecteurs):
+        """Test de l'index float16 et des ajouts après construction"""
+        index = QuantizedVectorIndex(dtype="float16", attributes=["allergenes_mask"])
+        index.build(range(400), vecteurs[:400], allergenes_mask=[0] * 400)
+        index.upsert(9999, vecteurs[450], allergenes_mask=0)
+        assert index.matrix.dtype == np.float16
+        assert index.search(vecteurs[450], k=1)[0][0] == 9999
+
+    def test_upsert_after_empty_build(self, vecteurs):
+        """Test qu'un index int8 construit sur un catalogue vide accepte des ajouts"""
+        index = QuantizedVectorIndex(dtype="int8")
+        index.build([], [])
+        for i, v in enumerate(vecteurs[:20]):
+            index.upsert(i, v)
+        assert index.search(vecteurs[7], k=1, rerank_fn=lambda ids: vecteurs[ids])[0][0] == 7
+
+    def test_unknown_dtype_is_rejected(self):
+        with pytest.raises(ValueError):
+            QuantizedVectorIndex(dtype="int4")
+
+class TestLexicalIndex:
+    NOMS = [(1, "Épinards à la crème"), (2, "Poutine québécoise"), (3, "Soupe aux pois"),
+            (4, "Tarte au sucre"), (5, "Crème brûlée"), (6, "Pâté chinois")]
+
+    def test_tokens_are_folded(self):
+        """Test que la casse, les accents et les pluriels simples sont ignorés"""
+        assert tokenize("Épinards À LA Crème") == tokenize("epinard a la creme")
+        assert tokenize("Choux") == ["chou"]
+
+    def test_accent_and_typo_tolerant_search(self):
+        """Test que « epinards » trouve « Épinards » et qu'une faute de frappe est tolérée"""
+        index = LexicalIndex()
+        index.build(self.NOMS)
+        assert list(index.search("epinards")[0]) == [1]
+        assert list(index.search("poutinne")[0]) == [2]
+        assert list(index.search("creme")[0]) == [5, 1]
+        assert len(index.search("sushi")[0]) == 0
+
+    def test_incremental_updates_and_filter(self):
+        """Test des ajouts, remplacements et suppressions, et du filtre par colonne"""
+        index = LexicalIndex(attributes=["allergenes_mask"])
+        masks = [allergen_mask(["Lactose"]) if "rème" in nom else 0 for _, nom in self.NOMS]
+        index.build(self.NOMS, allergenes_mask=masks)
+        filtre = allergen_filter(allergen_mask(["Lactose"]))
+        assert len(index.search("creme", allowed=filtre)[0]) == 0
+        index.upsert(7, "Crème de tomates")
+        assert list(index.search("creme", allowed=filtre)[0]) == [7]
+        assert index.remove(1)
+        index.upsert(3, "Soupe aux légumes")
+        assert list(index.search("pois")[0]) == []
+        assert list(index.search("epinards")[0]) == []
+        assert list(index.search("pate chinois")[0]) == [6]
+        assert len(index) == 6
+
+class TestPrefixIndex:
+    NOMS = [(1, "Poutine québécoise"), (2, "Pouding chômeur"), (3, "Soupe aux pois"), (4, "Pâté chinois")]
+
+    def test_prefix_matches_any_word_and_ranks_name_starts_first(self):
+        """Test que « pou » trouve les noms commençant par le préfixe avant les autres mots"""
+        index = PrefixIndex(attributes=["calories"])
+        index.build(self.NOMS + [(5, "Crème de poulet")], calories=[700, 400, 200, 500, 300])
+        assert list(index.search("POU", order_by="calories", descending=False)) == [2, 1, 5]
+        assert list(index.search("queb")) == [1]
+        assert list(index.search("pate")) == [4]
+        assert list(index.search("")) == []
+
+    def test_large_values_are_ranked_exactly(self):
+        """Test que des valeurs voisines restent départagées (pas d'arrondi flottant) dans chaque groupe"""
+        index = PrefixIndex(attributes=["popularite"])
+        index.build(self.NOMS + [(5, "Crème de poulet")], popularite=[0, 1, 0, 0, 2 ** 62])
+        assert list(index.search("pou", order_by="popularite")) == [2, 1, 5]
+        assert list(index.search("pou", order_by="popularite", descending=False)) == [1, 2, 5]
+
+    def test_incremental_updates_and_filter(self):
+        """Test des insertions à leur place dans le tableau trié et du filtre d'allergènes"""
+        index = PrefixIndex(attributes=["allergenes_mask"])
+        index.build(self.NOMS, allergenes_mask=[allergen_mask(["Lactose"]), 0, 0, 0])
+        index.upsert(6, "Pouding au pain", allergenes_mask=allergen_mask(["Gluten"]))
+        index.remove(2)
+        assert sorted(index.search("pou")) == [1, 6]
+        assert list(index.search("pou", allowed=allergen_filter(allergen_mask(["Lactose"])))) == [6]
+        assert index.value("allergenes_mask", 6) == allergen_mask(["Gluten"])
+        assert len(index) == 4
+
+class TestNutrientIndex:
+    @pytest.fixture
+    def profils(self):
+        rng = np.random.default_rng(3)
+        valeurs = rng.gamma(2.0, 20.0, (300, 5))
+        categories = ["viande" if i % 3 == 0 else "fruit" for i in range(300)]
+        return valeurs, categories
+
+    def _brute_force(self, valeurs, cible, colonnes, lignes, k):
+        z = (valeurs - valeurs.mean(axis=0)) / valeurs.std(axis=0)
+        t = (cible - valeurs.mean(axis=0)) / valeurs.std(axis=0)
+        d = np.sqrt(((z[:, colonnes] - t[colonnes]) ** 2).sum(axis=1))
+        ordre = [i for i in np.argsort(d, kind="stable") if i in lignes]
+        return ordre[:k], d
+
+    def test_nearest_matches_brute_force(self, profils):
+        """Test que les cibles partielles et le filtre de catégorie correspondent à un calcul exhaustif"""
+        valeurs, categories = profils
+        index = NutrientIndex()
+        index.build(range(1000, 1300), valeurs, categories)
+        ids, distances = index.nearest({"calories": 40.0, "proteins": 60.0}, k=5, categories=["viande"])
+        attendu, d = self._brute_force(valeurs, np.array([40.0, 60.0, 0, 0, 0]), [0, 1], set(range(0, 300, 3)), 5)
+        assert list(ids) == [1000 + i for i in attendu]
+        assert np.allclose(distances, d[attendu], atol=1e-4)
+        assert all(categories[i - 1000] == "viande" for i in ids)
+
+    def test_similar_excludes_itself_and_tracks_writes(self, profils):
+        """Test que l'aliment de référence est exclu et que les écritures sont prises en compte"""
+        valeurs, categories = profils
+        index = NutrientIndex()
+        index.build(range(300), valeurs, categories)
+        ids, _ = index.similar_to(0, k=3)
+        assert 0 not in ids
+        index.upsert(999, valeurs[0], "viande")
+        ids, distances = index.similar_to(0, k=3, categories=["viande"])
+        assert ids[0] == 999 and distances[0] == pytest.approx(0, abs=1e-5)
+        index.remove(999)
+        assert 999 not in index and 999 not in index.similar_to(0, k=300)[0]
+        with pytest.raises(ValueError):
+            index.nearest({}, k=3)
+
+    def test_drift_after_writes(self, profils):
+        """Test de la dérive des statistiques par rapport à la construction (et d'une construction à vide)"""
+        valeurs, categories = profils
+        index = NutrientIndex()
+        index.build(range(300), valeurs, categories)
+        assert index.drift() == pytest.approx(0, abs=1e-5)
+        assert index.signature == (300, 299)
+        index.upsert(300, valeurs[0], "viande")
+        assert index.drift() < 0.1
+        for i in range(301, 400):
+            index.upsert(i, valeurs[0] * 10, "viande")
+        assert index.drift() > 1
+        vide = NutrientIndex()
+        assert vide.drift() == 0 and vide.signature == (0, None)
+        vide.upsert(1, valeurs[0], "viande")
+        assert vide.drift() == float("inf")
+
+    def test_score_goals_matches_brute_force(self, profils):
+        """Test du classement par objectifs pondérés avec bornes strictes"""
+        valeurs, categories = profils
+        index = NutrientIndex()
+        index.build(range(300), valeurs, categories)
+        objectifs = {"proteins": Goal(weight=1.0), "fats": Goal(max=30), "fiber": Goal(weight=0.5, min=20)}
+        ids, scores = index.score(objectifs, k=5)
+        z = (valeurs - valeurs.mean(axis=0)) / valeurs.std(axis=0)
+        attendu = z[:, 1] + 0.5 * z[:, 4]
+        attendu[(valeurs[:, 3] > 30) | (valeurs[:, 4] < 20)] = -np.inf
+        assert list(ids) == list(np.argsort(-attendu, kind="stable")[:5])
+        assert np.allclose(scores, attendu[ids], atol=1e-4)
+        assert all(categories[i] == "fruit" for i in index.score(objectifs, k=5, categories=["fruit"])[0])
+        with pytest.raises(ValueError):
+            index.score({"sodium": Goal(weight=1.0)})
+
+class TestMealPlanner:
+    def test_week_respects_calories_allergens_and_repeats(self):
+        """Test que les 21 repas sont dans les bornes, sans allergène et sans aliment répété"""
+        rng = np.random.default_rng(5)
+        n = 2000
+        planner = MealPlanner(np.arange(1, n + 1), rng.integers(50, 900, n), rng.integers(0, 8, n), max_repetitions=1)
+        plan = planner.plan(allergy_mask=0b010, rng=np.random.default_rng(0))
+        calories = dict(zip(planner.ids.tolist(), planner.calories.tolist()))
+        masks = dict(zip(planner.ids.tolist(), planner.masks.tolist()))
+        assert len(plan) == 7 and all(len(jour) == 3 for jour in plan)
+        aliments = [i for jour in plan for repas in jour for i in repas]
+        assert len(aliments) == len(set(aliments))
+        assert not any(masks[i] & 0b010 for i in aliments)
+        for jour in plan:
+            for repas in jour:
+                assert 1 <= len(repas) <= 3
+                assert 300 <= sum(calories[i] for i in repas) <= 800
+
+    def test_small_catalogue_relaxes_repeats(self):
+        """Test qu'un petit catalogue remplit quand même tous les repas en répétant des aliments"""
+        limits = PlanLimits(min_calories_per_meal=400, max_calories_per_meal=600, max_meals_per_day=2, days_per_plan=3)
+        planner = MealPlanner([1, 2, 3, 4], [200, 250, 450, 900], [0, 0, 0, 0], limits=limits)
+        plan = planner.plan(rng=np.random.default_rng(0))
+        calories = {1: 200, 2: 250, 3: 450}
+        assert len(plan) == 3 and all(len(jour) == 2 for jour in plan)
+        for jour in plan:
+            for repas in jour:
+                assert 400 <= sum(calories[i] for i in repas) <= 600
+
+    def test_candidates_cached_per_allergy_set(self):
+        """Test du cache LRU des candidats : un calcul par ensemble d'allergies, les plus anciens évincés"""
+        planner = MealPlanner([1, 2, 3], [300, 400, 500], [allergen_mask(["Gluten"]), 0, allergen_mask(["Lactose"])])
+        planner.candidates.maxsize = 2
+        gluten = allergen_mask(["gluten"])
+        planner.plan(gluten, rng=np.random.default_rng(0))
+        planner.plan(allergen_mask(["Gluten"]), rng=np.random.default_rng(1))
+        assert (planner.candidates.hits, planner.candidates.misses) == (1, 1)
+        assert planner.ids[planner.candidates.get(gluten)[0]].tolist() == [2, 3]
+        planner.candidates.get(0)
+        planner.candidates.get(allergen_mask(["Lactose"]))
+        assert len(planner.candidates) == 2 and planner.candidates.misses == 3
+
+    def test_planner_reloaded_after_food_write(self, engine):
+        """Test que le planificateur partagé est écarté au commit (et seulement au commit) d'une écriture d'aliment"""
+        with Session(engine) as session:
+            aliment = Aliment(nom="Pâté chinois", categorie="Plat principal", calories=500)
+            session.add(aliment)
+            session.commit()
+            planner = get_planner(session)
+            assert get_planner(session) is planner and aliment.id in planner.ids
+            aliment.allergenes = ["Lactose"]
+            session.add(aliment)
+            session.commit()
+            recharge = get_planner(session)
+            assert recharge is not planner
+            assert recharge.candidates.get(allergen_mask(["Lactose"]))[0].size == 0
+            # Écriture annulée : le planificateur est conservé
+            session.add(Aliment(nom="Tourtière", categorie="Plat principal", calories=600))
+            session.flush()
+            session.rollback()
+            assert get_planner(session) is recharge
+
+    def test_planner_and_safe_rows_follow_other_worker_updates(self, engine, vecteurs, monkeypatch):
+        """Test que le planificateur et les lignes sans allergène sont recalculés après
+        la modification d'un aliment par un autre worker (sans événement ORM local)"""
+        import meal_planner
+        from sqlalchemy import update
+        monkeypatch.setattr(meal_planner, "PLAN_CATALOGUE_REFRESH_SECONDS", 0)
+        monkeypatch.setattr(search, "SEARCH_INDEX_REFRESH_SECONDS", 0)
+        gluten = allergen_mask(["Gluten"])
+        with Session(engine) as session:
+            session.add_all([Aliment(nom="Pain de mie", categorie="Boulangerie", calories=250, embedding=vecteurs[0]),
+                             Aliment(nom="Pomme", categorie="Fruit", calories=50, embedding=vecteurs[1])])
+            session.commit()
+            planner = get_planner(session)
+            assert planner.candidates.get(gluten)[0].size == 2
+            index = AlimentIndex().ensure_loaded(session)
+            assert len(index.vectors.search(vecteurs[0], k=2, allowed=search._index_filter(index, gluten))[0]) == 2
+            session.execute(update(Aliment).where(Aliment.nom == "Pain de mie").values(
+                allergenes=["Gluten"], allergenes_mask=gluten, version=Aliment.version + 1))
+            session.commit()
+            recharge = get_planner(session)
+            assert recharge is not planner and recharge.candidates.get(gluten)[0].size == 1
+            index.ensure_loaded(session)
+            assert len(index.vectors.search(vecteurs[0], k=2, allowed=search._index_filter(index, gluten))[0]) == 1
+
+    def test_limits_read_from_config(self, tmp_path):
+        """Test de la lecture des contraintes dans la section recommendations de config.yaml"""
+        config = tmp_path / "config.yaml"
+        config.write_text("recommendations:\n  max_calories_per_meal: 700\n  days_per_plan: 5\n")
+        assert load_plan_limits(str(config)) == PlanLimits(max_calories_per_meal=700, days_per_plan=5)
+        assert load_plan_limits(str(tmp_path / "absent.yaml")) == PlanLimits()
+
+class TestReciprocalRankFusion:
+    def test_items_ranked_well_in_both_lists_come_first(self):
+        """Test que la fusion favorise les éléments présents dans les deux classements"""
+        lexical = [1, 2, 3, 4]
+        semantique = [5, 3, 1, 6]
+        assert reciprocal_rank_fusion([lexical, semantique])[:2] == [1, 3]
+        assert reciprocal_rank_fusion([lexical]) == lexical
+        assert reciprocal_rank_fusion([[], []]) == []
+
+class TestAllergenMask:
+    def test_known_allergens_are_folded(self):
+        """Test que la casse, les accents et le pluriel n'influent pas sur le masque"""
+        assert allergen_mask(["Œufs"]) == allergen_mask(["oeuf"]) == allergen_mask(["Oeufs"])
+        assert allergen_mask(["Sésame", "Gluten"]) == allergen_mask(["gluten"]) | allergen_mask(["sesame"])
+        assert allergen_mask([]) == 0
+
+    def test_unknown_allergens_fit_in_bigint(self):
+        """Test que les allergènes hors liste sont hachés dans un BIGINT signé"""
+        mask = allergen_mask(["Kiwi", "Moutarde de Dijon", "Fraise"])
+        assert 0 < mask < 2 ** 63
+        assert allergen_mask(["Kiwi"]) & mask
+
+class TestAlimentIndex:
+    def test_index_follows_database(self, engine, vecteurs):
+        """Test du chargement de l'index depuis la base (aliments sans embedding ignorés)"""
+        with Session(engine) as session:
+            for i in range(3):
+                session.add(Aliment(nom=f"Aliment {i}", categorie="Test", calories=100, embedding=vecteurs[i]))
+            session.add(Aliment(nom="Sans embedding", categorie="Test", calories=100))
+            session.commit()
+
+            index = AlimentIndex()
+            index.ensure_loaded(session)
+            assert len(index.vectors) == 3
+
+            ids, _ = index.vectors.search(vecteurs[2], k=1)
+            assert [a.nom for a in get_aliments_ordered(session, ids)] == ["Aliment 2"]
+
+    def test_indexes_reloaded_after_other_worker_updates(self, engine, vecteurs, monkeypatch):
+        """Test qu'une modification faite par un autre worker (même nombre de lignes, même id maximal)
+        est vue grâce à la somme des versions"""
+        from sqlalchemy import update
+        monkeypatch.setattr(search, "SEARCH_INDEX_REFRESH_SECONDS", 0)
+        with Session(engine) as session:
+            session.add_all([Aliment(nom="Pain de mie", categorie="Boulangerie", calories=250, embedding=vecteurs[0]),
+                             Aliment(nom="Pomme", categorie="Fruit", calories=50, embedding=vecteurs[1])])
+            session.commit()
+            index, lexical = AlimentIndex().ensure_loaded(session), LexicalAliment().ensure_loaded(session)
+            assert index.vectors.column("version").tolist() == [0, 0]
+            # Écriture d'un autre worker : son hook before_update a incrémenté la version
+            session.execute(update(Aliment).where(Aliment.nom == "Pain de mie").values(
+                allergenes=["Gluten"], allergenes_mask=allergen_mask(["Gluten"]), version=Aliment.version + 1))
+            session.commit()
+            gluten = allergen_filter(allergen_mask(["Gluten"]))
+            assert len(index.ensure_loaded(session).vectors.search(vecteurs[0], k=2, allowed=gluten)[0]) == 1
+            assert list(lexical.ensure_loaded(session).index.search("pain", allowed=gluten)[0]) == []
+
+    def test_indexes_follow_committed_writes_only(self, engine, vecteurs):
+        """Test que les index en mémoire ne voient une écriture qu'après le commit (rollback sans id fantôme)"""
+        with Session(engine) as session:
+            pomme = Aliment(nom="Pomme", categorie="Fruit", calories=50, embedding=vecteurs[0])
+            session.add(pomme)
+            session.commit()
+            index, lexical = AlimentIndex(), LexicalAliment()
+            search._indexes[str(engine.url)], search._lexical_indexes[str(engine.url)] = index, lexical
+            index.ensure_loaded(session), lexical.ensure_loaded(session)
+            try:
+                poire = Aliment(nom="Poire", categorie="Fruit", calories=60, embedding=vecteurs[1])
+                session.add(poire)
+                session.flush()
+                poire_id = poire.id
+                assert poire_id not in index.vectors
+                session.rollback()
+                session.delete(session.get(Aliment, pomme.id))
+                session.flush()
+                session.rollback()
+                assert list(index.vectors.ids) == [pomme.id] and list(lexical.index.ids) == [pomme.id]
+                session.add(Aliment(nom="Poire", categorie="Fruit", calories=60, embedding=vecteurs[1]))
+                session.commit()
+                assert len(index.vectors) == 2 and lexical.index.search("poire")[0].size == 1
+            finally:
+                search._indexes.pop(str(engine.url)), search._lexical_indexes.pop(str(engine.url))
+
+    def test_allergen_mask_is_maintained_on_write(self, engine, vecteurs):
+        """Test que le masque d'allergènes est recalculé à l'insertion et à la mise à jour"""
+        with Session(engine) as session:
+            aliment = Aliment(nom="Poutine", categorie="Plat principal", calories=700, allergenes=["Lactose"])
+            session.add(aliment)
+            session.commit()
+            assert aliment.allergenes_mask == allergen_mask(["Lactose"])
+            aliment.allergenes = ["Lactose", "Gluten"]
+            session.add(aliment)
+            session.commit()
+            session.refresh(aliment)
+            assert aliment.allergenes_mask == allergen_mask(["Lactose", "Gluten"])
+            assert aliment.version == 1
+
+    def test_allergen_masks_backfilled_after_bulk_writes(self, engine):
+        """Test que les masques des lignes écrites hors ORM sont recalculés et pris en compte par l'index"""
+        from sqlalchemy import insert
+        from services import backfill_allergenes_masks
+        with Session(engine) as session:
+            session.execute(insert(Aliment), [
+                {"nom": "Poutine", "categorie": "Plat principal", "calories": 700, "allergenes": ["Lactose"]},
+                {"nom": "Pomme", "categorie": "Fruit", "calories": 50, "allergenes": []},
+            ])
+            session.commit()
+            assert session.exec(select(Aliment.allergenes_mask)).all() == [0, 0]
+            assert backfill_allergenes_masks(session) == 1
+            assert backfill_allergenes_masks(session) == 0
+            poutine = session.exec(select(Aliment).where(Aliment.nom == "Poutine")).one()
+            assert poutine.allergenes_mask == allergen_mask(["Lactose"])
+            planner = get_planner(session)
+            rows, _ = planner.candidates.get(allergen_mask(["Lactose"]))
+            assert [int(planner.ids[i]) for i in rows] == [poutine.id + 1]
+
+    def test_lexical_index_follows_database(self, engine):
+        """Test de la recherche par nom sur l'index lexical chargé depuis la base"""
+        with Session(engine) as session:
+            session.add(Aliment(nom="Épinards à la crème", categorie="Accompagnement", calories=150, allergenes=["Lactose"]))
+            session.add(Aliment(nom="Épinards sautés", categorie="Accompagnement", calories=80))
+            session.commit()
+
+            index = LexicalAliment().ensure_loaded(session)
+            ids, _ = index.index.search("epinards", allowed=allergen_filter(allergen_mask(["Lactose"])))
+            assert [a.nom for a in get_aliments_ordered(session, ids)] == ["Épinards sautés"]
+
+    def test_recommendations_apply_constraints_before_top_k(self, engine):
+        """Test que les recommandations restent complètes quand les meilleurs candidats sont exclus"""
+        from embedding import embedding_service
+        from search import get_aliment_index
+        from services import recommend_aliments
+        get_aliment_index(engine).invalidate()
+        with Session(engine) as session:
+            # Les 30 aliments les plus proches de la requête sont trop caloriques ou allergènes
+            for i in range(30):
+                nom = f"Soupe aux pois {i}"
+                session.add(Aliment(nom=nom, categorie="Soupe", calories=900 if i % 2 else 300,
+                                    allergenes=[] if i % 2 else ["Gluten"], embedding=embedding_service.embed(nom)))
+            for i in range(15):
+                nom = f"Salade verte {i}"
+                session.add(Aliment(nom=nom, categorie="Entrée", calories=150, embedding=embedding_service.embed(nom)))
+            session.commit()
+
+            aliments = recommend_aliments(session, "soupe aux pois", ["Gluten"], max_calories=800)
+            assert len(aliments) == 10
+            assert all(a.calories <= 800 and "Gluten" not in a.allergenes for a in aliments)
+
+    def test_allergen_safe_rows_follow_writes(self, engine):
+        """Test que les lignes sans allergène en cache sont recalculées après la modification d'un aliment"""
+        from embedding import embedding_service
+        from search import get_aliment_index
+        from services import recommend_aliments
+        get_aliment_index(engine).invalidate()
+        with Session(engine) as session:
+            aliments = [Aliment(nom=f"Tarte au sucre {i}", categorie="Dessert", calories=400,
+                                embedding=embedding_service.embed(f"Tarte au sucre {i}")) for i in range(3)]
+            session.add_all(aliments)
+            session.commit()
+            assert len(recommend_aliments(session, "tarte au sucre", ["Gluten"])) == 3
+            index = get_aliment_index(engine)
+            assert len(index.safe_rows) == 1
+            version = index.vectors.version
+            aliments[0].allergenes = ["Gluten"]
+            session.add(aliments[0])
+            session.commit()
+            # Entrée calculée pour l'ancienne version : écartée à la lecture, sous le verrou de l'index
+            assert index.vectors.version > version
+            assert index.safe_rows.get(allergen_mask(["Gluten"]))[0] == version
+            assert aliments[0].id not in [a.id for a in recommend_aliments(session, "tarte au sucre", ["Gluten"])]
+
+class TestSimilarites:
+    def _graph(self, session):
+        from models import AlimentSimilaire
+        rows = session.exec(select(AlimentSimilaire.aliment_id, AlimentSimilaire.similaire_id, AlimentSimilaire.score)).all()
+        return {(a, b): round(score, 4) for a, b, score in rows}
+
+    def test_incremental_updates_match_rebuild(self, engine, vecteurs):
+        """Test qu'après création et modification d'aliments, le graphe égale une reconstruction complète"""
+        from search import get_aliment_index
+        get_aliment_index(engine).invalidate()
+        with Session(engine) as session:
+            aliments = [Aliment(nom=f"Aliment {i}", categorie="Test", calories=100, embedding=vecteurs[i]) for i in range(60)]
+            session.add_all(aliments)
+            session.commit()
+            build_similarites(session, k=5)
+            voisins = get_aliments_similaires(session, aliments[0].id, limit=5)
+            attendu = np.argsort(-(normalize_rows(vecteurs[:60]) @ normalize_rows(vecteurs[0])[0]))[1:6]
+            assert [a.nom for a in voisins] == [f"Aliment {i}" for i in attendu]
+
+            nouveau = Aliment(nom="Nouveau", categorie="Test", calories=100, embedding=vecteurs[0] + 0.01)
+            session.add(nouveau)
+            session.commit()
+            update_similarites(session, [nouveau.id], k=5)
+            assert get_aliments_similaires(session, aliments[0].id, limit=1)[0].id == nouveau.id
+            aliments[int(attendu[0])].embedding = vecteurs[200]
+            session.add(aliments[int(attendu[0])])
+            session.commit()
+            update_similarites(session, [aliments[int(attendu[0])].id], k=5)
+            incremental = self._graph(session)
+            build_similarites(session, k=5)
+            assert incremental == self._graph(session)
+
+class TestPgvectorQuery:
+    def test_query_uses_bound_parameters(self):
+        """Test que la requête pgvector ne contient ni vecteur ni LIMIT littéraux"""
+        from sqlalchemy.dialects import postgresql
+        sql = str(PGVECTOR_SEARCH.compile(dialect=postgresql.dialect()))
+        assert sql.count("<#> %(query_embedding)s") == 1
+        assert "LIMIT %(top_k)s" in sql
+        assert "allergenes_mask & %(mask)s" in sql
+        assert "calories <= %(max_calories)s" in sql
+        assert "aliment.embedding," not in sql
+        # Candidats retriés par distance (ordre approximatif avec iterative_scan = relaxed_order)
+        assert "AS MATERIALIZED" in sql
+        assert sql.endswith("ORDER BY candidats.distance")
+
+    def test_vector_bound_as_array_with_psycopg3(self):
+        """Test que le vecteur est transmis en tableau numpy (dumper binaire) avec psycopg 3"""
+        from sqlalchemy import create_engine as sa_create_engine
+        from models import EmbeddingVector
+        dialect = sa_create_engine("postgresql+psycopg://u:p@localhost/db").dialect
+        process = EmbeddingVector(3).bind_processor(dialect)
+        assert isinstance(process([1, 2, 3]), np.ndarray)
@@ -0,0 +1,22 @@
+import json
+import unicodedata
+from typing import List
+
+def normalize_text(text: str) -> str:
+    """Normaliser un texte pour la comparaison : minuscules, sans accents, espaces réduits"""
+    # œ et æ ne se décomposent pas en NFKD
+    text = text.casefold().replace("œ", "oe").replace("æ", "ae")
+    decomposed = unicodedata.normalize("NFKD", text)
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(folded.split())
+
+def parse_allergenes(value) -> List[str]:
+    """Lire une liste d'allergènes stockée en liste JSON ou en chaîne JSON (version simple)"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return [value]
+    return list(value)
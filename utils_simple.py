@@ -2,6 +2,7 @@ import json
 import os
 from sqlmodel import Session, select
 from models import Aliment
+from embedding import embedding_service
 
 def load_initial_data(session: Session, data_path: str = "data/repas_canadiens.json"):
     if not os.path.exists(data_path):
@@ -9,16 +10,28 @@ def load_initial_data(session: Session, data_path: str = "data/repas_canadiens.j
         return
     with open(data_path, "r", encoding="utf-8") as f:
         aliments = json.load(f)
+    existants = set(session.exec(select(Aliment.nom)).all())
+    nouveaux = []
     for aliment in aliments:
         # Vérifier si l'aliment existe déjà
-        existing = session.exec(select(Aliment).where(Aliment.nom == aliment["nom"])).first()
-        if not existing:
-            session.add(Aliment(
-                nom=aliment["nom"],
-                categorie=aliment["categorie"],
-                calories=aliment["calories"],
-                allergenes=json.dumps(aliment["allergenes"]),  # Convertir en JSON string
-                image_url=aliment["image_url"]
-            ))
+        if aliment["nom"] not in existants:
+            existants.add(aliment["nom"])
+            nouveaux.append(aliment)
+    # Embeddings des nouveaux aliments en un seul lot (calculés plus tard par le backfill si le modèle manque)
+    try:
+        vecteurs = embedding_service.embed_many([aliment["nom"] for aliment in nouveaux])
+    except (ImportError, OSError) as e:
+        print(f"⚠️ Embeddings non calculés ({e}) : lancer scripts/backfill_embeddings.py")
+        vecteurs = [None] * len(nouveaux)
+    for aliment, vecteur in zip(nouveaux, vecteurs):
+        session.add(Aliment(
+            nom=aliment["nom"],
+            categorie=aliment["categorie"],
+            calories=aliment["calories"],
+            allergenes=json.dumps(aliment["allergenes"]),  # Convertir en JSON string
+            image_url=aliment["image_url"],
+            embedding=vecteur,
+            embedding_nom=aliment["nom"] if vecteur is not None else None,
+        ))
     session.commit()
     print(f"✅ {len(aliments)} aliments chargés dans la base de données") 
\ No newline at end of file
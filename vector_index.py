@@ -0,0 +1,436 @@
+import numpy as np
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+def normalize_rows(vectors) -> np.ndarray:
+    """Normaliser les lignes (norme L2) dans une matrice float32 contiguë"""
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices des k meilleurs scores, triés par score décroissant (argpartition + tri du top-k)"""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def mmr_rerank(query, candidates, k: int, lambda_: float = 0.7) -> np.ndarray:
+    """Réordonner des candidats par pertinence marginale maximale (MMR).
+
+    À chaque étape, le candidat retenu maximise
+    lambda_ * sim(requête, c) - (1 - lambda_) * max sim(c, déjà retenus).
+    Les similarités requête-candidats et candidats-candidats sont calculées
+    en deux produits matriciels ; chaque étape met à jour le vecteur des
+    similarités maximales en une opération. Retourne les indices (dans
+    `candidates`) des k candidats retenus, dans l'ordre de sélection.
+    """
+    matrix = normalize_rows(candidates)
+    n = matrix.shape[0] if len(candidates) else 0
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    relevance = matrix @ normalize_rows(query)[0]
+    similarities = matrix @ matrix.T
+    chosen = np.empty(k, dtype=np.int64)
+    chosen[0] = int(np.argmax(relevance))
+    available = np.ones(n, dtype=bool)
+    available[chosen[0]] = False
+    redundancy = similarities[chosen[0]].copy()
+    for step in range(1, k):
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        chosen[step] = best
+        available[best] = False
+        np.maximum(redundancy, similarities[best], out=redundancy)
+    return chosen
+
+class VectorIndex:
+    """Index vectoriel exact en mémoire, indépendant de la base de données.
+
+    Les embeddings sont conservés normalisés dans une matrice float32
+    contiguë (une ligne par aliment) : la similarité cosinus avec une
+    requête se calcule en un seul produit matrice-vecteur et le top-k est
+    extrait par argpartition. La matrice est surdimensionnée pour que les
+    insertions successives restent en O(1) amorti.
+
+    Des attributs numériques par ligne (`attributes`, ex. masque
+    d'allergènes) sont stockés en colonnes alignées sur la matrice, ce qui
+    permet de filtrer les candidats avant l'extraction du top-k.
+    """
+
+    def __init__(self, dim: Optional[int] = None, attributes: Iterable[str] = ()):
+        self.dim = dim
+        self._matrix = np.zeros((0, dim or 0), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._columns: Dict[str, np.ndarray] = {name: np.zeros(0, dtype=np.int64) for name in attributes}
+        self._positions = {}
+        self._size = 0
+        # Incrémenté sous le verrou à chaque écriture : les caches dérivés des colonnes s'y comparent
+        self.version = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._positions
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix[:self._size]
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.ids.nbytes + sum(self.column(name).nbytes for name in self._columns)
+
+    def column(self, name: str) -> np.ndarray:
+        """Valeurs d'un attribut, alignées sur les lignes de la matrice"""
+        return self._columns[name][:self._size]
+
+    def build(self, ids: Iterable[int], vectors, **attributes) -> None:
+        """Reconstruire l'index à partir de zéro"""
+        ids = np.asarray(list(ids), dtype=np.int64)
+        matrix = normalize_rows(vectors) if len(ids) else np.zeros((0, self.dim or 0), dtype=np.float32)
+        with self._lock:
+            if len(ids):
+                self.dim = matrix.shape[1]
+            self._matrix = self._encode(matrix, fit=True)
+            self._ids = ids
+            for name in self._columns:
+                values = attributes.get(name)
+                self._columns[name] = np.asarray(values if values is not None else np.zeros(len(ids)), dtype=np.int64)
+            self._size = len(ids)
+            self._positions = {int(item_id): row for row, item_id in enumerate(ids)}
+            self.version += 1
+
+    def _grow(self, capacity: int) -> None:
+        matrix = np.zeros((capacity, self.dim), dtype=self._matrix.dtype)
+        ids = np.zeros(capacity, dtype=np.int64)
+        if self._size:
+            matrix[:self._size] = self._matrix[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._ids = matrix, ids
+        for name, values in self._columns.items():
+            grown = np.zeros(capacity, dtype=values.dtype)
+            grown[:self._size] = values[:self._size]
+            self._columns[name] = grown
+
+    def upsert(self, item_id: int, vector, **attributes) -> None:
+        """Ajouter ou remplacer le vecteur d'un élément"""
+        item_id = int(item_id)
+        row_vector = normalize_rows(vector)[0]
+        with self._lock:
+            if self.dim is None or self._size == 0:
+                self.dim = row_vector.shape[0]
+            if row_vector.shape[0] != self.dim:
+                raise ValueError(f"Dimension {row_vector.shape[0]} incompatible avec l'index ({self.dim})")
+            row = self._positions.get(item_id)
+            if row is None:
+                if self._size == self._matrix.shape[0] or self._matrix.shape[1] != self.dim:
+                    self._grow(max(16, 2 * self._size))
+                row = self._size
+                self._ids[row] = item_id
+                self._positions[item_id] = row
+                self._size += 1
+            self._matrix[row] = self._encode(row_vector)
+            for name, values in self._columns.items():
+                values[row] = attributes.get(name, 0)
+            self.version += 1
+
+    def remove(self, item_id: int) -> bool:
+        """Retirer un élément (la dernière ligne prend sa place)"""
+        with self._lock:
+            row = self._positions.pop(int(item_id), None)
+            if row is None:
+                return False
+            last = self._size - 1
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = self._ids[last]
+                for values in self._columns.values():
+                    values[row] = values[last]
+                self._positions[int(self._ids[row])] = row
+            self._size = last
+            self.version += 1
+            return True
+
+    def _encode(self, vectors: np.ndarray, fit: bool = False) -> np.ndarray:
+        """Représentation stockée de vecteurs normalisés (float32 pour l'index exact)"""
+        return vectors
+
+    def _decode(self, rows: np.ndarray) -> np.ndarray:
+        """Vecteurs float32 (normalisés) d'une représentation stockée"""
+        return rows
+
+    def vectors(self, ids) -> np.ndarray:
+        """Vecteurs normalisés des éléments `ids`, dans le même ordre (approchés si l'index est compressé)"""
+        with self._lock:
+            rows = [self._positions[int(item_id)] for item_id in ids]
+            return self._decode(self._matrix[rows]).astype(np.float32, copy=False)
+
+    def scores(self, query) -> np.ndarray:
+        """Similarité cosinus de la requête avec chaque élément"""
+        q = normalize_rows(query)[0]
+        return self.matrix @ q
+
+    def search(self, query, k: int = 10, allowed: Union[np.ndarray, Callable[["VectorIndex"], np.ndarray], None] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Retourner (ids, scores) des k éléments les plus proches.
+
+        `allowed` est un masque booléen par ligne (ou une fonction de l'index
+        qui le calcule, évaluée sous le verrou) : les lignes exclues sont
+        écartées avant l'extraction du top-k, si bien que le résultat contient
+        k éléments autorisés dès qu'il en existe au moins k.
+        """
+        with self._lock:
+            if self._size == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            scores = self.scores(query)
+            if callable(allowed):
+                allowed = allowed(self)
+            if allowed is not None:
+                k = min(k, int(np.count_nonzero(allowed)))
+                scores[~allowed] = -np.inf
+            best = top_k_indices(scores, k)
+            return self.ids[best].copy(), scores[best]
+
+    def scores_many(self, queries: np.ndarray) -> np.ndarray:
+        """Similarités (m, n) de requêtes déjà normalisées avec chaque élément"""
+        return queries @ self.matrix.T
+
+    def search_many(self, queries, k: int = 10, allowed=None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Top-k de plusieurs requêtes en un seul produit matriciel.
+
+        `allowed` est un masque commun (n,) ou propre à chaque requête
+        (m, n), ou une fonction de l'index qui le calcule. La matrice des
+        scores fait m x n flottants : les appelants découpent les gros lots.
+        """
+        queries = normalize_rows(queries)
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        with self._lock:
+            if self._size == 0:
+                return [empty] * len(queries)
+            scores = self.scores_many(queries)
+            limits = np.full(len(queries), min(k, self._size))
+            if callable(allowed):
+                allowed = allowed(self)
+            if allowed is not None:
+                allowed = np.broadcast_to(allowed, scores.shape)
+                scores[~allowed] = -np.inf
+                limits = np.minimum(limits, np.count_nonzero(allowed, axis=1))
+            kk = min(k, self._size)
+            if kk < self._size:
+                top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+            else:
+                top = np.broadcast_to(np.arange(self._size), scores.shape)
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            ids = self.ids
+            return [(ids[top[i, :limits[i]]].copy(), top_scores[i, :limits[i]]) for i in range(len(queries))]
+
+
+class IVFIndex(VectorIndex):
+    """Index approximatif à listes inversées (IVF) pour les grands catalogues.
+
+    Les vecteurs sont répartis entre `nlist` centroïdes appris par k-means
+    sphérique ; une requête ne compare que les lignes des `nprobe` listes
+    les plus proches. `nprobe` règle le compromis rappel / latence
+    (nprobe = nlist revient à la recherche exacte). En dessous de
+    `min_train_size` vecteurs, l'index se comporte comme l'index exact.
+    """
+
+    def __init__(self, dim: Optional[int] = None, attributes: Iterable[str] = (), nlist: Optional[int] = None,
+                 nprobe: int = 8, min_train_size: int = 4096, kmeans_iterations: int = 10, seed: int = 0):
+        super().__init__(dim, list(attributes) + ["_cluster"])
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def build(self, ids: Iterable[int], vectors, **attributes) -> None:
+        with self._lock:
+            super().build(ids, vectors, **attributes)
+            self.centroids = None
+            if self._size >= self.min_train_size:
+                self.train()
+
+    def train(self) -> None:
+        """Apprendre les centroïdes (k-means sphérique sur un échantillon) et affecter chaque ligne"""
+        matrix = self.matrix
+        nlist = self.nlist or max(1, int(np.sqrt(self._size)))
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(self._size, 32 * nlist)
+        sample = matrix[rng.choice(self._size, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            # Somme des points de chaque liste : tri par liste puis réduction par segments
+            counts = np.bincount(assign, minlength=nlist)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            filled = counts > 0
+            sums = np.zeros_like(centroids)
+            sums[filled] = np.add.reduceat(sample[np.argsort(assign, kind="stable")], starts[filled], axis=0)
+            # Une liste vide reçoit un point tiré au hasard
+            sums[~filled] = sample[rng.choice(sample_size, int((~filled).sum()))]
+            centroids = normalize_rows(sums)
+        self.centroids = centroids
+        self._columns["_cluster"][:self._size] = self._assign(matrix)
+
+    def _assign(self, matrix: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        return np.concatenate([
+            np.argmax(matrix[start:start + chunk] @ self.centroids.T, axis=1)
+            for start in range(0, matrix.shape[0], chunk)
+        ]) if matrix.shape[0] else np.zeros(0, dtype=np.int64)
+
+    def upsert(self, item_id: int, vector, **attributes) -> None:
+        if self.centroids is not None:
+            attributes["_cluster"] = int(self._assign(normalize_rows(vector))[0])
+        super().upsert(item_id, vector, **attributes)
+        if self.centroids is None and self._size >= self.min_train_size:
+            with self._lock:
+                self.train()
+
+    def search(self, query, k: int = 10, allowed=None, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            if self.centroids is None:
+                return super().search(query, k, allowed)
+            q = normalize_rows(query)[0]
+            if callable(allowed):
+                allowed = allowed(self)
+            nlist = self.centroids.shape[0]
+            probes = np.argsort(-(self.centroids @ q))
+            clusters = self.column("_cluster")
+            nprobe = min(nprobe or self.nprobe, nlist)
+            # Élargir la sonde tant que les listes visitées ne fournissent pas k candidats autorisés
+            while True:
+                selected = np.zeros(nlist, dtype=bool)
+                selected[probes[:nprobe]] = True
+                candidates = selected[clusters]
+                if allowed is not None:
+                    candidates &= allowed
+                rows = np.flatnonzero(candidates)
+                if len(rows) >= k or nprobe >= nlist:
+                    break
+                nprobe = min(2 * nprobe, nlist)
+            scores = self._matrix[rows] @ q
+            best = top_k_indices(scores, k)
+            return self.ids[rows[best]].copy(), scores[best]
+
+    def search_many(self, queries, k: int = 10, allowed=None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Une recherche IVF par requête (les listes sondées diffèrent d'une requête à l'autre)"""
+        with self._lock:
+            if self.centroids is None:
+                return super().search_many(queries, k, allowed)
+            if callable(allowed):
+                allowed = allowed(self)
+            queries = normalize_rows(queries)
+            if allowed is not None:
+                allowed = np.broadcast_to(allowed, (len(queries), self._size))
+            return [self.search(q, k, None if allowed is None else allowed[i]) for i, q in enumerate(queries)]
+
+class QuantizedVectorIndex(VectorIndex):
+    """Index exact stockant des vecteurs compressés en int8 ou float16.
+
+    Le premier passage calcule des scores approchés sur la matrice compacte
+    (par blocs convertis en float32, pour borner la mémoire temporaire) ;
+    les `rerank_factor * k` meilleurs candidats sont ensuite reclassés avec
+    leurs vecteurs float32 exacts fournis par `rerank_fn` (lus en base).
+
+    En int8, chaque dimension a son pas de quantification (max |x| / 127),
+    replié dans la requête : score ≈ codes @ (pas * q).
+    """
+
+    def __init__(self, dim: Optional[int] = None, attributes: Iterable[str] = (), dtype: str = "int8",
+                 rerank_factor: int = 4, chunk_size: int = 65536):
+        if dtype not in ("int8", "float16"):
+            raise ValueError(f"Quantification non supportée: {dtype}")
+        super().__init__(dim, attributes)
+        self._matrix = np.zeros((0, dim or 0), dtype=dtype)
+        self.rerank_factor = rerank_factor
+        self.chunk_size = chunk_size
+        self.steps: Optional[np.ndarray] = None
+
+    def _encode(self, vectors: np.ndarray, fit: bool = False) -> np.ndarray:
+        if self._matrix.dtype == np.float16:
+            return vectors.astype(np.float16)
+        if fit and vectors.ndim == 2 and len(vectors):
+            self.steps = np.maximum(np.abs(vectors).max(axis=0), 1e-6).astype(np.float32) / 127
+        elif fit:
+            # Index vide : pas fixés au premier vecteur ajouté (dimension encore inconnue)
+            self.steps = None
+            return np.zeros(vectors.shape, dtype=np.int8)
+        elif self.steps is None:
+            self.steps = np.full(vectors.shape[-1], 1 / 127, dtype=np.float32)
+        return np.clip(np.rint(vectors / self.steps), -127, 127).astype(np.int8)
+
+    def _decode(self, rows: np.ndarray) -> np.ndarray:
+        if self._matrix.dtype == np.int8:
+            return rows.astype(np.float32) * self.steps
+        return rows.astype(np.float32)
+
+    def scores(self, query) -> np.ndarray:
+        q = normalize_rows(query)[0]
+        if self.steps is not None and self._matrix.dtype == np.int8:
+            q = q * self.steps
+        codes = self.matrix
+        scores = np.empty(self._size, dtype=np.float32)
+        for start in range(0, self._size, self.chunk_size):
+            scores[start:start + self.chunk_size] = codes[start:start + self.chunk_size].astype(np.float32) @ q
+        return scores
+
+    def scores_many(self, queries: np.ndarray) -> np.ndarray:
+        if self.steps is not None and self._matrix.dtype == np.int8:
+            queries = queries * self.steps
+        codes = self.matrix
+        scores = np.empty((len(queries), self._size), dtype=np.float32)
+        for start in range(0, self._size, self.chunk_size):
+            scores[:, start:start + self.chunk_size] = queries @ codes[start:start + self.chunk_size].astype(np.float32).T
+        return scores
+
+    def search(self, query, k: int = 10, allowed=None, rerank_fn=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k approché puis, si `rerank_fn(ids)` est fourni, reclassement exact en float32"""
+        if rerank_fn is None:
+            return super().search(query, k, allowed)
+        ids, _ = super().search(query, k * self.rerank_factor, allowed)
+        if len(ids) == 0:
+            return ids, np.empty(0, dtype=np.float32)
+        exact = normalize_rows(rerank_fn(ids)) @ normalize_rows(query)[0]
+        best = top_k_indices(exact, k)
+        return ids[best], exact[best]
+
+    def search_many(self, queries, k: int = 10, allowed=None, rerank_fn=None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Top-k approchés de plusieurs requêtes puis, si `rerank_fn(ids)` est fourni, le même reclassement
+        exact que `search` (vecteurs float32 des candidats de tout le lot lus en un seul appel)"""
+        if rerank_fn is None:
+            return super().search_many(queries, k, allowed)
+        results = super().search_many(queries, k * self.rerank_factor, allowed)
+        candidates = np.unique(np.concatenate([ids for ids, _ in results])) if results else np.empty(0, dtype=np.int64)
+        if len(candidates) == 0:
+            return [(ids, np.empty(0, dtype=np.float32)) for ids, _ in results]
+        exact_vectors = normalize_rows(rerank_fn(candidates))
+        reranked = []
+        for query, (ids, _) in zip(normalize_rows(queries), results):
+            exact = exact_vectors[np.searchsorted(candidates, ids)] @ query
+            best = top_k_indices(exact, k)
+            reranked.append((ids[best], exact[best]))
+        return reranked